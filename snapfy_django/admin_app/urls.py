@@ -17,4 +17,5 @@ urlpatterns = [
     path('list-analytics-reports/', views.list_analytics_reports, name='list_analytics_reports'),
     path('music-tracks/', views.music_track_list, name='music_track_list'),
     path('music-tracks/<int:track_id>/', views.music_track_detail, name='music_track_detail'),
+    path('redis-pool-stats/', views.redis_pool_stats, name='redis_pool_stats'),
 ]
\ No newline at end of file
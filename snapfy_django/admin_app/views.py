@@ -6,6 +6,7 @@ from rest_framework.permissions import IsAuthenticated
 from .models import AnalyticsReport, AdminActionLog, UserStatistics
 from user_app.models import User, Report 
 from story_app.models import MusicTrack
+from snapfy_django.redis_pool import pool_metrics
 from post_app.models import *
 from .serializers import MusicTrackSerializer
 from django.db.models import Count
@@ -1209,4 +1210,10 @@ def music_track_detail(request, track_id):
 
     elif request.method == 'DELETE':
         track.delete()
-        return Response({"message": "Music track deleted"}, status=status.HTTP_204_NO_CONTENT)
\ No newline at end of file
+        return Response({"message": "Music track deleted"}, status=status.HTTP_204_NO_CONTENT)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, IsAdminUser])
+def redis_pool_stats(request):
+    """Size and wait-time metrics of the async Redis pool(s) used by websocket consumers"""
+    return Response({'pools': pool_metrics()})
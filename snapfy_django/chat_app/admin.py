@@ -1,7 +1,8 @@
 from django.contrib import admin
-from .models import ChatRoom, Message, CallLog
+from .models import ChatRoom, Message, CallLog, MessageArchive
 # Register your models here.
 
 admin.site.register(ChatRoom)
 admin.site.register(Message)
-admin.site.register(CallLog)
\ No newline at end of file
+admin.site.register(CallLog)
+admin.site.register(MessageArchive)
@@ -0,0 +1,238 @@
+# chat_app/archive.py
+import os
+import gzip
+import json
+import logging
+from django.conf import settings
+from django.core import serializers
+from django.db import connection, models, transaction
+from django.db.models import F
+from django.utils import timezone
+from user_app.models import User
+from .models import Message, MessageArchive, ArchivePurge
+from .partitions import (
+    month_start, add_months, month_bounds, partition_name, attached_months, detach_partition, drop_table,
+)
+
+logger = logging.getLogger(__name__)
+
+# Months older than MESSAGE_HOT_MONTHS leave chat_app_message and go cold in two steps:
+#   archive_month   detaches the month's partition; its rows stay in Postgres as a standalone table
+#   export_archive  writes that table to MESSAGE_ARCHIVE_ROOT/<YYYY-MM>/<room_id>.jsonl.gz and drops it
+# A MessageArchive row per cold month tells message_history where to read through to.
+# Exports use Django's jsonl serializer and keep the ciphertext; they are decrypted with the room key like live ones.
+# Deleting a room or user cannot cascade into cold months, so chat_app.signals purges them: rows in detached
+# tables go in the deleting transaction, a room's export files once it commits, and a user's messages are
+# queued as an ArchivePurge for manage_message_partitions to rewrite out of the export files.
+EXPORT_BATCH_SIZE = 2000
+
+
+def load_messages(lines):
+    """Unsaved Messages rebuilt from exported lines; never save() them, their month is gone from the table.
+    Columns dropped since the export (e.g. is_read) are skipped."""
+    return [deserialized.object for deserialized in serializers.deserialize('jsonl', lines, ignorenonexistent=True)]
+
+
+def archive_month(month):
+    """Detach a month's partition from chat_app_message. Nothing is lost: the table stays, recorded
+    in MessageArchive, and history reads keep reaching it."""
+    start, end = month_bounds(month)
+    count = Message.objects.filter(sent_at__gte=start, sent_at__lt=end).count()
+    with transaction.atomic():
+        detach_partition(month)
+        archive, _ = MessageArchive.objects.update_or_create(
+            month=month,
+            defaults={"table_name": partition_name(month), "path": "", "message_count": count},
+        )
+    logger.info(f"Detached {count} messages for {month:%Y-%m}")
+    return archive
+
+
+def export_archive(archive):
+    """Write a detached month to one gzipped JSON-lines file per room, then drop the table.
+    Safe to rerun: files are rewritten and the table is only dropped once every file is closed."""
+    directory = os.path.join(settings.MESSAGE_ARCHIVE_ROOT, f"{archive.month:%Y-%m}")
+    os.makedirs(directory, exist_ok=True)
+    rows = Message.objects.raw(f'SELECT * FROM "{archive.table_name}" ORDER BY room_id, sent_at, id')
+    count, room_id, out = 0, None, None
+    try:
+        for message in rows.iterator(chunk_size=EXPORT_BATCH_SIZE):
+            if message.room_id != room_id:
+                if out:
+                    out.close()
+                room_id = message.room_id
+                out = gzip.open(os.path.join(directory, f"{room_id}.jsonl.gz"), 'wt', encoding='utf-8')
+            out.write(serializers.serialize('jsonl', [message]))
+            count += 1
+    finally:
+        if out:
+            out.close()
+
+    with transaction.atomic():
+        drop_table(archive.table_name)
+        archive.table_name, archive.path, archive.message_count = "", directory, count
+        archive.save(update_fields=['table_name', 'path', 'message_count'])
+    logger.info(f"Exported {count} messages for {archive.month:%Y-%m} to {directory}")
+    return count
+
+
+def read_archive(archive, room_id, before, limit):
+    """Up to `limit` messages of a room from one cold month, newest first, older than the (sent_at, id) `before`."""
+    if archive.table_name:
+        return list(Message.objects.raw(
+            f'SELECT * FROM "{archive.table_name}" WHERE room_id = %s AND (sent_at, id) < (%s, %s) '
+            f'ORDER BY sent_at DESC, id DESC LIMIT %s',
+            [room_id, before[0], before[1], limit],
+        ))
+
+    path = os.path.join(archive.path, f"{room_id}.jsonl.gz")
+    if not os.path.exists(path):
+        return []
+    with gzip.open(path, 'rt', encoding='utf-8') as archived:
+        messages = load_messages(archived)
+    messages = [message for message in messages if (message.sent_at, message.id) < before]
+    messages.sort(key=lambda message: (message.sent_at, message.id), reverse=True)
+    return messages[:limit]
+
+
+def message_history(room, before, limit):
+    """A page of a room's history older than the (sent_at, id) cursor `before`, newest first,
+    as (live messages, archived messages). Live months are read one partition at a time so each
+    query is pruned to a single month; past the oldest attached month it reads through to the archive."""
+    sent_at, last_id = before
+    keyset = models.Q(sent_at__lt=sent_at) | models.Q(sent_at=sent_at, id__lt=last_id)
+    queryset = (
+        room.messages
+        .filter(keyset)
+        .select_related('sender')
+        .order_by('-sent_at', '-id')
+    )
+
+    months = attached_months()
+    first_month = month_start(room.created_at)
+    live = []
+    if not months:
+        live = list(queryset[:limit])
+    for month in months:
+        if len(live) >= limit or month < first_month:
+            break
+        if month > month_start(sent_at):
+            continue
+        start, end = month_bounds(month)
+        live.extend(queryset.filter(sent_at__gte=start, sent_at__lt=end)[:limit - len(live)])
+
+    archived = []
+    if len(live) < limit and months and first_month < months[-1]:
+        cursor = (live[-1].sent_at, live[-1].id) if live else before
+        cold = MessageArchive.objects.filter(
+            month__gte=first_month, month__lte=month_start(cursor[0]), month__lt=months[-1],
+        ).order_by('-month')
+        for archive in cold:
+            archived.extend(read_archive(archive, room.id, cursor, limit - len(live) - len(archived)))
+            if len(live) + len(archived) >= limit:
+                break
+        # Cold rows outlive their senders' accounts; drop those like the cascade would have
+        senders = User.objects.in_bulk({message.sender_id for message in archived})
+        archived = [message for message in archived if message.sender_id in senders]
+        for message in archived:
+            message.sender, message.room = senders[message.sender_id], room
+    return live, archived
+
+
+def hot_cutoff(hot_months):
+    """The oldest month kept attached."""
+    return add_months(month_start(timezone.now()), -hot_months)
+
+
+def cold_months(hot_months):
+    """Attached months that have fallen out of the hot window, oldest first."""
+    cutoff = hot_cutoff(hot_months)
+    return sorted(month for month in attached_months() if month < cutoff)
+
+
+def recent_messages(room):
+    """A room's messages in the hot months, newest first. Bounding sent_at lets Postgres prune the
+    query to the hot partitions; anything older is paged through message_history."""
+    queryset = room.messages.order_by('-sent_at', '-id')
+    if settings.MESSAGE_HOT_MONTHS > 0:
+        start, _ = month_bounds(hot_cutoff(settings.MESSAGE_HOT_MONTHS))
+        queryset = queryset.filter(sent_at__gte=start)
+    return queryset
+
+
+def _delete_detached(field_name, value):
+    """Delete the rows whose Message field matches from every detached month table, in the caller's transaction."""
+    field = Message._meta.get_field(field_name)
+    value = field.get_db_prep_value(value, connection)
+    for archive in MessageArchive.objects.exclude(table_name=''):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM "{archive.table_name}" WHERE "{field.column}" = %s', [value])
+            deleted = cursor.rowcount
+        if deleted:
+            MessageArchive.objects.filter(id=archive.id).update(message_count=F('message_count') - deleted)
+
+
+def _remove_export(archive_id, path):
+    if not os.path.exists(path):
+        return
+    with gzip.open(path, 'rt', encoding='utf-8') as archived:
+        count = sum(1 for _ in archived)
+    os.remove(path)
+    MessageArchive.objects.filter(id=archive_id).update(message_count=F('message_count') - count)
+
+
+def purge_room(room_id):
+    """Remove a deleted room's messages from every cold month."""
+    _delete_detached('room', room_id)
+    exports = [
+        (archive.id, os.path.join(archive.path, f"{room_id}.jsonl.gz"))
+        for archive in MessageArchive.objects.exclude(path='')
+    ]
+    # Files cannot roll back, so they only go once the room is really gone
+    transaction.on_commit(lambda: [_remove_export(archive_id, path) for archive_id, path in exports])
+
+
+def purge_sender(user_id):
+    """Remove a deleted user's messages from detached tables now, and queue the export files for rewriting."""
+    _delete_detached('sender', user_id)
+    if MessageArchive.objects.exclude(path='').exists():
+        ArchivePurge.objects.get_or_create(sender_id=user_id)
+
+
+def _rewrite_without(path, sender_ids):
+    """Rewrite one export file without the messages of `sender_ids`. Returns how many were dropped."""
+    with gzip.open(path, 'rt', encoding='utf-8') as archived:
+        lines = archived.readlines()
+    kept = [line for line in lines if json.loads(line)['fields']['sender'] not in sender_ids]
+    if len(kept) == len(lines):
+        return 0
+    if not kept:
+        os.remove(path)
+        return len(lines)
+    partial = f"{path}.tmp"
+    with gzip.open(partial, 'wt', encoding='utf-8') as out:
+        out.writelines(kept)
+    os.replace(partial, path)
+    return len(lines) - len(kept)
+
+
+def purge_exported_senders():
+    """Work through the queued ArchivePurges: rewrite every export file without those users' messages.
+    Returns the number of messages removed."""
+    purges = list(ArchivePurge.objects.all())
+    if not purges:
+        return 0
+    sender_ids = {str(purge.sender_id) for purge in purges}
+    removed = 0
+    for archive in MessageArchive.objects.exclude(path=''):
+        if not os.path.isdir(archive.path):
+            continue
+        dropped = sum(
+            _rewrite_without(os.path.join(archive.path, name), sender_ids)
+            for name in os.listdir(archive.path) if name.endswith('.jsonl.gz')
+        )
+        if dropped:
+            MessageArchive.objects.filter(id=archive.id).update(message_count=F('message_count') - dropped)
+        removed += dropped
+    ArchivePurge.objects.filter(id__in=[purge.id for purge in purges]).delete()
+    return removed
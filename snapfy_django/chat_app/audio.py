@@ -0,0 +1,119 @@
+# chat_app/audio.py
+import os
+import tempfile
+import subprocess
+import logging
+import numpy as np
+import imageio_ffmpeg
+from channels.layers import get_channel_layer
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from .models import Message
+from .uploads import get_backend, attachment_url
+from .utils import invalidate_room_preview
+
+logger = logging.getLogger(__name__)
+
+ANALYSIS_SAMPLE_RATE = 8000  # Plenty for peaks and duration, keeps decoded voice notes small
+FFMPEG_TIMEOUT = 120
+
+
+def ffmpeg(*args, capture=False):
+    command = [imageio_ffmpeg.get_ffmpeg_exe(), '-hide_banner', '-loglevel', 'error', '-nostdin', *args]
+    result = subprocess.run(command, capture_output=True, timeout=FFMPEG_TIMEOUT)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.decode(errors='replace').strip()}")
+    return result.stdout if capture else None
+
+
+def transcode_to_opus(src_path, dst_path):
+    """Mono Opus in an Ogg container at VOICE_NOTE_BITRATE, tuned for speech."""
+    ffmpeg(
+        '-y', '-i', src_path,
+        '-vn', '-ac', '1',
+        '-c:a', 'libopus', '-b:a', settings.VOICE_NOTE_BITRATE, '-application', 'voip',
+        '-f', 'ogg', dst_path,
+    )
+
+
+def decode_pcm(path, sample_rate=ANALYSIS_SAMPLE_RATE):
+    """Decode any audio ffmpeg understands to mono float samples in [-1, 1]."""
+    raw = ffmpeg('-i', path, '-vn', '-ac', '1', '-ar', str(sample_rate), '-f', 's16le', '-', capture=True)
+    return np.frombuffer(raw, dtype='<i2').astype(np.float32) / 32768.0
+
+
+def waveform_peaks(samples, buckets):
+    """Peak amplitude of each of `buckets` equal slices, scaled to 0-100 against the loudest slice."""
+    if samples.size == 0:
+        return [0] * buckets
+    edges = np.linspace(0, samples.size, buckets + 1).astype(int)
+    magnitudes = np.abs(samples)
+    peaks = np.array([
+        magnitudes[start:end].max() if end > start else 0.0
+        for start, end in zip(edges[:-1], edges[1:])
+    ])
+    loudest = peaks.max()
+    if loudest <= 0:
+        return [0] * buckets
+    return np.rint(peaks / loudest * 100).astype(int).tolist()
+
+
+def analyze(path, buckets=None):
+    """(duration in seconds, waveform peaks) of an audio file."""
+    samples = decode_pcm(path)
+    duration = round(samples.size / ANALYSIS_SAMPLE_RATE, 2)
+    return duration, waveform_peaks(samples, buckets or settings.VOICE_NOTE_WAVEFORM_BUCKETS)
+
+
+def process_voice_note(message):
+    """Transcode a voice note to Opus, store duration and waveform, and tell the room.
+    The original upload is replaced only once the Opus copy is safely stored."""
+    backend = get_backend()
+    original = message.file
+    with tempfile.TemporaryDirectory() as workdir:
+        src_path = os.path.join(workdir, 'source')
+        dst_path = os.path.join(workdir, 'voice.ogg')
+        backend.download(original, src_path)
+        transcode_to_opus(src_path, dst_path)
+        duration, waveform = analyze(dst_path)
+        transcoded = backend.store(dst_path, f"{original.public_id}_opus")
+
+    # Conditional so a message deleted while we were transcoding does not get its file back, and a
+    # worker whose claim expired and was requeued does not overwrite the one that took over
+    updated = Message.objects.filter(id=message.id, is_deleted=False, audio_claimed_at=message.audio_claimed_at).update(
+        file=transcoded,
+        audio_duration=duration,
+        audio_waveform=waveform,
+        audio_status='ready',
+        updated_at=timezone.now(),
+    )
+    stale = original if updated else transcoded
+    try:
+        backend.delete(stale)
+    except Exception as e:
+        logger.warning(f"Could not delete voice note file {stale.public_id}: {e}")
+    if not updated:
+        logger.info(f"Voice note {message.id} was deleted or reclaimed during transcoding")
+        return
+    message.file = transcoded
+
+    invalidate_room_preview(message.room_id)
+    member_ids = list(message.room.users.values_list('id', flat=True))
+    channel_layer = get_channel_layer()
+    for user_id in member_ids:
+        cache.delete(f"messages_{message.room_id}_{user_id}")
+        if channel_layer:
+            async_to_sync(channel_layer.group_send)(
+                f"user_{user_id}",
+                {
+                    "type": "voice_note_ready",
+                    "room_id": str(message.room_id),
+                    "message_id": str(message.id),
+                    "file_url": attachment_url(message.file),
+                    "audio_duration": duration,
+                    "audio_waveform": waveform,
+                }
+            )
+    logger.info(f"Voice note {message.id} transcoded, {duration}s")
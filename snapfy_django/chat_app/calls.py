@@ -0,0 +1,120 @@
+# chat_app/calls.py
+import json
+import time
+import logging
+from django.conf import settings
+from django_redis import get_redis_connection
+from snapfy_django.redis_pool import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Live call state lives here; CallLog only keeps the durable summary.
+# call:<call_id>        hash: room_id, caller_id, receiver_id, call_type, status ("ringing"/"ongoing"), started_at
+# call:<call_id>:sdp    hash: offer / answer as JSON, kept only CALL_SDP_TTL seconds
+# user_call:<user_id>   id of the call the user is in, so "is this user in a call" is one EXISTS
+# A ringing call expires after CALL_RING_TTL, an answered one after CALL_STATE_TTL without signaling.
+
+
+def call_key(call_id):
+    return f"call:{call_id}"
+
+
+def sdp_key(call_id):
+    return f"call:{call_id}:sdp"
+
+
+def user_call_key(user_id):
+    return f"user_call:{user_id}"
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _session(raw):
+    return {_decode(field): _decode(value) for field, value in raw.items()} if raw else None
+
+
+# Sync side, used by the call REST endpoints
+
+def start_call(call_id, room_id, caller_id, receiver_id, call_type, offer):
+    redis_client = get_redis_connection("default")
+    pipe = redis_client.pipeline()
+    pipe.hset(call_key(call_id), mapping={
+        "room_id": str(room_id),
+        "caller_id": str(caller_id),
+        "receiver_id": str(receiver_id),
+        "call_type": call_type,
+        "status": "ringing",
+        "started_at": time.time(),
+    })
+    pipe.expire(call_key(call_id), settings.CALL_RING_TTL)
+    pipe.hset(sdp_key(call_id), "offer", json.dumps(offer))
+    pipe.expire(sdp_key(call_id), settings.CALL_SDP_TTL)
+    for user_id in (caller_id, receiver_id):
+        pipe.set(user_call_key(user_id), str(call_id), ex=settings.CALL_RING_TTL)
+    pipe.execute()
+
+
+def end_call(call_id):
+    """Drop a call's live state. Returns the session as it was, or None if it had already ended."""
+    redis_client = get_redis_connection("default")
+    session = _session(redis_client.hgetall(call_key(call_id)))
+    pipe = redis_client.pipeline()
+    pipe.delete(call_key(call_id), sdp_key(call_id))
+    if session:
+        participants = [session["caller_id"], session["receiver_id"]]
+        # Only clear the pointers still aimed at this call; a participant may be in a newer one
+        for user_id, current in zip(participants, redis_client.mget([user_call_key(user_id) for user_id in participants])):
+            if _decode(current) == str(call_id):
+                pipe.delete(user_call_key(user_id))
+    pipe.execute()
+    return session
+
+
+def get_call(call_id):
+    return _session(get_redis_connection("default").hgetall(call_key(call_id)))
+
+
+# Async side, used by UserChatConsumer
+
+async def in_call(user_id):
+    return bool(await get_redis().exists(user_call_key(user_id)))
+
+
+async def record_signal(call_id, user_id, signal_type, sdp=None):
+    """Fold a signaling message into the call's live state. Signals from users outside the call are ignored."""
+    if not call_id:
+        return
+    redis_client = get_redis()
+    session = _session(await redis_client.hgetall(call_key(call_id)))
+    if not session or str(user_id) not in (session["caller_id"], session["receiver_id"]):
+        return
+
+    if signal_type == "call_ended":
+        await aend_call(call_id, session)
+        return
+
+    async with redis_client.pipeline(transaction=True) as pipe:
+        if signal_type == "call_answer" and session["status"] == "ringing":
+            pipe.hset(call_key(call_id), "status", "ongoing")
+        if sdp is not None:
+            pipe.hset(sdp_key(call_id), "answer" if signal_type == "call_answer" else "offer", json.dumps(sdp))
+            pipe.expire(sdp_key(call_id), settings.CALL_SDP_TTL)
+        ttl = settings.CALL_RING_TTL if signal_type == "call_offer" and session["status"] == "ringing" else settings.CALL_STATE_TTL
+        pipe.expire(call_key(call_id), ttl)
+        for participant in (session["caller_id"], session["receiver_id"]):
+            pipe.set(user_call_key(participant), str(call_id), ex=ttl)
+        await pipe.execute()
+
+
+async def aend_call(call_id, session):
+    redis_client = get_redis()
+    participants = [session["caller_id"], session["receiver_id"]]
+    current = await redis_client.mget([user_call_key(user_id) for user_id in participants])
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.delete(call_key(call_id), sdp_key(call_id))
+        for user_id, pointer in zip(participants, current):
+            if _decode(pointer) == str(call_id):
+                pipe.delete(user_call_key(user_id))
+        await pipe.execute()
@@ -4,40 +4,54 @@ from django.contrib.auth import get_user_model
 from rest_framework_simplejwt.tokens import AccessToken
 from channels.db import database_sync_to_async
 from django.db import models
-from django.utils import timezone
-from .models import ChatRoom, Message, CallLog
-from cryptography.fernet import Fernet
+from django.conf import settings
+from .models import ChatRoom, Message
+from snapfy_django.redis_pool import get_redis
+from . import presence, calls
+from .uploads import attachment_url
+from .crypto import get_cipher, decrypt_message, decrypt_messages, ciphertext_text
+from .receipts import room_receipts, read_state, unread_count, unread_counts, advance_read_receipt, receipt_payload
+from .utils import (
+    claim_send, complete_send, release_send, SEND_PENDING, set_room_preview, parse_cursor, make_cursor,
+)
 import logging
-import redis.asyncio as redis
 import uuid
 import asyncio
-import datetime, os
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
 
+# Reconnect sync limits
+SYNC_PAGE_SIZE = 100
+SYNC_MAX_PAGE_SIZE = 200
+SYNC_MAX_ROOMS = 50
+
+# A burst of trickle ICE candidates is forwarded once it reaches this size at the latest
+ICE_BATCH_MAX = 20
+
+
 class UserChatConsumer(AsyncWebsocketConsumer):
     
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.redis_client = None
+        self.room_ids = set()
+        self.heartbeat_task = None
+        self.ice_batches = {}  # (call_id, target_user_id) -> pending candidates and their flush task
+        self.ice_batching = False  # Client understands ice_candidates frames
     
     async def connect(self):
         self.user = None
         self.connection_id = str(uuid.uuid4())
         self.session_id = None
-        
-        redis_password = os.environ.get('REDIS_PASSWORD', '')
-        redis_host = os.environ.get('REDIS_HOST', 'localhost')
-        redis_port = os.environ.get('REDIS_PORT', '6379')
-        redis_url = f"redis://:{redis_password}@{redis_host}:{redis_port}/0" if redis_password else f"redis://{redis_host}:{redis_port}/0"
-        self.redis_client = redis.from_url(redis_url)
+        self.redis_client = get_redis()
 
         query_string = self.scope.get('query_string', b'').decode()
         if 'session_id=' in query_string:
             self.session_id = query_string.split('session_id=')[1].split('&')[0]
         else:
             self.session_id = str(uuid.uuid4())
+        self.ice_batching = 'ice_batch=1' in query_string.split('&')
 
         try:
             token = query_string.split('token=')[1].split('&')[0] if 'token=' in query_string else None
@@ -54,14 +68,19 @@ class UserChatConsumer(AsyncWebsocketConsumer):
 
             self.user_id = str(self.user.id)
             self.group_name = f"user_{self.user_id}"
+            # Join first, then load: a room_membership event sent in between is queued for this
+            # socket instead of lost, and room_membership keeps the set current from then on
+            await self.channel_layer.group_add(self.group_name, self.channel_name)
+            self.room_ids = await self.get_user_room_ids()
 
-            await self.add_connection_to_redis()
-            connections = await self.get_user_connections()
+            came_online = await presence.register_connection(self.user_id, self.connection_id, self.session_id)
+            connections = await presence.live_connections(self.user_id)
             # Only replace connections that are not handling active calls
             active_call = await self.check_active_call()
             other_connections = [
-                conn for conn in connections
-                if conn.get('session_id') != self.session_id
+                conn for conn_id, conn in connections.items()
+                if conn_id != self.connection_id
+                and conn.get('session_id') != self.session_id
                 and not active_call  # Skip replacement if this connection is part of an active call
             ]
             if other_connections and not active_call:
@@ -74,112 +93,53 @@ class UserChatConsumer(AsyncWebsocketConsumer):
                         "except_connection": self.connection_id
                     }
                 )
-                await asyncio.sleep(0.5)
 
-            await self.channel_layer.group_add(self.group_name, self.channel_name)
-            await self.channel_layer.group_add("all_users", self.channel_name)
             await self.accept()
             await self.send(text_data=json.dumps({"type": "connection_established", "user_id": self.user_id}))
-            await self.update_user_status(True)
-            await self.broadcast_user_status(True)
+            self.heartbeat_task = asyncio.create_task(self.heartbeat_loop())
+            if came_online:
+                await self.broadcast_user_status()
         except Exception as e:
             logger.error(f"Connection error: {str(e)}")
             await self.close(code=4001, reason=f"Connection error: {str(e)}")
-        finally:
-            if self.redis_client:
-                await self.redis_client.close()
                 
-    @database_sync_to_async
-    def check_active_call(self):
-        # Check if the user is part of an active call
-        return CallLog.objects.filter(
-            models.Q(caller=self.user) | models.Q(receiver=self.user),
-            call_status='ongoing',
-            call_end_time__isnull=True
-        ).exists()
+    async def check_active_call(self):
+        # One key lookup in the call registry instead of a CallLog query
+        return await calls.in_call(self.user_id)
 
     @database_sync_to_async
     def get_user_from_token(self, token):
         try:
             access_token = AccessToken(token)
-            user = User.objects.get(id=access_token['user_id'])
-            user.is_online = True
-            user.last_seen = timezone.now()
-            user.save()
-            return user
+            return User.objects.get(id=access_token['user_id'])
         except Exception:
             return None
-        
-    @database_sync_to_async
-    def update_user_status(self, is_online):
-        if self.user:
-            self.user.is_online = is_online
-            self.user.last_seen = timezone.now() if not is_online else None
-            self.user.save()
-            logger.info(f"User {self.user_id} status updated: is_online={is_online}")
-            
-    async def add_connection_to_redis(self):
-        try:
-            conn_data = json.dumps({
-                "conn_id": self.connection_id,
-                "session_id": self.session_id or "",
-                "timestamp": timezone.now().isoformat()
-            })
-            await self.redis_client.sadd(f"user_connections:{self.user_id}", conn_data)
-            await self.redis_client.expire(f"user_connections:{self.user_id}", 3600)
-        except Exception as e:
-            logger.error(f"Error adding connection to Redis: {e}")
 
-    async def remove_connection_from_redis(self):
-        try:
-            conn_data = json.dumps({"conn_id": self.connection_id, "session_id": self.session_id or ""})
-            await self.redis_client.srem(f"user_connections:{self.user_id}", conn_data)
-        except Exception as e:
-            logger.error(f"Error removing connection from Redis: {e}")
-
-    async def get_user_connections(self):
-        redis_password = os.environ.get('REDIS_PASSWORD', '')
-        redis_host = os.environ.get('REDIS_HOST', 'localhost')
-        redis_port = os.environ.get('REDIS_PORT', '6379')
-        redis_url = f"redis://:{redis_password}@{redis_host}:{redis_port}/0" if redis_password else f"redis://{redis_host}:{redis_port}/0"
-        redis_client = redis.from_url(redis_url)
-        try:
-            connections = await redis_client.smembers(f"user_connections:{self.user_id}")
-            result = []
-            for conn in connections:
-                try:
-                    conn_data = conn.decode('utf-8')
-                    if not conn_data:
-                        logger.warning(f"Empty connection data in Redis for user {self.user_id}")
-                        continue
-                    parsed_data = json.loads(conn_data)
-                    result.append(parsed_data)
-                except (json.JSONDecodeError, UnicodeDecodeError) as e:
-                    logger.warning(f"Invalid connection data in Redis for user {self.user_id}: {e}")
-                    # Remove corrupted data
-                    await redis_client.srem(f"user_connections:{self.user_id}", conn)
-                    continue
-            return result
-        except Exception as e:
-            logger.error(f"Error fetching connections from Redis: {e}")
-            return []
-        finally:
-            await redis_client.close()
+    async def heartbeat_loop(self):
+        # Keeps this connection's presence entry alive; if the process dies the entry expires on its own
+        while True:
+            await asyncio.sleep(settings.PRESENCE_HEARTBEAT_INTERVAL)
+            try:
+                await presence.heartbeat(self.user_id, self.connection_id, self.session_id)
+            except Exception as e:
+                logger.error(f"Error refreshing presence for user {self.user_id}: {e}")
 
     async def disconnect(self, close_code):
+        if self.heartbeat_task:
+            self.heartbeat_task.cancel()
+        for key in list(self.ice_batches):
+            await self.flush_ice_candidates(key)
+
         if hasattr(self, 'group_name'):
             await self.channel_layer.group_discard(self.group_name, self.channel_name)
-            await self.channel_layer.group_discard("all_users", self.channel_name)
-            await self.remove_connection_from_redis()
-
-            await asyncio.sleep(1)
-            remaining_connections = await self.get_user_connections()
-            if not remaining_connections:
-                await self.update_user_status(False)
-                await self.broadcast_user_status(False)
-
-        if self.redis_client:
-            await self.redis_client.close()
+            try:
+                if await presence.unregister_connection(self.user_id, self.connection_id):
+                    # Debounced in the background so a quick reconnect never shows as offline
+                    presence.run_in_background(
+                        presence.settle_offline(self.user_id, self.broadcast_user_status)
+                    )
+            except Exception as e:
+                logger.error(f"Error removing connection from Redis: {e}")
 
     async def receive(self, text_data):
         try:
@@ -197,6 +157,10 @@ class UserChatConsumer(AsyncWebsocketConsumer):
                 await self.forward_call_signal(data, 'ice_candidate')
             elif message_type == 'call_ended':
                 await self.forward_call_signal(data, 'call_ended')
+            elif message_type == 'sync':
+                await self.handle_sync(data)
+            elif message_type == 'heartbeat':
+                await presence.heartbeat(self.user_id, self.connection_id, self.session_id)
         except json.JSONDecodeError:
             await self.send(text_data=json.dumps({"error": "Invalid message format"}))
 
@@ -210,22 +174,35 @@ class UserChatConsumer(AsyncWebsocketConsumer):
             await self.send(text_data=json.dumps({"error": "Room ID and content required"}))
             return
 
-        if not await self.is_user_in_room(room_id):
+        if not self.is_user_in_room(room_id):
             logger.error(f"User {self.user_id} not authorized for room {room_id}")
             await self.send(text_data=json.dumps({"error": "Not authorized for this room"}))
             return
 
-        message_data = await self.save_message(room_id, content, temp_id)
+        message_data, created = await self.save_message(room_id, content, temp_id)
+        if not created:
+            # Retry of a tempId we already handled: answer this socket only, no new row or fan-out
+            if message_data is None:
+                await self.send(text_data=json.dumps({
+                    "type": "error",
+                    "error": "Message is still being sent",
+                    "tempId": temp_id
+                }))
+            else:
+                logger.info(f"Duplicate send of tempId {temp_id} by user {self.user_id}, returning message {message_data['id']}")
+                await self.send(text_data=json.dumps({
+                    "type": "chat_message",
+                    "message": message_data,
+                    "room_id": str(room_id),
+                    "unread_count": 0
+                }))
+            return
         logger.info(f"Saved message for room {room_id}: {message_data}")
 
         room_users = await self.get_room_users(room_id)
+        counts = await database_sync_to_async(unread_counts)(room_id, [user.id for user in room_users if user != self.user])
         for user in room_users:
-            user_specific_unread_count = (
-                0 if user == self.user
-                else await database_sync_to_async(
-                    lambda: Message.objects.filter(room_id=room_id, is_read=False).exclude(sender=user).count()
-                )()
-            )
+            user_specific_unread_count = counts.get(user.id, 0)
             logger.info(f"Broadcasting to user {user.id} in room {room_id}, unread_count={user_specific_unread_count}")
             await self.channel_layer.group_send(
                 f"user_{user.id}",
@@ -237,6 +214,25 @@ class UserChatConsumer(AsyncWebsocketConsumer):
                 }
             )
             
+    async def handle_sync(self, data):
+        # Resume after a reconnect: only what changed in each room since the client's cursor
+        rooms = data.get('rooms')
+        if not isinstance(rooms, dict):
+            await self.send(text_data=json.dumps({"type": "error", "error": "rooms must map room ids to cursors"}))
+            return
+        try:
+            limit = max(1, min(int(data.get('limit') or SYNC_PAGE_SIZE), SYNC_MAX_PAGE_SIZE))
+        except (TypeError, ValueError):
+            limit = SYNC_PAGE_SIZE
+
+        room_cursors = {
+            str(room_id): cursor
+            for room_id, cursor in list(rooms.items())[:SYNC_MAX_ROOMS]
+            if self.is_user_in_room(room_id)
+        }
+        results = await self.get_room_changes(room_cursors, limit)
+        await self.send(text_data=json.dumps({"type": "sync_result", "rooms": results}))
+
     async def connection_replace(self, event):
         if event.get("except_connection") != self.connection_id:
             active_call = await self.check_active_call()
@@ -245,37 +241,32 @@ class UserChatConsumer(AsyncWebsocketConsumer):
 
     async def handle_mark_as_read(self, data):
         room_id = data.get('room_id')
-        if not await self.is_user_in_room(room_id):
+        if not self.is_user_in_room(room_id):
             return
 
-        result = await self.mark_messages_read(room_id)
+        message_id = data.get('message_id')  # Read up to here; the newest message when omitted
+        if message_id is not None and not str(message_id).isdigit():
+            return
+        receipt = await self.mark_messages_read(room_id, message_id)
+        if not receipt:
+            return
         room_users = await self.get_room_users(room_id)
         for user in room_users:
             await self.channel_layer.group_send(
                 f"user_{user.id}",
-                {
-                    "type": "mark_as_read",
-                    "room_id": str(result["room_id"]),
-                    "user_id": str(result["user_id"]),
-                    "updated_ids": result["updated_ids"],
-                    "read_at": result["read_at"]
-                }
+                {"type": "mark_as_read", **receipt}
             )
 
-    async def broadcast_user_status(self, is_online):
-        await self.channel_layer.group_send(
-            "all_users",
-            {
-                "type": "user_status",
-                "user_id": str(self.user.id),
-                "is_online": is_online,
-                "last_seen": timezone.now().isoformat() if not is_online else None
-            }
-        )
+    async def broadcast_user_status(self):
+        # Only contacts (shared rooms and followers) hear about it, coalesced per user
+        await presence.publish_status(self.user_id, self.channel_layer)
 
-    @database_sync_to_async
     def is_user_in_room(self, room_id):
-        return ChatRoom.objects.filter(id=room_id, users=self.user).exists()
+        return room_id is not None and str(room_id) in self.room_ids
+
+    @database_sync_to_async
+    def get_user_room_ids(self):
+        return {str(room_id) for room_id in ChatRoom.objects.filter(users=self.user).values_list('id', flat=True)}
 
     @database_sync_to_async
     def get_room_users(self, room_id):
@@ -284,63 +275,129 @@ class UserChatConsumer(AsyncWebsocketConsumer):
 
     @database_sync_to_async
     def save_message(self, room_id, content, temp_id=None):
+        """Returns (message_data, created). A tempId seen before gives back the message it created
+        with created=False, or (None, False) while that first attempt is still being written."""
         room = ChatRoom.objects.get(id=room_id)
-        fernet = Fernet(room.encryption_key.encode())
-        encrypted_content = fernet.encrypt(content.encode()).decode()
+        cipher = get_cipher(room.id, room.encryption_key)
 
-        message = Message.objects.create(
-            room=room,
-            sender=self.user,
-            content=encrypted_content
-        )
+        if temp_id:
+            existing_id = claim_send(self.user.id, temp_id)
+            if existing_id == SEND_PENDING:
+                return None, False
+            existing = Message.objects.select_related('sender').filter(id=existing_id, room=room).first() if existing_id else None
+            if existing:
+                message_data = self.message_payload(existing, decrypt_message(cipher, existing), room_receipts(room.id))
+                message_data["encrypted_content"] = ciphertext_text(existing.content, existing.content_blob)
+                message_data['tempId'] = temp_id
+                return message_data, False
+
+        try:
+            stored_content, content_blob = cipher.encrypt(content)
+            message = Message.objects.create(
+                room=room,
+                sender=self.user,
+                content=stored_content,
+                content_blob=content_blob
+            )
+        except Exception:
+            if temp_id:
+                release_send(self.user.id, temp_id)
+            raise
+        if temp_id:
+            complete_send(self.user.id, temp_id, message.id)
+        set_room_preview(message, content)
 
         room.last_message_at = message.sent_at
-        room.unread_count = room.messages.filter(is_read=False).exclude(sender=self.user).count()
         room.save()
 
-        message_data = {
+        message_data = self.message_payload(message, content)
+        message_data["encrypted_content"] = ciphertext_text(stored_content, content_blob)
+        message_data["unread_count"] = unread_count(room.id, self.user.id)
+        if temp_id:
+            message_data['tempId'] = temp_id
+        return message_data, True
+
+    @staticmethod
+    def message_payload(message, content, receipts=()):
+        is_read, read_at = read_state(message, receipts)
+        return {
             "id": str(message.id),
-            "room": str(room.id),
+            "room": str(message.room_id),
             "content": content,
-            "encrypted_content": encrypted_content,
             "sent_at": message.sent_at.isoformat(),
-            "is_read": message.is_read,
+            "updated_at": message.updated_at.isoformat(),
+            "is_read": is_read,
+            "read_at": read_at.isoformat() if read_at else None,
             "is_deleted": message.is_deleted,
+            "file_url": attachment_url(message.file),
+            "audio_status": message.audio_status,
+            "audio_duration": message.audio_duration,
+            "audio_waveform": message.audio_waveform,
             "sender": {
-                "id": str(self.user.id),
-                "username": self.user.username,
-                "profile_picture": self.user.profile_picture.url if self.user.profile_picture else None
+                "id": str(message.sender.id),
+                "username": message.sender.username,
+                "profile_picture": message.sender.profile_picture.url if message.sender.profile_picture else None
             },
-            "unread_count": room.unread_count
         }
-        if temp_id:
-            message_data['tempId'] = temp_id
-        return message_data
 
     @database_sync_to_async
-    def mark_messages_read(self, room_id):
-        room = ChatRoom.objects.get(id=room_id)
-        messages = room.messages.filter(is_read=False).exclude(sender=self.user)
-        updated_ids = list(messages.values_list('id', flat=True))
-
-        if updated_ids:
-            messages.update(is_read=True, read_at=timezone.now())
-            room.unread_count = 0
-            room.save()
+    def get_room_changes(self, room_cursors, limit):
+        results = []
+        rooms = ChatRoom.objects.in_bulk(list(room_cursors.keys()))
+        for room_id, cursor in room_cursors.items():
+            parsed = parse_cursor(cursor)
+            room = rooms.get(int(room_id)) if room_id.isdigit() else None
+            if not parsed or not room:
+                results.append({"room_id": room_id, "error": "Invalid cursor"})
+                continue
+            since, last_id = parsed
+
+            # Served by the (room, updated_at, id) index; reads and deletes bump updated_at too
+            changed = list(
+                Message.objects
+                .filter(room=room)
+                .filter(models.Q(updated_at__gt=since) | models.Q(updated_at=since, id__gt=last_id))
+                .select_related('sender')
+                .order_by('updated_at', 'id')[:limit + 1]
+            )
+            has_more = len(changed) > limit
+            changed = changed[:limit]
+
+            fresh = [message for message in changed if message.sent_at > since and not message.is_deleted]
+            plaintexts = decrypt_messages(room.id, room.encryption_key, fresh)
+            receipts = room_receipts(room.id)
+            messages, updates = [], []
+            for message in changed:
+                if message.id in plaintexts:
+                    messages.append(self.message_payload(message, plaintexts[message.id], receipts))
+                else:
+                    updates.append({
+                        "id": str(message.id),
+                        "is_deleted": message.is_deleted,
+                    })
+
+            results.append({
+                "room_id": room_id,
+                "messages": messages,
+                "updates": updates,
+                # Watermarks that moved since the cursor; read state is derived from these
+                "receipts": [receipt_payload(receipt) for receipt in receipts if receipt.read_at > since],
+                "cursor": make_cursor(changed[-1].updated_at, changed[-1].id) if changed else cursor,
+                "has_more": has_more,
+            })
+        return results
 
-        return {
-            "room_id": str(room_id),
-            "user_id": str(self.user.id),
-            "updated_ids": [str(id) for id in updated_ids],
-            "read_at": timezone.now().isoformat() if updated_ids else None
-        }
+    @database_sync_to_async
+    def mark_messages_read(self, room_id, message_id=None):
+        receipt = advance_read_receipt(room_id, self.user.id, message_id)
+        return receipt_payload(receipt) if receipt else None
 
     async def chat_message(self, event):
         room_id = event["room_id"]
         message = event["message"]
         unread_count = event.get("unread_count", 0)
 
-        if await self.is_user_in_room(room_id):
+        if self.is_user_in_room(room_id):
             await self.send(text_data=json.dumps({
                 "type": "chat_message",
                 "message": message,
@@ -354,6 +411,25 @@ class UserChatConsumer(AsyncWebsocketConsumer):
                 "unread_count": unread_count
             }))
             
+    async def room_membership(self, event):
+        room_id = event["room_id"]
+        if event["action"] == "add":
+            self.room_ids.add(room_id)
+        else:
+            self.room_ids.discard(room_id)
+        logger.info(f"User {self.user_id} membership {event['action']} for room {room_id}")
+
+    async def voice_note_ready(self, event):
+        if self.is_user_in_room(event["room_id"]):
+            await self.send(text_data=json.dumps({
+                "type": "voice_note_ready",
+                "room_id": event["room_id"],
+                "message_id": event["message_id"],
+                "file_url": event["file_url"],
+                "audio_duration": event["audio_duration"],
+                "audio_waveform": event["audio_waveform"]
+            }))
+
     async def chat_list_update(self, event):
         await self.send(text_data=json.dumps({
             "type": "chat_list_update",
@@ -366,7 +442,8 @@ class UserChatConsumer(AsyncWebsocketConsumer):
             "type": "mark_as_read",
             "room_id": event["room_id"],
             "user_id": event["user_id"],
-            "updated_ids": event["updated_ids"],
+            "last_read_message_id": event["last_read_message_id"],
+            "last_read_sent_at": event["last_read_sent_at"],
             "read_at": event["read_at"]
         }))
 
@@ -385,10 +462,14 @@ class UserChatConsumer(AsyncWebsocketConsumer):
         target_user_id = data.get('target_user_id')
         call_type = data.get('call_type', 'audio')  # Default to audio if not provided
         
-        if not target_user_id or not room_id or not await self.is_user_in_room(room_id):
+        if not target_user_id or not room_id or not self.is_user_in_room(room_id):
             await self.send(text_data=json.dumps({"type": "error", "error": "Invalid call data"}))
             return
-        
+
+        if signal_type == "ice_candidate":
+            await self.queue_ice_candidate(data, room_id, target_user_id)
+            return
+
         # Prevent duplicate call_offer signals
         if signal_type == "call_offer":
             signal_key = f"call_offer:{data.get('call_id')}:{target_user_id}"
@@ -411,6 +492,8 @@ class UserChatConsumer(AsyncWebsocketConsumer):
             "call_type": call_type,
         }
         
+        await calls.record_signal(data.get('call_id'), self.user_id, signal_type, data.get('sdp'))
+
         if signal_type in ["call_offer", "call_answer"]:
             payload["sdp"] = data.get('sdp')
         elif signal_type == "ice_candidate":
@@ -421,6 +504,48 @@ class UserChatConsumer(AsyncWebsocketConsumer):
 
         await self.channel_layer.group_send(f"user_{target_user_id}", payload)
 
+    async def queue_ice_candidate(self, data, room_id, target_user_id):
+        # Browsers trickle dozens of candidates at once; forward each burst as one ice_candidates event
+        key = (str(data.get('call_id')), str(target_user_id))
+        batch = self.ice_batches.get(key)
+        if batch is None:
+            batch = self.ice_batches[key] = {
+                "room_id": room_id,
+                "candidates": [],
+                "task": asyncio.create_task(self.flush_ice_candidates_later(key)),
+            }
+        candidate = data.get('candidate')
+        if candidate:
+            batch["candidates"].append(candidate)
+        # An empty candidate is the browser's end-of-candidates marker
+        end_of_candidates = not candidate or bool(data.get('end_of_candidates'))
+        if end_of_candidates or len(batch["candidates"]) >= ICE_BATCH_MAX:
+            batch["task"].cancel()
+            await self.flush_ice_candidates(key, end_of_candidates)
+
+    async def flush_ice_candidates_later(self, key):
+        await asyncio.sleep(settings.CALL_ICE_BATCH_WINDOW)
+        await self.flush_ice_candidates(key)
+
+    async def flush_ice_candidates(self, key, end_of_candidates=False):
+        batch = self.ice_batches.pop(key, None)
+        if batch is None or (not batch["candidates"] and not end_of_candidates):
+            return
+        call_id, target_user_id = key
+        await self.channel_layer.group_send(f"user_{target_user_id}", {
+            "type": "ice_candidates",
+            "call_id": call_id,
+            "room_id": batch["room_id"],
+            "target_user_id": target_user_id,
+            "caller": {
+                "id": str(self.user.id),
+                "username": self.user.username,
+                "profile_picture": self.user.profile_picture.url if self.user.profile_picture else None,
+            },
+            "candidates": batch["candidates"],
+            "end_of_candidates": end_of_candidates,
+        })
+
     # WebSocket message handlers
     async def call_offer(self, event):
         logger.info(f"Sending call_offer for call_id {event['call_id']} to user {event['target_user_id']}")
@@ -446,6 +571,21 @@ class UserChatConsumer(AsyncWebsocketConsumer):
     async def ice_candidate(self, event):
         await self.send(text_data=json.dumps(event))
 
+    async def ice_candidates(self, event):
+        if self.ice_batching:
+            await self.send(text_data=json.dumps(event))
+            return
+        # Clients without ice_batch=1 get the old one-frame-per-candidate stream
+        for candidate in event["candidates"]:
+            await self.send(text_data=json.dumps({
+                "type": "ice_candidate",
+                "call_id": event["call_id"],
+                "room_id": event["room_id"],
+                "target_user_id": event["target_user_id"],
+                "caller": event["caller"],
+                "candidate": candidate,
+            }))
+
     async def call_ended(self, event):
         logger.info(f"Sending call_ended for call_id {event['call_id']} with status {event['call_status']}")
         await self.send(text_data=json.dumps({
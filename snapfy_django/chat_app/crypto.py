@@ -0,0 +1,135 @@
+# chat_app/crypto.py
+import os
+import base64
+import functools
+import logging
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from .models import Message
+
+logger = logging.getLogger(__name__)
+
+# Message bodies are stored in one of two formats, both keyed by ChatRoom.encryption_key:
+#   fernet  base64 Fernet token in Message.content (legacy, ~57 bytes overhead plus 33% expansion)
+#   aesgcm  version byte + 12 byte nonce + ciphertext + 16 byte tag in Message.content_blob
+# Reads accept either format, writes use settings.MESSAGE_CIPHER.
+CIPHERS = ('aesgcm', 'fernet')
+AESGCM_VERSION = b"\x01"
+AESGCM_NONCE_SIZE = 12
+TEXT_PREFIX = "aesgcm:"  # Marks a blob rendered as text for JSON; Fernet tokens never contain ':'
+DECRYPTION_ERROR = '[Decryption Error]'
+CIPHER_CACHE_SIZE = 1024
+
+
+class RoomCipher:
+    """Encrypts and decrypts the messages of one room."""
+
+    def __init__(self, room_id, encryption_key):
+        self.fernet = Fernet(encryption_key)
+        aead_key = HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=None,
+            info=b"snapfy-message-aesgcm",
+        ).derive(base64.urlsafe_b64decode(encryption_key))
+        self.aead = AESGCM(aead_key)
+        self.aad = f"room:{room_id}".encode()  # A blob copied into another room fails to decrypt
+
+    def encrypt(self, plaintext, mode=None):
+        """Return (content, content_blob) to store on a Message."""
+        mode = mode or settings.MESSAGE_CIPHER
+        if not plaintext:
+            return '', None
+        if mode == 'aesgcm':
+            nonce = os.urandom(AESGCM_NONCE_SIZE)
+            return '', AESGCM_VERSION + nonce + self.aead.encrypt(nonce, plaintext.encode(), self.aad)
+        if mode == 'fernet':
+            return self.fernet.encrypt(plaintext.encode()).decode(), None
+        raise ValueError(f"Unknown message cipher: {mode}")
+
+    def decrypt(self, content, content_blob=None):
+        """Decrypt either format, or the text form of a blob. Raises InvalidToken or ValueError."""
+        if content_blob:
+            blob = bytes(content_blob)
+            if blob[:1] != AESGCM_VERSION:
+                raise ValueError("Unknown message blob version")
+            nonce, ciphertext = blob[1:1 + AESGCM_NONCE_SIZE], blob[1 + AESGCM_NONCE_SIZE:]
+            try:
+                return self.aead.decrypt(nonce, ciphertext, self.aad).decode()
+            except InvalidTag:
+                raise InvalidToken
+        if not content:
+            return ''
+        if content.startswith(TEXT_PREFIX):
+            return self.decrypt('', base64.urlsafe_b64decode(content[len(TEXT_PREFIX):]))
+        return self.fernet.decrypt(content.encode()).decode()
+
+
+@functools.lru_cache(maxsize=CIPHER_CACHE_SIZE)
+def _cached_cipher(room_id, encryption_key):
+    return RoomCipher(room_id, encryption_key)
+
+
+def get_cipher(room_id, encryption_key):
+    """Cipher for a room, reused across messages. Keyed on the key too, so a rotated key
+    never hits a stale entry. Raises ValueError for a malformed key."""
+    return _cached_cipher(str(room_id), encryption_key)
+
+
+def ciphertext_text(content, content_blob):
+    """Stored ciphertext as text, for the content/encrypted_content fields of payloads."""
+    if content_blob:
+        return TEXT_PREFIX + base64.urlsafe_b64encode(bytes(content_blob)).decode()
+    return content or ''
+
+
+def decrypt_message(cipher, message):
+    try:
+        return cipher.decrypt(message.content, message.content_blob)
+    except (InvalidToken, ValueError):
+        return DECRYPTION_ERROR
+
+
+def decrypt_messages(room_id, encryption_key, messages, migrate=True):
+    """Decrypt a page of one room's messages with a single cipher: {message id: plaintext}.
+    Deleted messages are skipped. Legacy Fernet rows found along the way are rewritten
+    as AES-GCM blobs when that is the write format, unless `migrate` is off (archived rows)."""
+    cipher = get_cipher(room_id, encryption_key)
+    plaintexts, legacy = {}, []
+    for message in messages:
+        if message.is_deleted:
+            continue
+        try:
+            plaintexts[message.id] = cipher.decrypt(message.content, message.content_blob)
+        except (InvalidToken, ValueError):
+            plaintexts[message.id] = DECRYPTION_ERROR
+            continue
+        if message.content and not message.content_blob:
+            legacy.append(message)
+
+    if migrate and legacy and settings.MESSAGE_CIPHER == 'aesgcm' and settings.MESSAGE_CRYPTO_LAZY_MIGRATE:
+        migrate_legacy(cipher, legacy, plaintexts)
+    return plaintexts
+
+
+def migrate_legacy(cipher, messages, plaintexts):
+    """Re-encrypt Fernet rows as blobs. Each update is conditional on the old token so a
+    concurrent delete is never overwritten, and update() leaves updated_at alone so
+    reconnect sync does not see a change."""
+    migrated = 0
+    try:
+        with transaction.atomic():
+            for message in messages:
+                content, content_blob = cipher.encrypt(plaintexts[message.id], mode='aesgcm')
+                migrated += Message.objects.filter(
+                    id=message.id, content=message.content, is_deleted=False
+                ).update(content=content, content_blob=content_blob)
+    except DatabaseError as e:
+        logger.warning(f"Lazy message re-encryption failed, will retry on next read: {e}")
+        return
+    logger.info(f"Re-encrypted {migrated} legacy messages as AES-GCM")
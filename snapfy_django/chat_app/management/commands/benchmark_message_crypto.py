@@ -0,0 +1,52 @@
+# chat_app/management/commands/benchmark_message_crypto.py
+import time
+from cryptography.fernet import Fernet
+from django.core.management.base import BaseCommand
+from chat_app.crypto import CIPHERS, RoomCipher, get_cipher, ciphertext_text
+from chat_app.models import generate_encryption_key
+
+
+class Command(BaseCommand):
+    help = "Measure encrypt/decrypt throughput and stored bytes per message for each message cipher"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=20000)
+        parser.add_argument('--size', type=int, default=80, help="Plaintext length in characters")
+
+    def handle(self, *args, **options):
+        count, size = options['messages'], options['size']
+        key = generate_encryption_key()
+        plaintext = ("snapfy " * (size // 7 + 1))[:size]
+        self.stdout.write(f"{count} messages of {size} chars")
+
+        # What the old code paid per message: a fresh Fernet for every call
+        start = time.perf_counter()
+        for _ in range(count):
+            Fernet(key.encode()).encrypt(plaintext.encode())
+        self.report("fernet, new cipher per call", "encrypt", count, time.perf_counter() - start)
+
+        for mode in CIPHERS:
+            cipher = get_cipher(0, key)
+            start = time.perf_counter()
+            stored = [cipher.encrypt(plaintext, mode=mode) for _ in range(count)]
+            self.report(mode, "encrypt", count, time.perf_counter() - start)
+
+            start = time.perf_counter()
+            for content, content_blob in stored:
+                cipher.decrypt(content, content_blob)
+            self.report(mode, "decrypt", count, time.perf_counter() - start)
+
+            content, content_blob = stored[0]
+            stored_bytes = len(content.encode()) + len(content_blob or b'')
+            self.stdout.write(
+                f"{mode:<30} storage  {stored_bytes} bytes/message "
+                f"({stored_bytes - size} overhead, {len(ciphertext_text(content, content_blob))} chars on the wire)"
+            )
+
+        start = time.perf_counter()
+        for _ in range(1000):
+            RoomCipher(0, key)
+        self.report("cipher construction", "build", 1000, time.perf_counter() - start)
+
+    def report(self, label, operation, count, elapsed):
+        self.stdout.write(f"{label:<30} {operation:<8} {count / elapsed:,.0f} msg/s ({elapsed * 1e6 / count:.1f} us each)")
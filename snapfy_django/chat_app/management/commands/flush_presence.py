@@ -0,0 +1,39 @@
+# chat_app/management/commands/flush_presence.py
+import time
+import logging
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from chat_app import presence
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ("Periodically copy is_online/last_seen from the Redis presence service to Postgres in bulk, "
+            "and announce offline the users whose connections expired without a disconnect")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Flush a single time and exit")
+        parser.add_argument('--interval', type=int, default=settings.PRESENCE_FLUSH_INTERVAL)
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        channel_layer = get_channel_layer()
+        while True:
+            try:
+                swept = async_to_sync(presence.sweep_vanished)(channel_layer)
+                if swept:
+                    self.stdout.write(f"Announced {swept} vanished users offline")
+            except Exception as e:
+                logger.error(f"Presence sweep failed: {e}")
+            try:
+                written = presence.flush_dirty(batch_size=options['batch_size'])
+                if written:
+                    self.stdout.write(f"Flushed presence for {written} users")
+            except Exception as e:
+                logger.error(f"Presence flush failed: {e}")
+            if options['once']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,76 @@
+# chat_app/management/commands/manage_message_partitions.py
+import time
+import logging
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from chat_app import archive, partitions
+from chat_app.models import ChatRoom, MessageArchive
+from chat_app.views import MESSAGE_HISTORY_PAGE_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ("Keep monthly chat_app_message partitions ahead of time, detach months older than "
+            "--hot-months and optionally export detached months to compressed files")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Run a single pass and exit")
+        parser.add_argument('--interval', type=int, default=6 * 3600)
+        parser.add_argument('--ahead', type=int, default=settings.MESSAGE_PARTITIONS_AHEAD)
+        parser.add_argument('--hot-months', type=int, default=settings.MESSAGE_HOT_MONTHS,
+                            help="Months kept attached, counting the current one; 0 never detaches")
+        parser.add_argument('--export', action='store_true',
+                            help="Write detached months to MESSAGE_ARCHIVE_ROOT and drop their tables")
+        parser.add_argument('--explain', type=int, metavar='ROOM_ID',
+                            help="Print the plan of a room's newest history page and exit")
+
+    def handle(self, *args, **options):
+        if not partitions.is_partitioned():
+            raise CommandError("chat_app_message is not partitioned; run migrations on Postgres first")
+        if options['explain']:
+            self.explain(options['explain'])
+            return
+
+        while True:
+            try:
+                self.run_pass(options)
+            except Exception as e:
+                logger.error(f"Message partition maintenance failed: {e}")
+            if options['once']:
+                return
+            time.sleep(options['interval'])
+
+    def run_pass(self, options):
+        for month in partitions.ensure_partitions(options['ahead']):
+            self.stdout.write(f"Created partition {partitions.partition_name(month)}")
+
+        if options['hot_months'] > 0:
+            for month in archive.cold_months(options['hot_months']):
+                archived = archive.archive_month(month)
+                self.stdout.write(f"Detached {archived.table_name} ({archived.message_count} messages)")
+
+        if options['export']:
+            for detached in MessageArchive.objects.exclude(table_name='').order_by('month'):
+                count = archive.export_archive(detached)
+                self.stdout.write(f"Exported {count} messages for {detached.month:%Y-%m} to {detached.path}")
+
+        removed = archive.purge_exported_senders()
+        if removed:
+            self.stdout.write(f"Purged {removed} archived messages of deleted users")
+
+    def explain(self, room_id):
+        """The query a recent-history page runs first; the plan should scan only the current month's partition."""
+        room = ChatRoom.objects.get(id=room_id)
+        now = timezone.now()
+        start, end = partitions.month_bounds(partitions.month_start(now))
+        queryset = (
+            room.messages
+            .filter(sent_at__lt=now)
+            .filter(sent_at__gte=start, sent_at__lt=end)
+            .order_by('-sent_at', '-id')[:MESSAGE_HISTORY_PAGE_SIZE]
+        )
+        plan = partitions.explain(queryset)
+        self.stdout.write("\n".join(plan))
+        self.stdout.write(f"Partitions scanned: {', '.join(partitions.scanned_partitions(plan)) or 'none'}")
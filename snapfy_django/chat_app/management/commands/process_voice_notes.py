@@ -0,0 +1,64 @@
+# chat_app/management/commands/process_voice_notes.py
+import time
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+from chat_app.audio import process_voice_note
+from chat_app.models import Message
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Transcode pending voice notes to Opus and store their duration and waveform"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Process the current backlog and exit")
+        parser.add_argument('--interval', type=int, default=settings.VOICE_NOTE_POLL_INTERVAL)
+        parser.add_argument('--batch-size', type=int, default=20)
+
+    def handle(self, *args, **options):
+        while True:
+            processed = self.process_batch(options['batch_size'])
+            if processed:
+                self.stdout.write(f"Processed {processed} voice notes")
+            if options['once'] and not processed:
+                return
+            if not processed:
+                time.sleep(options['interval'])
+
+    def requeue_stale(self):
+        """Put back notes whose worker died mid-transcode: claimed longer than VOICE_NOTE_CLAIM_TIMEOUT ago."""
+        expired = timezone.now() - timedelta(seconds=settings.VOICE_NOTE_CLAIM_TIMEOUT)
+        requeued = Message.objects.filter(
+            Q(audio_claimed_at__lt=expired) | Q(audio_claimed_at__isnull=True),
+            audio_status='processing',
+        ).update(audio_status='pending', audio_claimed_at=None)
+        if requeued:
+            logger.warning(f"Requeued {requeued} voice notes left processing by a dead worker")
+        return requeued
+
+    def process_batch(self, batch_size):
+        self.requeue_stale()
+        pending_ids = list(
+            Message.objects.filter(audio_status='pending', is_deleted=False)
+            .order_by('sent_at')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        processed = 0
+        for message_id in pending_ids:
+            # Claim it, so several workers never transcode the same note
+            claimed_at = timezone.now()
+            if not Message.objects.filter(id=message_id, audio_status='pending').update(audio_status='processing', audio_claimed_at=claimed_at):
+                continue
+            message = Message.objects.select_related('room').get(id=message_id)
+            try:
+                process_voice_note(message)
+            except Exception as e:
+                logger.error(f"Voice note {message_id} failed: {e}")
+                Message.objects.filter(id=message_id, audio_claimed_at=claimed_at).update(audio_status='failed')
+            processed += 1
+        return processed
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.6 on 2026-10-19 13:00
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_app', '0018_chatroom_last_message_at_message_is_deleted_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room', 'updated_at', 'id'], name='chat_app_me_room_id_d1bde9_idx'),
+        ),
+    ]
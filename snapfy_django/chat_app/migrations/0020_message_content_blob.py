@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-19 13:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_app', '0019_message_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='content_blob',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.6 on 2026-10-19 13:10
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_app', '0020_message_content_blob'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='audio_duration',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='audio_status',
+            field=models.CharField(blank=True, choices=[('pending', 'Pending'), ('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')], max_length=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='audio_waveform',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['audio_status'], name='chat_app_me_audio_s_607616_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.6 on 2026-10-19 13:12
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_app', '0021_message_audio_metadata'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='calllog',
+            name='sdp',
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.1.6 on 2026-10-19 13:15
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_call_summary(apps, schema_editor):
+    ChatRoom = apps.get_model('chat_app', 'ChatRoom')
+    CallLog = apps.get_model('chat_app', 'CallLog')
+    ended = CallLog.objects.filter(call_end_time__isnull=False)
+    totals = (
+        ended.values('room')
+        .annotate(
+            missed=models.Count('id', filter=models.Q(call_status='missed')),
+            total=models.Sum('duration'),
+        )
+    )
+    for row in totals.iterator():
+        last_call = ended.filter(room=row['room']).order_by('-call_start_time', '-id').first()
+        ChatRoom.objects.filter(id=row['room']).update(
+            last_call=last_call,
+            missed_call_count=row['missed'],
+            total_call_duration=row['total'] or 0,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_app', '0022_remove_calllog_sdp'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_call',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat_app.calllog'),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='missed_call_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='total_call_duration',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='calllog',
+            index=models.Index(fields=['room', 'call_start_time', 'id'], name='chat_app_ca_room_id_d5fb75_idx'),
+        ),
+        migrations.RunPython(backfill_call_summary, migrations.RunPython.noop),
+    ]
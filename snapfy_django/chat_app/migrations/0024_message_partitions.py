@@ -0,0 +1,43 @@
+# Generated by Django 5.1.6 on 2026-10-19 13:19
+
+from django.db import migrations, models
+from chat_app.partitions import rebuild_message_table
+
+
+def partition_messages(apps, schema_editor):
+    # Postgres only; other backends keep a plain table and history reads skip the partition walk
+    if schema_editor.connection.vendor == 'postgresql':
+        with schema_editor.connection.cursor() as cursor:
+            rebuild_message_table(cursor, partitioned=True)
+
+
+def unpartition_messages(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        with schema_editor.connection.cursor() as cursor:
+            rebuild_message_table(cursor, partitioned=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_app', '0023_room_call_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(unique=True)),
+                ('table_name', models.CharField(blank=True, max_length=63)),
+                ('path', models.CharField(blank=True, max_length=255)),
+                ('message_count', models.PositiveIntegerField(default=0)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterModelOptions(
+            name='message',
+            options={},
+        ),
+        migrations.RunPython(partition_messages, unpartition_messages),
+    ]
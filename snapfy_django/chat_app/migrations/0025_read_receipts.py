@@ -0,0 +1,112 @@
+# Generated by Django 5.1.6 on 2026-10-19 13:25
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def receipts_from_flags(apps, schema_editor):
+    # Each member has read up to the newest message from someone else that is flagged read. One
+    # SELECT over the memberships with correlated subqueries, instead of a query per member.
+    ChatRoom = apps.get_model('chat_app', 'ChatRoom')
+    Message = apps.get_model('chat_app', 'Message')
+    ReadReceipt = apps.get_model('chat_app', 'ReadReceipt')
+    newest_read = (
+        Message.objects
+        .filter(room_id=models.OuterRef('chatroom_id'), is_read=True)
+        .exclude(sender_id=models.OuterRef('user_id'))
+        .order_by('-sent_at', '-id')
+    )
+    memberships = (
+        ChatRoom.users.through.objects
+        .annotate(
+            last_read_message_id=models.Subquery(newest_read.values('id')[:1]),
+            last_read_sent_at=models.Subquery(newest_read.values('sent_at')[:1]),
+            last_read_at=models.Subquery(newest_read.values('read_at')[:1]),
+        )
+        .filter(last_read_message_id__isnull=False)
+        .values_list('chatroom_id', 'user_id', 'last_read_sent_at', 'last_read_message_id', 'last_read_at')
+    )
+    receipts = []
+    for room_id, user_id, sent_at, message_id, read_at in memberships.iterator(chunk_size=1000):
+        receipts.append(ReadReceipt(
+            room_id=room_id,
+            user_id=user_id,
+            last_read_sent_at=sent_at,
+            last_read_message_id=message_id,
+            read_at=read_at or sent_at,
+        ))
+        if len(receipts) >= 1000:
+            ReadReceipt.objects.bulk_create(receipts)
+            receipts = []
+    ReadReceipt.objects.bulk_create(receipts)
+
+
+def flags_from_receipts(apps, schema_editor):
+    # A message is read once any member other than its sender has a receipt at or past it
+    Message = apps.get_model('chat_app', 'Message')
+    ReadReceipt = apps.get_model('chat_app', 'ReadReceipt')
+    covering = (
+        ReadReceipt.objects
+        .filter(room_id=models.OuterRef('room_id'))
+        .exclude(user_id=models.OuterRef('sender_id'))
+        .filter(
+            models.Q(last_read_sent_at__gt=models.OuterRef('sent_at'))
+            | models.Q(last_read_sent_at=models.OuterRef('sent_at'), last_read_message_id__gte=models.OuterRef('id'))
+        )
+    )
+    Message.objects.filter(models.Exists(covering), is_read=False).update(
+        is_read=True, read_at=models.Subquery(covering.order_by('read_at').values('read_at')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_app', '0024_message_partitions'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReadReceipt',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_read_sent_at', models.DateTimeField()),
+                ('last_read_message_id', models.BigIntegerField()),
+                ('read_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='readreceipt',
+            name='room',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_receipts', to='chat_app.chatroom'),
+        ),
+        migrations.AddField(
+            model_name='readreceipt',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_receipts', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='readreceipt',
+            index=models.Index(fields=['room', 'read_at'], name='chat_app_re_room_id_791e49_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='readreceipt',
+            constraint=models.UniqueConstraint(fields=('room', 'user'), name='unique_read_receipt'),
+        ),
+        migrations.RunPython(receipts_from_flags, flags_from_receipts),
+        migrations.RemoveIndex(
+            model_name='message',
+            name='chat_app_me_is_read_644327_idx',
+        ),
+        migrations.RemoveField(
+            model_name='message',
+            name='is_read',
+        ),
+        migrations.RemoveField(
+            model_name='message',
+            name='read_at',
+        ),
+    ]
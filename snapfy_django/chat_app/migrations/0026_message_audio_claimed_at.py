@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-19 14:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_app', '0025_read_receipts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='audio_claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
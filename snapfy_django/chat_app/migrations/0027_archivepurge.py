@@ -0,0 +1,21 @@
+# Generated by Django 5.1.6 on 2026-10-19 14:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_app', '0026_message_audio_claimed_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivePurge',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sender_id', models.UUIDField(unique=True)),
+                ('requested_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -19,14 +19,21 @@ class ChatRoom(models.Model):
     is_group = models.BooleanField(default=False)  # New field to distinguish group chats
     group_name = models.CharField(max_length=100, blank=True, null=True)
     admin = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='administered_groups')
+    # Call aggregates, maintained when a call ends so badges never scan CallLog
+    last_call = models.ForeignKey('CallLog', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    missed_call_count = models.PositiveIntegerField(default=0)
+    total_call_duration = models.PositiveIntegerField(default=0)  # In seconds
 
     def update_last_message(self, message):
         self.last_message_at = message.sent_at
         self.save()
     
-    def update_unread_count(self):
-        self.unread_count = self.messages.filter(is_read=False).exclude(sender__in=self.users.all()).count()
-        self.save()
+    def record_call_end(self, call_log):
+        ChatRoom.objects.filter(id=self.id).update(
+            last_call=call_log,
+            missed_call_count=models.F('missed_call_count') + (1 if call_log.call_status == 'missed' else 0),
+            total_call_duration=models.F('total_call_duration') + (call_log.duration or 0),
+        )
 
     def add_user(self, user):
         self.users.add(user)
@@ -50,22 +57,36 @@ class ChatRoom(models.Model):
         return f"ChatRoom {self.id} with {self.users.count()} users"
 
 class Message(models.Model):
+    AUDIO_STATUSES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    ]
+
     room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name="messages")
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name="sent_messages")
-    content = models.TextField(blank=True, null=True)
+    content = models.TextField(blank=True, null=True)  # Legacy Fernet token, or plain "[Deleted]"
+    content_blob = models.BinaryField(blank=True, null=True)  # AES-GCM nonce + ciphertext, see chat_app.crypto
     file = CloudinaryField('file', resource_type='auto', blank=True, null=True)
     sent_at = models.DateTimeField(auto_now_add=True)
-    is_read = models.BooleanField(default=False)
-    read_at = models.DateTimeField(null=True, blank=True)
     is_deleted = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)  # Bumped on delete too, drives reconnect sync
+    # Voice notes only, filled in by the process_voice_notes worker
+    audio_status = models.CharField(max_length=10, choices=AUDIO_STATUSES, null=True, blank=True)
+    audio_duration = models.FloatField(null=True, blank=True)  # Seconds
+    audio_waveform = models.JSONField(null=True, blank=True)  # Peaks scaled 0-100, VOICE_NOTE_WAVEFORM_BUCKETS long
+    audio_claimed_at = models.DateTimeField(null=True, blank=True)  # When a worker took it; stale claims are requeued
 
     class Meta:
-        ordering = ['sent_at']
+        # No default ordering: every history query orders explicitly, counts and updates skip the sort.
+        # On Postgres the table is partitioned by month on sent_at, see chat_app.partitions.
         indexes = [
             models.Index(fields=['room', 'sent_at']),
-            models.Index(fields=['is_read']),
+            models.Index(fields=['room', 'updated_at', 'id']),
             models.Index(fields=['is_deleted']),
             models.Index(fields=['sender']),
+            models.Index(fields=['audio_status']),
         ]
 
     def save(self, *args, **kwargs):
@@ -74,17 +95,34 @@ class Message(models.Model):
         if is_new:
             self.room.update_last_message(self)
 
-    def mark_as_read(self):
-        if not self.is_read:
-            self.is_read = True
-            self.read_at = timezone.now()
-            self.save()
-            self.room.update_unread_count()
-
     def __str__(self):
         return f"Message {self.id} in {self.room} from {self.sender}"
 
 
+class ReadReceipt(models.Model):
+    """How far a member has read a room: every message from someone else sent at or before
+    (last_read_sent_at, last_read_message_id) counts as read. One row per member per room."""
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='read_receipts')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='read_receipts')
+    last_read_sent_at = models.DateTimeField()
+    last_read_message_id = models.BigIntegerField()  # Not a ForeignKey, Message is partitioned (chat_app.partitions)
+    read_at = models.DateTimeField(default=now)  # When the watermark last moved
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['room', 'user'], name='unique_read_receipt'),
+        ]
+        indexes = [
+            models.Index(fields=['room', 'read_at']),
+        ]
+
+    def covers(self, message):
+        return message.sender_id != self.user_id and (message.sent_at, message.id) <= (self.last_read_sent_at, self.last_read_message_id)
+
+    def __str__(self):
+        return f"{self.user} read {self.room} up to message {self.last_read_message_id}"
+
+
 class CallLog(models.Model):
     CALL_TYPES = [
         ('audio', 'Audio Call'),
@@ -105,14 +143,53 @@ class CallLog(models.Model):
     call_start_time = models.DateTimeField(default=now)
     call_end_time = models.DateTimeField(null=True, blank=True)
     duration = models.IntegerField(null=True, blank=True)  # In seconds
-    sdp = models.TextField(null=True, blank=True)  # Store SDP offer
     
     def save(self, *args, **kwargs):
-        if self.call_end_time and self.call_status in ['completed', 'rejected', 'missed']:
-            self.duration = int((self.call_end_time - self.call_start_time).total_seconds()) if self.call_status == 'completed' else 0
-        else:
-            self.duration = None
+        self.duration = self.computed_duration()
         super().save(*args, **kwargs)
 
+    def computed_duration(self):
+        if self.call_end_time and self.call_status in ['completed', 'rejected', 'missed']:
+            return int((self.call_end_time - self.call_start_time).total_seconds()) if self.call_status == 'completed' else 0
+        return None
+
+    def finish(self, call_status):
+        """End the call. Returns False if it had already ended: of concurrent attempts only the one
+        that sets call_end_time wins, and only the winner may count it in the room's aggregates."""
+        self.call_end_time = now()
+        self.call_status = call_status
+        self.duration = self.computed_duration()
+        return bool(CallLog.objects.filter(id=self.id, call_end_time__isnull=True).update(
+            call_end_time=self.call_end_time, call_status=self.call_status, duration=self.duration,
+        ))
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['room', 'call_start_time', 'id']),
+        ]
+
+    def __str__(self):
+        return f"{self.caller} -> {self.receiver} ({self.call_type}, {self.call_status})"
+
+class MessageArchive(models.Model):
+    """A month of messages moved out of chat_app_message by manage_message_partitions.
+    Its rows live either in the detached partition table or, once exported, in
+    gzipped JSON lines under `path`, one file per room; see chat_app.archive."""
+    month = models.DateField(unique=True)  # First day of the month
+    table_name = models.CharField(max_length=63, blank=True)
+    path = models.CharField(max_length=255, blank=True)
+    message_count = models.PositiveIntegerField(default=0)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Archived messages for {self.month:%Y-%m}"
+
+
+class ArchivePurge(models.Model):
+    """A deleted user whose messages are still in exported archive files. Detached tables are purged
+    when the user is deleted; manage_message_partitions rewrites the files and removes these rows."""
+    sender_id = models.UUIDField(unique=True)
+    requested_at = models.DateTimeField(auto_now_add=True)
+
     def __str__(self):
-        return f"{self.caller} -> {self.receiver} ({self.call_type}, {self.call_status})"
\ No newline at end of file
+        return f"Archive purge for {self.sender_id}"
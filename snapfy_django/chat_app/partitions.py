@@ -0,0 +1,185 @@
+# chat_app/partitions.py
+import datetime
+import logging
+from django.db import connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# On Postgres chat_app_message is range-partitioned by calendar month (UTC) on sent_at:
+#   chat_app_message_p<YYYYMM>   messages sent in that month
+#   chat_app_message_default     anything no monthly partition covers, kept empty by ensure_partitions
+# Postgres wants the partition key in every unique constraint, so the primary key is (id, sent_at);
+# ids still come from the one chat_app_message_id_seq and nothing may hold a foreign key to Message.
+# Queries that bound sent_at only touch the partitions inside the bound.
+TABLE = 'chat_app_message'
+DEFAULT_PARTITION = f'{TABLE}_default'
+SEQUENCE = f'{TABLE}_id_seq'
+
+
+def month_start(value):
+    """First day of the UTC month holding a date or aware datetime."""
+    if isinstance(value, datetime.datetime):
+        value = value.astimezone(datetime.timezone.utc).date()
+    return value.replace(day=1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def month_bounds(month):
+    """[start, end) of a month as aware UTC datetimes, the partition's range."""
+    start = datetime.datetime.combine(month, datetime.time(), tzinfo=datetime.timezone.utc)
+    end = datetime.datetime.combine(add_months(month, 1), datetime.time(), tzinfo=datetime.timezone.utc)
+    return start, end
+
+
+def partition_name(month):
+    return f"{TABLE}_p{month:%Y%m}"
+
+
+def month_from_name(name):
+    try:
+        return datetime.datetime.strptime(name.rsplit('_p', 1)[1], '%Y%m').date()
+    except (IndexError, ValueError):
+        return None
+
+
+def is_partitioned():
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass", [TABLE])
+        return cursor.fetchone() is not None
+
+
+def attached_months():
+    """Months with a partition attached to chat_app_message, newest first.
+    Empty when the table is not partitioned (SQLite in tests, or before migration 0024)."""
+    if connection.vendor != 'postgresql':
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = %s::regclass",
+            [TABLE],
+        )
+        months = [month_from_name(name) for (name,) in cursor.fetchall()]
+    return sorted((month for month in months if month), reverse=True)
+
+
+def explain(queryset):
+    """The lines of Postgres' plan for a queryset."""
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN {sql}", params)
+        return [line for (line,) in cursor.fetchall()]
+
+
+def scanned_partitions(plan):
+    """Names of the partitions an EXPLAIN plan scans, sorted."""
+    return sorted({
+        word for line in plan for previous, word in zip(line.split(), line.split()[1:])
+        if previous == 'on' and word.startswith(f"{TABLE}_p")
+    })
+
+
+def create_partition(cursor, month):
+    """Create a month's partition. Rows that already landed in the default partition for that
+    month are moved into it, since Postgres refuses the new partition while they sit there."""
+    start, end = month_bounds(month)
+    name = partition_name(month)
+    cursor.execute(f'SELECT EXISTS (SELECT 1 FROM "{DEFAULT_PARTITION}" WHERE sent_at >= %s AND sent_at < %s)', [start, end])
+    if not cursor.fetchone()[0]:
+        cursor.execute(f'CREATE TABLE "{name}" PARTITION OF "{TABLE}" FOR VALUES FROM (%s) TO (%s)', [start, end])
+        return
+
+    logger.warning(f"Moving {month:%Y-%m} messages out of {DEFAULT_PARTITION}")
+    cursor.execute(f'ALTER TABLE "{TABLE}" DETACH PARTITION "{DEFAULT_PARTITION}"')
+    cursor.execute(f'CREATE TABLE "{name}" PARTITION OF "{TABLE}" FOR VALUES FROM (%s) TO (%s)', [start, end])
+    cursor.execute(
+        f'WITH moved AS (DELETE FROM "{DEFAULT_PARTITION}" WHERE sent_at >= %s AND sent_at < %s RETURNING *) '
+        f'INSERT INTO "{TABLE}" SELECT * FROM moved',
+        [start, end],
+    )
+    cursor.execute(f'ALTER TABLE "{TABLE}" ATTACH PARTITION "{DEFAULT_PARTITION}" DEFAULT')
+
+
+def ensure_partitions(ahead):
+    """Make sure this month and the next `ahead` months have partitions. Returns the months created."""
+    if not is_partitioned():
+        return []
+    existing = set(attached_months())
+    current = month_start(timezone.now())
+    created = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        for offset in range(ahead + 1):
+            month = add_months(current, offset)
+            if month not in existing:
+                create_partition(cursor, month)
+                created.append(month)
+    return created
+
+
+def detach_partition(month):
+    with connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE "{TABLE}" DETACH PARTITION "{partition_name(month)}"')
+
+
+def drop_table(name):
+    with connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS "{name}"')
+
+
+def rebuild_message_table(cursor, partitioned, ahead=3):
+    """Copy chat_app_message into a new table, range-partitioned by month or plain, keeping its
+    columns, indexes, foreign keys and id sequence. Migration 0024 runs this in both directions."""
+    old = f"{TABLE}_old"
+    cursor.execute(
+        "SELECT indexname, indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s",
+        [TABLE],
+    )
+    indexes = cursor.fetchall()
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+        [TABLE],
+    )
+    foreign_keys = cursor.fetchall()
+
+    # Index names are schema-wide, move the old ones aside so the new table can reuse them
+    cursor.execute(f'ALTER TABLE "{TABLE}" RENAME TO "{old}"')
+    for name, _ in indexes:
+        cursor.execute(f'ALTER INDEX "{name}" RENAME TO "{name}_old"')
+
+    # No INCLUDING DEFAULTS: the id default points at the old table's sequence, which goes with it
+    cursor.execute(
+        f'CREATE TABLE "{TABLE}" (LIKE "{old}" INCLUDING CONSTRAINTS INCLUDING STORAGE)'
+        + (' PARTITION BY RANGE (sent_at)' if partitioned else '')
+    )
+    cursor.execute(
+        f'ALTER TABLE "{TABLE}" ADD CONSTRAINT "{TABLE}_pkey" PRIMARY KEY '
+        + ('(id, sent_at)' if partitioned else '(id)')
+    )
+    if partitioned:
+        cursor.execute(f'CREATE TABLE "{DEFAULT_PARTITION}" PARTITION OF "{TABLE}" DEFAULT')
+        cursor.execute(f'SELECT min(sent_at) FROM "{old}"')
+        oldest = cursor.fetchone()[0]
+        month = month_start(oldest or timezone.now())
+        last = add_months(month_start(timezone.now()), ahead)
+        while month <= last:
+            create_partition(cursor, month)
+            month = add_months(month, 1)
+
+    cursor.execute(f'INSERT INTO "{TABLE}" SELECT * FROM "{old}"')
+    for name, definition in indexes:
+        if name != f"{TABLE}_pkey":
+            cursor.execute(definition.replace(' ON ONLY ', ' ON '))
+    cursor.execute(f'DROP TABLE "{old}"')
+    for name, definition in foreign_keys:
+        cursor.execute(f'ALTER TABLE "{TABLE}" ADD CONSTRAINT "{name}" {definition}')
+
+    cursor.execute(f'CREATE SEQUENCE "{SEQUENCE}" OWNED BY "{TABLE}".id')
+    cursor.execute(f"ALTER TABLE \"{TABLE}\" ALTER COLUMN id SET DEFAULT nextval('{SEQUENCE}')")
+    cursor.execute(f"SELECT setval('{SEQUENCE}', COALESCE((SELECT max(id) FROM \"{TABLE}\"), 0) + 1, false)")
@@ -0,0 +1,311 @@
+# chat_app/presence.py
+import asyncio
+import json
+import time
+import datetime
+import logging
+from django.conf import settings
+from django.core.cache import cache
+from channels.db import database_sync_to_async
+from django_redis import get_redis_connection
+from snapfy_django.redis_pool import get_redis
+from user_app.models import User
+
+logger = logging.getLogger(__name__)
+
+# presence:conns:<user_id>  hash of connection id -> {"session_id", "expires_at"}
+# presence:state:<user_id>  last announced state, "online" or "offline"; expires with the connections
+# presence:sent:<user_id>   state last delivered to contacts
+# presence:announced        set of user ids contacts were last told are online
+# presence:throttle:<user_id> / presence:pending:<user_id>  broadcast coalescing window
+# presence:last_seen        hash of user id -> epoch seconds
+# presence:dirty            set of user ids whose Postgres columns need a flush
+LAST_SEEN_KEY = "presence:last_seen"
+DIRTY_KEY = "presence:dirty"
+ANNOUNCED_KEY = "presence:announced"
+
+# Background tasks are held here until they finish; the event loop only keeps weak references
+_tasks = set()
+
+
+def conns_key(user_id):
+    return f"presence:conns:{user_id}"
+
+
+def state_key(user_id):
+    return f"presence:state:{user_id}"
+
+
+def sent_key(user_id):
+    return f"presence:sent:{user_id}"
+
+
+def throttle_key(user_id):
+    return f"presence:throttle:{user_id}"
+
+
+def pending_key(user_id):
+    return f"presence:pending:{user_id}"
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _live(entries, now):
+    """Split a connections hash into live entries and the ids of expired ones."""
+    live, expired = {}, []
+    for conn_id, raw in entries.items():
+        conn_id = _decode(conn_id)
+        try:
+            data = json.loads(raw)
+        except (json.JSONDecodeError, UnicodeDecodeError, TypeError):
+            expired.append(conn_id)
+            continue
+        if data.get("expires_at", 0) > now:
+            live[conn_id] = data
+        else:
+            expired.append(conn_id)
+    return live, expired
+
+
+def to_datetime(epoch):
+    return datetime.datetime.fromtimestamp(float(epoch), tz=datetime.timezone.utc) if epoch else None
+
+
+def run_in_background(coro):
+    """Start `coro` as a task that is kept alive until done and whose failure is logged."""
+    task = asyncio.create_task(coro)
+    _tasks.add(task)
+    task.add_done_callback(_task_done)
+    return task
+
+
+def _task_done(task):
+    _tasks.discard(task)
+    if not task.cancelled() and task.exception():
+        logger.error(f"Presence task {task.get_coro().__name__} failed: {task.exception()!r}")
+
+
+# Async side, used by UserChatConsumer
+
+async def register_connection(user_id, conn_id, session_id):
+    """Record a heartbeat for this connection. Returns True if the user just came online."""
+    now = time.time()
+    redis_client = get_redis()
+    entry = json.dumps({"session_id": session_id or "", "expires_at": now + settings.PRESENCE_TTL})
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.hset(conns_key(user_id), conn_id, entry)
+        pipe.expire(conns_key(user_id), settings.PRESENCE_TTL)
+        pipe.hset(LAST_SEEN_KEY, str(user_id), now)
+        # Expires with the connections, so a process that dies before settle_offline cannot leave
+        # the user online forever; their next connection counts as coming online again
+        pipe.set(state_key(user_id), "online", get=True, ex=settings.PRESENCE_TTL)
+        results = await pipe.execute()
+    came_online = _decode(results[-1]) != "online"
+    if came_online:
+        await redis_client.sadd(DIRTY_KEY, str(user_id))
+    return came_online
+
+
+async def heartbeat(user_id, conn_id, session_id):
+    now = time.time()
+    redis_client = get_redis()
+    entry = json.dumps({"session_id": session_id or "", "expires_at": now + settings.PRESENCE_TTL})
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.hset(conns_key(user_id), conn_id, entry)
+        pipe.expire(conns_key(user_id), settings.PRESENCE_TTL)
+        pipe.expire(state_key(user_id), settings.PRESENCE_TTL)
+        pipe.hset(LAST_SEEN_KEY, str(user_id), now)
+        await pipe.execute()
+
+
+async def live_connections(user_id):
+    """Live connections of a user as {conn_id: {"session_id", "expires_at"}}; expired ones are pruned."""
+    redis_client = get_redis()
+    live, expired = _live(await redis_client.hgetall(conns_key(user_id)), time.time())
+    if expired:
+        await redis_client.hdel(conns_key(user_id), *expired)
+    return live
+
+
+async def unregister_connection(user_id, conn_id):
+    """Drop this connection. Returns True if the user has no live connections left."""
+    redis_client = get_redis()
+    await redis_client.hdel(conns_key(user_id), conn_id)
+    await redis_client.hset(LAST_SEEN_KEY, str(user_id), time.time())
+    return not await live_connections(user_id)
+
+
+async def settle_offline(user_id, on_offline):
+    """Wait out the grace period and announce offline only if nothing reconnected meanwhile.
+    Meant to run as a background task so disconnect never blocks on it."""
+    await asyncio.sleep(settings.PRESENCE_OFFLINE_GRACE)
+    if await live_connections(user_id):
+        return
+    redis_client = get_redis()
+    previous = await redis_client.set(state_key(user_id), "offline", get=True, ex=settings.PRESENCE_TTL)
+    if _decode(previous) == "offline":
+        return
+    await redis_client.sadd(DIRTY_KEY, str(user_id))
+    await on_offline()
+
+
+async def publish_status(user_id, channel_layer):
+    """Deliver the user's current status to online contacts. Flaps are coalesced: at most one
+    update leaves per PRESENCE_BROADCAST_WINDOW, and the last state always gets through."""
+    redis_client = get_redis()
+    window_ms = int(settings.PRESENCE_BROADCAST_WINDOW * 1000)
+    if await redis_client.set(throttle_key(user_id), 1, nx=True, px=window_ms):
+        await _send_status(user_id, channel_layer)
+    elif await redis_client.set(pending_key(user_id), 1, nx=True, px=window_ms * 2):
+        # Only one deferred send per window, whichever process gets here first
+        run_in_background(_send_deferred(user_id, channel_layer))
+
+
+async def _send_deferred(user_id, channel_layer):
+    redis_client = get_redis()
+    wait_ms = await redis_client.pttl(throttle_key(user_id))
+    if wait_ms > 0:
+        await asyncio.sleep(wait_ms / 1000)
+    await redis_client.delete(pending_key(user_id))
+    await redis_client.set(throttle_key(user_id), 1, px=int(settings.PRESENCE_BROADCAST_WINDOW * 1000))
+    try:
+        await _send_status(user_id, channel_layer)
+    except Exception as e:
+        logger.error(f"Error sending deferred status for user {user_id}: {e}")
+
+
+async def _send_status(user_id, channel_layer):
+    redis_client = get_redis()
+    state = _decode(await redis_client.get(state_key(user_id))) or "offline"
+    previous = await redis_client.set(sent_key(user_id), state, get=True, ex=86400)
+    if state == "online":
+        await redis_client.sadd(ANNOUNCED_KEY, str(user_id))
+    else:
+        await redis_client.srem(ANNOUNCED_KEY, str(user_id))
+    if _decode(previous) == state:
+        return  # Contacts already have this state, the flap cancelled itself out
+
+    last_seen = _decode(await redis_client.hget(LAST_SEEN_KEY, str(user_id)))
+    event = {
+        "type": "user_status",
+        "user_id": str(user_id),
+        "is_online": state == "online",
+        "last_seen": to_datetime(last_seen).isoformat() if state != "online" and last_seen else None,
+    }
+    audience = await database_sync_to_async(get_online_audience)(user_id)
+    for contact_id in audience:
+        await channel_layer.group_send(f"user_{contact_id}", event)
+    logger.info(f"Sent status of user {user_id} ({state}) to {len(audience)} contacts")
+
+
+# Sync side, used by REST views and management commands
+
+def is_online(user_id):
+    redis_client = get_redis_connection("default")
+    live, _ = _live(redis_client.hgetall(conns_key(user_id)), time.time())
+    return bool(live)
+
+
+def get_audience(user_id):
+    """Ids of users who share a chat room with, or follow, this user. Cached briefly."""
+    cache_key = f"presence_audience_{user_id}"
+    audience = cache.get(cache_key)
+    if audience is None:
+        room_peers = User.objects.filter(chat_rooms__users__id=user_id).values_list('id', flat=True)
+        followers = User.objects.filter(following__id=user_id).values_list('id', flat=True)
+        audience = {str(peer_id) for peer_id in room_peers} | {str(follower_id) for follower_id in followers}
+        audience.discard(str(user_id))
+        audience = sorted(audience)
+        cache.set(cache_key, audience, timeout=60)
+    return audience
+
+
+def get_online_audience(user_id):
+    audience = get_audience(user_id)
+    return [contact_id for contact_id, state in get_presence(audience).items() if state["is_online"]]
+
+
+def record_seen(user_id):
+    redis_client = get_redis_connection("default")
+    redis_client.hset(LAST_SEEN_KEY, str(user_id), time.time())
+    redis_client.sadd(DIRTY_KEY, str(user_id))
+
+
+def mark_offline(user_id):
+    """Drop a user's connections, e.g. on logout. The closing sockets announce the offline
+    transition; sockets that stay open re-register on their next heartbeat."""
+    redis_client = get_redis_connection("default")
+    pipe = redis_client.pipeline()
+    pipe.delete(conns_key(user_id))
+    pipe.hset(LAST_SEEN_KEY, str(user_id), time.time())
+    pipe.sadd(DIRTY_KEY, str(user_id))
+    pipe.execute()
+
+
+def get_presence(user_ids):
+    """Batch presence lookup: {user_id: {"is_online", "last_seen"}} in two Redis round trips.
+    last_seen is None for users Redis has not seen since the last restart."""
+    user_ids = [str(user_id) for user_id in user_ids]
+    if not user_ids:
+        return {}
+    redis_client = get_redis_connection("default")
+    pipe = redis_client.pipeline()
+    for user_id in user_ids:
+        pipe.hgetall(conns_key(user_id))
+    conns = pipe.execute()
+    last_seen = redis_client.hmget(LAST_SEEN_KEY, user_ids)
+
+    now = time.time()
+    presence = {}
+    for user_id, entries, seen in zip(user_ids, conns, last_seen):
+        live, _ = _live(entries, now)
+        presence[user_id] = {
+            "is_online": bool(live),
+            "last_seen": to_datetime(_decode(seen)),
+        }
+    return presence
+
+
+async def sweep_vanished(channel_layer):
+    """Announce offline the users whose sockets went away without a disconnect, e.g. with a crashed
+    process: contacts were told they are online, but their connections and state have expired.
+    Returns how many were announced."""
+    redis_client = get_redis()
+    announced = [_decode(user_id) for user_id in await redis_client.smembers(ANNOUNCED_KEY)]
+    presence = await database_sync_to_async(get_presence)(announced)
+    swept = 0
+    for user_id, state in presence.items():
+        # A user still holding a state key is online, or settle_offline is about to announce them
+        if state["is_online"] or not await redis_client.set(state_key(user_id), "offline", nx=True, ex=settings.PRESENCE_TTL):
+            continue
+        await redis_client.sadd(DIRTY_KEY, user_id)
+        await _send_status(user_id, channel_layer)
+        swept += 1
+    return swept
+
+
+def flush_dirty(batch_size=500):
+    """Copy is_online/last_seen of changed users to Postgres with one bulk_update per batch.
+    Returns the number of users written."""
+    redis_client = get_redis_connection("default")
+    written = 0
+    while True:
+        user_ids = [_decode(user_id) for user_id in redis_client.spop(DIRTY_KEY, batch_size) or []]
+        if not user_ids:
+            return written
+        try:
+            presence = get_presence(user_ids)
+            users = list(User.objects.filter(id__in=user_ids).only('id', 'is_online', 'last_seen'))
+            for user in users:
+                state = presence[str(user.id)]
+                user.is_online = state["is_online"]
+                user.last_seen = state["last_seen"] or user.last_seen
+            User.objects.bulk_update(users, ['is_online', 'last_seen'], batch_size=batch_size)
+        except Exception:
+            # Put the batch back so the next run retries it
+            redis_client.sadd(DIRTY_KEY, *user_ids)
+            raise
+        written += len(users)
+        logger.info(f"Flushed presence for {len(users)} users")
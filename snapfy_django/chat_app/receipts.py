@@ -0,0 +1,91 @@
+# chat_app/receipts.py
+import logging
+from django.core.cache import cache
+from django.db import models
+from django.utils import timezone
+from .models import ChatRoom, Message, ReadReceipt
+
+logger = logging.getLogger(__name__)
+
+# Read receipts are per-member watermarks (ReadReceipt) rather than a flag on every message.
+# Marking a room read is one conditional UPDATE and one small event; clients work out which
+# messages are read by comparing (sent_at, id) with the watermark, as read_state() does here.
+
+
+def after_watermark(sent_at, message_id):
+    """Messages past a (sent_at, id) watermark, in keyset order like the history cursors."""
+    return models.Q(sent_at__gt=sent_at) | models.Q(sent_at=sent_at, id__gt=message_id)
+
+
+def room_receipts(room_id):
+    return list(ReadReceipt.objects.filter(room_id=room_id))
+
+
+def read_state(message, receipts):
+    """(is_read, read_at) of a message: read once another member's watermark covers it,
+    at the earliest such member's read_at."""
+    read_times = [receipt.read_at for receipt in receipts if receipt.covers(message)]
+    return (True, min(read_times)) if read_times else (False, None)
+
+
+def unread_counts(room_id, user_ids):
+    """{user_id: undeleted messages from others past that user's watermark}, one count per user on the (room, sent_at) index."""
+    watermarks = {receipt.user_id: receipt for receipt in ReadReceipt.objects.filter(room_id=room_id, user_id__in=user_ids)}
+    counts = {}
+    for user_id in user_ids:
+        messages = Message.objects.filter(room_id=room_id, is_deleted=False).exclude(sender_id=user_id)
+        receipt = watermarks.get(user_id)
+        if receipt:
+            messages = messages.filter(after_watermark(receipt.last_read_sent_at, receipt.last_read_message_id))
+        counts[user_id] = messages.count()
+    return counts
+
+
+def unread_count(room_id, user_id):
+    return unread_counts(room_id, [user_id])[user_id]
+
+
+def advance_read_receipt(room_id, user_id, message_id=None):
+    """Move a member's watermark up to `message_id`, or to the room's newest message.
+    Watermarks only move forward, so this is one conditional UPDATE (an INSERT the first time).
+    Returns the new receipt, or None when it was already there."""
+    messages = Message.objects.filter(room_id=room_id)
+    if message_id:
+        messages = messages.filter(id=message_id)
+    newest = messages.order_by('-sent_at', '-id').values_list('sent_at', 'id').first()
+    if not newest:
+        return None
+    sent_at, newest_id = newest
+    read_at = timezone.now()
+
+    def advance():
+        return (
+            ReadReceipt.objects
+            .filter(room_id=room_id, user_id=user_id)
+            .filter(models.Q(last_read_sent_at__lt=sent_at) | models.Q(last_read_sent_at=sent_at, last_read_message_id__lt=newest_id))
+            .update(last_read_sent_at=sent_at, last_read_message_id=newest_id, read_at=read_at)
+        )
+
+    if not advance():
+        _, created = ReadReceipt.objects.get_or_create(
+            room_id=room_id,
+            user_id=user_id,
+            defaults={"last_read_sent_at": sent_at, "last_read_message_id": newest_id, "read_at": read_at},
+        )
+        # A concurrent first read may have created the row, with an older watermark than ours
+        if not created and not advance():
+            return None
+    # Cached message pages carry read state
+    member_ids = ChatRoom.users.through.objects.filter(chatroom_id=room_id).values_list('user_id', flat=True)
+    cache.delete_many([f"messages_{room_id}_{member_id}" for member_id in member_ids])
+    return ReadReceipt(room_id=room_id, user_id=user_id, last_read_sent_at=sent_at, last_read_message_id=newest_id, read_at=read_at)
+
+
+def receipt_payload(receipt):
+    return {
+        "room_id": str(receipt.room_id),
+        "user_id": str(receipt.user_id),
+        "last_read_message_id": str(receipt.last_read_message_id),
+        "last_read_sent_at": receipt.last_read_sent_at.isoformat(),
+        "read_at": receipt.read_at.isoformat(),
+    }
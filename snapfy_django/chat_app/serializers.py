@@ -1,6 +1,9 @@
 from rest_framework import serializers
 from .models import *
 from user_app.serializer import UserSerializer
+from .crypto import ciphertext_text
+from .uploads import attachment_url
+from .receipts import room_receipts, read_state, unread_count
 
 class ChatRoomSerializer(serializers.ModelSerializer):
     users = UserSerializer(many=True)
@@ -8,11 +11,12 @@ class ChatRoomSerializer(serializers.ModelSerializer):
     unread_count = serializers.SerializerMethodField()
     encryption_key = serializers.SerializerMethodField()
     admin = UserSerializer(read_only=True)
+    call_summary = serializers.SerializerMethodField()
 
     class Meta:
         model = ChatRoom
         fields = ['id', 'users', 'created_at', 'last_message_at', 'last_message', 
-                 'unread_count', 'encryption_key', 'is_group', 'group_name', 'admin']
+                 'unread_count', 'encryption_key', 'is_group', 'group_name', 'admin', 'call_summary']
         read_only_fields = ['id', 'created_at', 'last_message_at']
 
     def get_last_message(self, obj):
@@ -24,9 +28,23 @@ class ChatRoomSerializer(serializers.ModelSerializer):
     def get_unread_count(self, obj):
         request = self.context.get('request')
         if request and request.user.is_authenticated:
-            return obj.messages.filter(is_read=False).exclude(sender=request.user).count()
+            return unread_count(obj.id, request.user.id)
         return 0
 
+    def get_call_summary(self, obj):
+        last_call = obj.last_call
+        return {
+            "last_call": {
+                "id": str(last_call.id),
+                "call_type": last_call.call_type,
+                "call_status": last_call.call_status,
+                "call_start_time": last_call.call_start_time,
+                "duration": last_call.duration,
+            } if last_call else None,
+            "missed_call_count": obj.missed_call_count,
+            "total_call_duration": obj.total_call_duration,
+        }
+
     def get_encryption_key(self, obj):
         return obj.encryption_key
 
@@ -34,28 +52,45 @@ class ChatRoomSerializer(serializers.ModelSerializer):
         data = super().to_representation(instance)
         data['id'] = str(data['id'])
         return data
+
+
+class InboxChatRoomSerializer(ChatRoomSerializer):
+    """Inbox rows: last_message comes from the shared room previews passed in context,
+    unread_count from the inbox_unread_count annotation."""
+
+    def get_last_message(self, obj):
+        return self.context['previews'].get(obj.id)
+
+    def get_unread_count(self, obj):
+        return obj.inbox_unread_count
+
     
 class MessageSerializer(serializers.ModelSerializer):
     sender = UserSerializer(read_only=True)
     file_url = serializers.SerializerMethodField()
-    is_read = serializers.BooleanField(read_only=True)
     is_deleted = serializers.BooleanField(read_only=True)
     tempId = serializers.CharField(required=False, write_only=True)  # Add tempId field
 
     class Meta:
         model = Message
-        fields = ['id', 'room', 'sender', 'content', 'file_url', 'sent_at', 'is_read', 'read_at', 'is_deleted', 'tempId']
-        read_only_fields = ['id', 'sender', 'sent_at', 'is_read', 'read_at']
+        fields = ['id', 'room', 'sender', 'content', 'file_url', 'sent_at', 'updated_at', 'is_deleted',
+                  'audio_status', 'audio_duration', 'audio_waveform', 'tempId']
+        read_only_fields = ['id', 'sender', 'sent_at', 'updated_at', 'audio_status', 'audio_duration', 'audio_waveform']
 
     def get_file_url(self, obj):
-        if obj.file:
-            return obj.file.url
-        return None
+        return attachment_url(obj.file)
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
         data['id'] = str(data['id'])
         data['room'] = str(instance.room.id)
+        if instance.content_blob:
+            data['content'] = ciphertext_text(instance.content, instance.content_blob)
+        # Derived from the room's watermarks; pass them as context['receipts'] when serializing a page
+        receipts = self.context.get('receipts')
+        is_read, read_at = read_state(instance, room_receipts(instance.room_id) if receipts is None else receipts)
+        data['is_read'] = is_read
+        data['read_at'] = serializers.DateTimeField().to_representation(read_at) if read_at else None
         # Include tempId if it was provided during creation
         if hasattr(instance, 'tempId'):
             data['tempId'] = instance.tempId
@@ -67,5 +102,5 @@ class CallLogSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = CallLog
-        fields = ['room', 'id', 'caller', 'receiver', 'call_type', 'call_status', 'call_start_time', 'call_end_time', 'duration', 'sdp']
+        fields = ['room', 'id', 'caller', 'receiver', 'call_type', 'call_status', 'call_start_time', 'call_end_time', 'duration']
         read_only_fields = ['id', 'call_start_time', 'duration']
\ No newline at end of file
@@ -0,0 +1,17 @@
+# chat_app/signals.py
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from user_app.models import User
+from . import archive
+from .models import ChatRoom
+
+
+# Live messages go with the CASCADE; cold months are outside it
+@receiver(post_delete, sender=ChatRoom)
+def purge_archived_room(sender, instance, **kwargs):
+    archive.purge_room(instance.id)
+
+
+@receiver(post_delete, sender=User)
+def purge_archived_sender(sender, instance, **kwargs):
+    archive.purge_sender(instance.id)
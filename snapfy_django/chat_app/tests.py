@@ -1,3 +1,718 @@
-from django.test import TestCase
+import io
+import os
+import gzip
+import time
+import wave
+import shutil
+import asyncio
+import tempfile
+from datetime import timedelta
+from unittest import mock, skipUnless
+import numpy as np
+import cloudinary
+from cloudinary.utils import compute_hex_hash
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core import serializers
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import QuerySet
+from django.test import TestCase, TransactionTestCase, override_settings, tag
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from snapfy_django.redis_pool import get_redis
+from snapfy_django.testing import FakeRedisMixin, capture_queries, connect_socket, receive_all
+from user_app.models import User
+from . import archive, partitions, presence, receipts
+from .consumers import UserChatConsumer
+from .models import ArchivePurge, CallLog, ChatRoom, Message, MessageArchive, ReadReceipt
+from .uploads import consume_upload, get_backend, issue_upload, verify_upload
+from .utils import SEND_PENDING, claim_send, get_room_previews, make_cursor, preview_key, send_key
+
+
+class ChatSocketTestCase(FakeRedisMixin, TransactionTestCase):
+    # TransactionTestCase: database_sync_to_async closes connections, which TestCase's transaction can't survive
+
+    def make_user(self, username):
+        return User.objects.create(username=username, email=f"{username}@example.com", is_verified=True)
+
+    def make_room(self, *users):
+        room = ChatRoom.objects.create()
+        room.users.add(*users)
+        return room
+
+    async def connect(self, user, params=""):
+        communicator = await connect_socket(UserChatConsumer, "/ws/user/chat/", user, params)
+        await receive_all(communicator)  # connection_established and presence
+        return communicator
+
+
+class RoomMembershipTests(ChatSocketTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user("alice")
+        self.room = self.make_room(self.user)
+        self.other_room = ChatRoom.objects.create()
+
+    async def test_messages_need_no_membership_queries(self):
+        communicator = await self.connect(self.user)
+        layer = get_channel_layer()
+        async with capture_queries() as queries:
+            for room in (self.room, self.other_room):
+                await layer.group_send(f"user_{self.user.id}", {
+                    "type": "chat_message", "message": {"id": "1"}, "room_id": str(room.id), "unread_count": 1,
+                })
+            frames = await receive_all(communicator)
+
+        self.assertEqual([frame["type"] for frame in frames], ["chat_message", "chat_list_update"])
+        self.assertEqual(queries, [])
+        await communicator.disconnect()
+
+    async def test_membership_events_update_the_cached_rooms(self):
+        communicator = await self.connect(self.user)
+        layer = get_channel_layer()
+        group = f"user_{self.user.id}"
+        await layer.group_send(group, {"type": "room_membership", "room_id": str(self.other_room.id), "action": "add"})
+        await layer.group_send(group, {"type": "room_membership", "room_id": str(self.room.id), "action": "remove"})
+        for room in (self.room, self.other_room):
+            await layer.group_send(group, {
+                "type": "chat_message", "message": {"id": "1"}, "room_id": str(room.id), "unread_count": 0,
+            })
+        frames = await receive_all(communicator)
+
+        self.assertEqual([frame["type"] for frame in frames], ["chat_list_update", "chat_message"])
+        await communicator.disconnect()
+
+
+class ReconnectSyncTests(ChatSocketTestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice, self.bob = self.make_user("alice"), self.make_user("bob")
+        self.room = self.make_room(self.alice, self.bob)
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def send(self, content):
+        response = self.client.post("/api/chatrooms/send-message/", {"room_id": self.room.id, "content": content}, format="json")
+        return Message.objects.get(id=response.data["message"]["id"])
+
+    def delete(self, message):
+        self.client.post(f"/api/chatrooms/{self.room.id}/delete-message/", {"message_id": message.id}, format="json")
+
+    async def sync(self, communicator, rooms, **options):
+        await communicator.send_json_to({"type": "sync", "rooms": rooms, **options})
+        [frame] = await receive_all(communicator)
+        return frame
+
+    async def test_only_changes_after_the_cursor_come_back(self):
+        first, tied, last = [await database_sync_to_async(self.send)(text) for text in ("one", "two", "three")]
+        # All three changed at the same instant; the cursor stopped at `tied`
+        since = timezone.now() - timedelta(minutes=1)
+        await database_sync_to_async(Message.objects.filter(room=self.room).update)(updated_at=since)
+        cursor = make_cursor(since, tied.id)
+        await database_sync_to_async(self.delete)(first)
+        newest = await database_sync_to_async(self.send)("four")
+
+        communicator = await self.connect(self.alice)
+        room_id = str(self.room.id)
+        frame = await self.sync(communicator, {room_id: cursor})
+        [result] = frame["rooms"]
+        self.assertEqual(frame["type"], "sync_result")
+        self.assertEqual([message["content"] for message in result["messages"]], ["three", "four"])
+        self.assertEqual(result["updates"], [{"id": str(first.id), "is_deleted": True}])
+        self.assertFalse(result["has_more"])
+        newest = await database_sync_to_async(Message.objects.get)(id=newest.id)
+        self.assertEqual(result["cursor"], make_cursor(newest.updated_at, newest.id))
+
+        # Paged, the first page stops after the tie and the next one resumes from there
+        [page] = (await self.sync(communicator, {room_id: cursor}, limit=1))["rooms"]
+        self.assertEqual(([message["id"] for message in page["messages"]], page["has_more"]), ([str(last.id)], True))
+        [page] = (await self.sync(communicator, {room_id: page["cursor"]}, limit=1))["rooms"]
+        self.assertEqual((page["updates"], page["has_more"]), (result["updates"], True))
+
+        [caught_up] = (await self.sync(communicator, {room_id: result["cursor"]}))["rooms"]
+        self.assertEqual((caught_up["messages"], caught_up["updates"]), ([], []))
+        self.assertEqual(caught_up["cursor"], result["cursor"])
+        await communicator.disconnect()
+
+    async def test_malformed_cursors_and_foreign_rooms(self):
+        other_room = await database_sync_to_async(self.make_room)(self.bob)
+        communicator = await self.connect(self.alice)
+        frame = await self.sync(communicator, {str(self.room.id): "not-a-cursor", str(other_room.id): make_cursor(timezone.now(), 1)})
+        # A room the user is not in is left out altogether
+        self.assertEqual(frame["rooms"], [{"room_id": str(self.room.id), "error": "Invalid cursor"}])
+        self.assertEqual(
+            await self.sync(communicator, ["not", "a", "map"]),
+            {"type": "error", "error": "rooms must map room ids to cursors"},
+        )
+        await communicator.disconnect()
+
+
+class PresenceTests(ChatSocketTestCase):
+    async def test_vanished_connection_is_announced_offline(self):
+        alice, bob = await database_sync_to_async(lambda: (self.make_user("alice"), self.make_user("bob")))()
+        await database_sync_to_async(self.make_room)(alice, bob)
+        bob_socket = await self.connect(bob)
+        alice_socket = await self.connect(alice)
+        self.assertEqual([frame["is_online"] for frame in await receive_all(bob_socket)], [True])
+
+        # Alice's process dies: no disconnect, her connection and state just expire
+        redis_client = get_redis()
+        await redis_client.delete(presence.conns_key(alice.id), presence.state_key(alice.id))
+        self.assertEqual(await presence.sweep_vanished(get_channel_layer()), 1)
+        frames = await receive_all(bob_socket)
+        self.assertEqual([(frame["user_id"], frame["is_online"]) for frame in frames], [(str(alice.id), False)])
+        self.assertEqual(await presence.sweep_vanished(get_channel_layer()), 0)
+
+        await alice_socket.disconnect()
+        await bob_socket.disconnect()
+
+
+@tag('load')
+@override_settings(PRESENCE_BROADCAST_WINDOW=0.2)
+class PresenceBroadcastLoadTests(FakeRedisMixin, TransactionTestCase):
+    """5k sockets, each user in a 1:1 room with the next: status changes used to go to the
+    all_users group, i.e. every socket; now they reach online contacts only."""
+    SOCKETS = 5000
+    CHANGES = 20
+    CHANGE_RATE = 50
+
+    def setUp(self):
+        super().setUp()
+        self.users = User.objects.bulk_create(
+            User(username=f"user{index}", email=f"user{index}@example.com") for index in range(self.SOCKETS)
+        )
+        rooms = ChatRoom.objects.bulk_create(ChatRoom() for _ in range(self.SOCKETS))
+        members = ChatRoom.users.through
+        members.objects.bulk_create(
+            members(chatroom_id=room.id, user_id=user.id)
+            for index, room in enumerate(rooms)
+            for user in (self.users[index], self.users[(index + 1) % self.SOCKETS])
+        )
+
+    async def count_deliveries(self, layer, send_all):
+        delivered = 0
+        send = layer.send
+
+        async def counting_send(channel, message):
+            nonlocal delivered
+            delivered += 1
+            await send(channel, message)
+
+        layer.send = counting_send
+        started = time.perf_counter()
+        await send_all()
+        elapsed = time.perf_counter() - started
+        layer.send = send
+        return delivered, elapsed
+
+    async def test_status_changes_reach_contacts_only(self):
+        layer = get_channel_layer()
+        layer.capacity = self.SOCKETS * self.CHANGES
+        for index, user in enumerate(self.users):
+            await presence.register_connection(user.id, f"conn{index}", f"session{index}")
+            await layer.group_add(f"user_{user.id}", f"socket{index}")
+            await layer.group_add("all_users", f"socket{index}")
+        changed = self.users[:self.CHANGES]
+
+        async def broadcast_all_users():
+            for user in changed:
+                await layer.group_send("all_users", {"type": "user_status", "user_id": str(user.id), "is_online": True, "last_seen": None})
+
+        async def publish_to_contacts():
+            for user in changed:
+                await presence.publish_status(user.id, layer)
+
+        before, before_seconds = await self.count_deliveries(layer, broadcast_all_users)
+        after, after_seconds = await self.count_deliveries(layer, publish_to_contacts)
+        # What the channel layer must carry when CHANGE_RATE users connect or disconnect per second
+        print(
+            f"\n{self.SOCKETS} sockets, {self.CHANGES} status changes in {before_seconds:.2f}s / {after_seconds:.2f}s: "
+            f"all_users {before} messages, {before * self.CHANGE_RATE // self.CHANGES}/s at {self.CHANGE_RATE} changes/s; "
+            f"contacts {after} messages, {after * self.CHANGE_RATE // self.CHANGES}/s"
+        )
+        self.assertEqual(before, self.SOCKETS * self.CHANGES)
+        self.assertEqual(after, 2 * self.CHANGES)  # Each user's two room peers
+
+    async def test_flaps_are_coalesced(self):
+        alice, bob = self.users[0], self.users[1]
+        layer = get_channel_layer()
+        await presence.register_connection(bob.id, "bob", "bob")
+        await layer.group_add(f"user_{bob.id}", "bob-socket")
+        redis_client = get_redis()
+        for flap in range(10):
+            await redis_client.set(presence.state_key(alice.id), "online" if flap % 2 == 0 else "offline")
+            await presence.publish_status(alice.id, layer)
+        await asyncio.sleep(0.5)  # The deferred send after the window
+
+        states = []
+        while "bob-socket" in layer.channels:  # Dropped once drained
+            states.append((await layer.receive("bob-socket"))["is_online"])
+        self.assertEqual(states, [True, False])
+
+
+class SendMessageTests(FakeRedisMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username="alice", email="alice@example.com", is_verified=True)
+        self.room = ChatRoom.objects.create()
+        self.room.users.add(self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def send(self, temp_id):
+        return self.client.post("/api/chatrooms/send-message/", {"room_id": self.room.id, "content": "hi", "tempId": temp_id}, format="json")
+
+    def test_failed_send_frees_its_temp_id(self):
+        with mock.patch("chat_app.crypto.RoomCipher.encrypt", side_effect=ValueError("bad key")):
+            with self.assertRaises(ValueError):
+                self.send("t1")
+        response = self.send("t1")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.send("t1").data["message"]["id"], response.data["message"]["id"])
+        self.assertEqual(Message.objects.count(), 1)
+
+    def test_pending_claim_lapses_quickly(self):
+        self.assertIsNone(claim_send(self.user.id, "t2"))
+        self.assertEqual(claim_send(self.user.id, "t2"), SEND_PENDING)
+        self.assertLessEqual(cache.ttl(send_key(self.user.id, "t2")), settings.CHAT_SEND_PENDING_TTL)
+
+
+class ReadReceiptTests(FakeRedisMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create(username="alice", email="alice@example.com", is_verified=True)
+        self.bob = User.objects.create(username="bob", email="bob@example.com", is_verified=True)
+        self.room = ChatRoom.objects.create()
+        self.room.users.add(self.alice, self.bob)
+        self.first, self.second, self.third = [self.message(self.bob) for _ in range(3)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def message(self, sender, **fields):
+        return Message.objects.create(room=self.room, sender=sender, content="[Deleted]", **fields)
+
+    def watermark(self):
+        return ReadReceipt.objects.get(room=self.room, user=self.alice).last_read_message_id
+
+    def mark_as_read(self, message=None):
+        data = {"message_id": message.id} if message else {}
+        response = self.client.post(f"/api/chatrooms/{self.room.id}/mark-as-read/", data, format="json")
+        self.assertEqual(response.status_code, 200)
+        return response.data["receipt"]
+
+    def test_the_watermark_never_moves_backwards(self):
+        self.assertEqual(self.mark_as_read(self.second)["last_read_message_id"], str(self.second.id))
+        self.assertIsNone(self.mark_as_read(self.first))
+        self.assertIsNone(self.mark_as_read(self.second))
+        self.assertEqual(self.watermark(), self.second.id)
+        self.assertEqual(self.mark_as_read()["last_read_message_id"], str(self.third.id))
+        self.assertIsNone(receipts.advance_read_receipt(self.room.id, self.alice.id, self.first.id))
+        self.assertEqual(self.watermark(), self.third.id)
+
+    def test_a_concurrent_first_read_makes_one_receipt(self):
+        update = QuerySet.update
+        raced = []
+
+        def racing_update(queryset, **fields):
+            updated = update(queryset, **fields)
+            if not raced:
+                raced.append(None)
+                # Another device's first read lands between this one's UPDATE and INSERT
+                raced[0] = receipts.advance_read_receipt(self.room.id, self.alice.id, self.first.id)
+            return updated
+
+        with mock.patch.object(QuerySet, "update", autospec=True, side_effect=racing_update):
+            receipt = receipts.advance_read_receipt(self.room.id, self.alice.id, self.third.id)
+
+        self.assertEqual(raced[0].last_read_message_id, self.first.id)
+        self.assertEqual(receipt.last_read_message_id, self.third.id)
+        self.assertEqual(ReadReceipt.objects.filter(room=self.room, user=self.alice).count(), 1)
+        self.assertEqual(self.watermark(), self.third.id)
+
+    def test_unread_counts_skip_own_and_deleted_messages(self):
+        self.message(self.alice)
+        self.message(self.bob, is_deleted=True)
+        users = [self.alice.id, self.bob.id]
+        self.assertEqual(receipts.unread_counts(self.room.id, users), {self.alice.id: 3, self.bob.id: 1})
+        receipts.advance_read_receipt(self.room.id, self.alice.id, self.first.id)
+        self.assertEqual(receipts.unread_counts(self.room.id, users), {self.alice.id: 2, self.bob.id: 1})
+        [row] = self.client.get("/api/chatrooms/my-chats/").data
+        self.assertEqual(row["unread_count"], 2)
+
+
+class RoomPreviewTests(FakeRedisMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create(username="alice", email="alice@example.com", is_verified=True)
+        self.bob = User.objects.create(username="bob", email="bob@example.com", is_verified=True)
+        self.room = ChatRoom.objects.create()
+        self.room.users.add(self.alice, self.bob)
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def send(self, content):
+        response = self.client.post("/api/chatrooms/send-message/", {"room_id": self.room.id, "content": content}, format="json")
+        return response.data["message"]["id"]
+
+    def delete(self, message_id):
+        self.client.force_authenticate(self.alice)
+        response = self.client.post(f"/api/chatrooms/{self.room.id}/delete-message/", {"message_id": message_id}, format="json")
+        self.assertEqual(response.status_code, 200)
+
+    def inbox_preview(self, user):
+        self.client.force_authenticate(user)
+        [row] = self.client.get("/api/chatrooms/my-chats/").data
+        return row["last_message"] and row["last_message"]["content"]
+
+    def test_deleting_the_last_message_falls_back_to_the_one_before(self):
+        self.send("one")
+        second = self.send("two")
+        self.assertEqual(self.inbox_preview(self.bob), "two")
+        self.delete(second)
+        # Every member shares the preview, so neither sees the deleted message
+        self.assertEqual(self.inbox_preview(self.bob), "one")
+        self.assertEqual(self.inbox_preview(self.alice), "one")
+
+    def test_a_missing_preview_is_rebuilt_once_and_cached(self):
+        first = self.send("one")
+        cache.delete(preview_key(self.room.id))
+        with self.assertNumQueries(2):
+            self.assertEqual(get_room_previews([self.room])[self.room.id]["content"], "one")
+        with self.assertNumQueries(0):
+            self.assertEqual(get_room_previews([self.room])[self.room.id]["content"], "one")
+
+        # A room with nothing visible left caches that too
+        self.delete(first)
+        self.assertIsNone(self.inbox_preview(self.alice))
+        with self.assertNumQueries(0):
+            self.assertEqual(get_room_previews([self.room]), {self.room.id: None})
+
+
+class LocalUploadTestCase(FakeRedisMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        local = override_settings(CHAT_UPLOAD_BACKEND='local', MEDIA_ROOT=media_root)
+        local.enable()
+        self.addCleanup(local.disable)
+        self.user = User.objects.create(username="alice", email="alice@example.com", is_verified=True)
+        self.room = ChatRoom.objects.create()
+        self.room.users.add(self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, data=b"voice"):
+        descriptor = self.client.post("/api/chatrooms/upload-url/", {"kind": "audio"}).data
+        file = SimpleUploadedFile("note.webm", data)
+        self.assertEqual(self.client.post(descriptor["url"], {**descriptor["fields"], "file": file}, format="multipart").status_code, 201)
+        return descriptor["public_id"]
+
+    def send(self, public_id):
+        return self.client.post("/api/chatrooms/send-message/", {"room_id": self.room.id, "upload": {"public_id": public_id}}, format="json")
+
+
+class UploadTests(LocalUploadTestCase):
+    def test_an_upload_backs_one_message(self):
+        public_id = self.upload()
+        self.assertEqual(self.send(public_id).status_code, 201)
+        self.assertEqual(self.send(public_id).status_code, 400)
+        self.assertEqual(Message.objects.count(), 1)
+
+    def test_racing_sends_consume_once(self):
+        public_id = self.upload()
+        self.assertEqual(verify_upload(self.user.id, {"public_id": public_id})[1], 'audio')
+        self.assertEqual(verify_upload(self.user.id, {"public_id": public_id})[1], 'audio')
+        self.assertEqual([consume_upload(public_id), consume_upload(public_id)], [True, False])
+
+    def test_oversized_upload_is_rejected_and_deleted(self):
+        public_id = self.upload(b"x" * 64)
+        with override_settings(CHAT_UPLOAD_MAX_BYTES=32):
+            self.assertEqual(self.send(public_id).status_code, 400)
+        self.assertFalse(get_backend().storage.exists(public_id))
+        self.assertEqual(Message.objects.count(), 0)
+
+    @override_settings(CHAT_UPLOAD_BACKEND='cloudinary')
+    def test_cloudinary_size_comes_from_storage(self):
+        public_id = issue_upload(self.user.id, 'file')["public_id"]
+        signature = compute_hex_hash(f"public_id={public_id}&version=1" + cloudinary.config().api_secret, 'sha1')
+        upload = {"public_id": public_id, "version": 1, "signature": signature, "resource_type": "raw", "bytes": 10}
+        with mock.patch("cloudinary.api.resource", return_value={"bytes": settings.CHAT_UPLOAD_MAX_BYTES + 1}), \
+                mock.patch("cloudinary.uploader.destroy") as destroy:
+            self.assertEqual(verify_upload(self.user.id, upload), (None, None))
+        destroy.assert_called_once_with(public_id, resource_type='raw')
+
+
+def sine_wav(seconds, rate=16000):
+    """A 440 Hz tone whose amplitude ramps from 10% to 80%, as 16-bit mono WAV."""
+    t = np.arange(int(seconds * rate)) / rate
+    pcm = (np.sin(2 * np.pi * 440 * t) * np.linspace(0.1, 0.8, t.size) * 32767).astype('<i2')
+    out = io.BytesIO()
+    with wave.open(out, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(pcm.tobytes())
+    return out.getvalue()
+
+
+class VoiceNoteTests(LocalUploadTestCase):
+    def test_sine_wave_is_transcoded_with_duration_and_waveform(self):
+        wav = sine_wav(2.0)
+        public_id = self.upload(wav)
+        self.assertEqual(self.send(public_id).data["message"]["audio_status"], 'pending')
+        call_command('process_voice_notes', '--once', stdout=io.StringIO())
+
+        message = Message.objects.get()
+        self.assertEqual(message.audio_status, 'ready')
+        self.assertAlmostEqual(message.audio_duration, 2.0, delta=0.1)
+        waveform = message.audio_waveform
+        self.assertEqual(len(waveform), settings.VOICE_NOTE_WAVEFORM_BUCKETS)
+        self.assertEqual(max(waveform), 100)
+        self.assertLess(waveform[0], 25)  # The ramp: quiet start, loudest at the end
+        self.assertGreater(waveform[-1], 90)
+        self.assertEqual(waveform, sorted(waveform, key=lambda peak: peak // 5))  # Rising, give or take codec noise
+
+        storage = get_backend().storage
+        self.assertTrue(message.file.public_id.endswith('_opus'))
+        with storage.open(message.file.public_id, 'rb') as opus:
+            data = opus.read()
+        self.assertEqual(data[:4], b'OggS')
+        self.assertLess(len(data), len(wav) / 5)
+        self.assertFalse(storage.exists(public_id))
+
+    def test_stale_claims_are_requeued(self):
+        public_id = self.upload(sine_wav(0.5))
+        self.send(public_id)
+        message = Message.objects.get()
+        # A worker claimed it and died
+        Message.objects.filter(id=message.id).update(
+            audio_status='processing',
+            audio_claimed_at=timezone.now() - timedelta(seconds=settings.VOICE_NOTE_CLAIM_TIMEOUT + 1),
+        )
+        call_command('process_voice_notes', '--once', stdout=io.StringIO())
+        message.refresh_from_db()
+        self.assertEqual(message.audio_status, 'ready')
+
+    def test_live_claims_are_left_alone(self):
+        public_id = self.upload(sine_wav(0.5))
+        self.send(public_id)
+        Message.objects.update(audio_status='processing', audio_claimed_at=timezone.now())
+        call_command('process_voice_notes', '--once', stdout=io.StringIO())
+        self.assertEqual(Message.objects.get().audio_status, 'processing')
+
+
+class IceBatchingTests(ChatSocketTestCase):
+    CANDIDATES = 30  # Per peer, about what a browser with a few interfaces trickles
+
+    async def make_peers(self):
+        self.alice, self.bob = await database_sync_to_async(lambda: (self.make_user("alice"), self.make_user("bob")))()
+        self.room = await database_sync_to_async(self.make_room)(self.alice, self.bob)
+
+    async def call_setup(self, caller, callee, callee_params):
+        """Offer, answer and a full trickle each way; returns the layer messages and what the callee got."""
+        caller_socket = await self.connect(caller, "ice_batch=1")
+        callee_socket = await self.connect(callee, callee_params)
+        layer = get_channel_layer()
+        sent = []
+        group_send = layer.group_send
+
+        async def counting_group_send(group, message):
+            sent.append(message["type"])
+            await group_send(group, message)
+
+        layer.group_send = counting_group_send
+        signal = {"call_id": "7", "room_id": str(self.room.id)}
+        await caller_socket.send_json_to({**signal, "type": "call_offer", "target_user_id": str(callee.id), "sdp": {"type": "offer"}})
+        await callee_socket.send_json_to({**signal, "type": "call_answer", "target_user_id": str(caller.id), "sdp": {"type": "answer"}})
+        for socket, target in ((caller_socket, callee), (callee_socket, caller)):
+            for index in range(self.CANDIDATES):
+                await socket.send_json_to({**signal, "type": "ice_candidate", "target_user_id": str(target.id), "candidate": {"candidate": f"c{index}"}})
+            await socket.send_json_to({**signal, "type": "ice_candidate", "target_user_id": str(target.id), "candidate": None})
+        received = await receive_all(callee_socket)
+        layer.group_send = group_send
+        await caller_socket.disconnect()
+        await callee_socket.disconnect()
+        return sent, received
+
+    async def test_channel_layer_messages_per_call_setup(self):
+        await self.make_peers()
+        sent, received = await self.call_setup(self.alice, self.bob, "ice_batch=1")
+        unbatched = 2 + 2 * self.CANDIDATES  # Offer, answer, then one message per candidate
+        print(f"\nCall setup with {self.CANDIDATES} candidates per peer: {len(sent)} channel-layer messages, {unbatched} unbatched")
+
+        self.assertEqual(sent.count("call_offer") + sent.count("call_answer"), 2)
+        self.assertLessEqual(sent.count("ice_candidates"), 2 * (self.CANDIDATES // 20 + 1))
+        batches = [frame for frame in received if frame["type"] == "ice_candidates"]
+        self.assertEqual([candidate["candidate"] for batch in batches for candidate in batch["candidates"]], [f"c{index}" for index in range(self.CANDIDATES)])
+        self.assertTrue(batches[-1]["end_of_candidates"])
+
+    async def test_old_clients_get_one_frame_per_candidate(self):
+        await self.make_peers()
+        sent, received = await self.call_setup(self.alice, self.bob, "")
+        self.assertLessEqual(sent.count("ice_candidates"), 2 * (self.CANDIDATES // 20 + 1))
+        candidates = [frame for frame in received if frame["type"] == "ice_candidate"]
+        self.assertEqual([frame["candidate"]["candidate"] for frame in candidates], [f"c{index}" for index in range(self.CANDIDATES)])
+        self.assertFalse([frame for frame in received if frame["type"] == "ice_candidates"])
+
+
+class EndCallTests(FakeRedisMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create(username="alice", email="alice@example.com", is_verified=True)
+        self.bob = User.objects.create(username="bob", email="bob@example.com", is_verified=True)
+        self.room = ChatRoom.objects.create()
+        self.room.users.add(self.alice, self.bob)
+        self.call = CallLog.objects.create(room=self.room, caller=self.alice, receiver=self.bob, call_type='audio')
+
+    def end_call(self, user, call_status):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.post(f"/api/chatrooms/{self.room.id}/end-call/", {"call_id": self.call.id, "call_status": call_status}, format="json")
+
+    def test_racing_hang_ups_count_the_call_once(self):
+        # Both requests loaded the call before either ended it
+        first, second = CallLog.objects.get(id=self.call.id), CallLog.objects.get(id=self.call.id)
+        self.assertEqual([first.finish('missed'), second.finish('missed')], [True, False])
+
+    def test_second_end_call_changes_nothing(self):
+        self.assertEqual(self.end_call(self.alice, 'missed').status_code, 200)
+        response = self.end_call(self.bob, 'missed')
+        self.assertEqual(response.data["call_status"], 'missed')
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.missed_call_count, 1)
+        self.assertEqual(self.room.last_call_id, self.call.id)
+
+
+class MessageArchiveTestCase(FakeRedisMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create(username="alice", email="alice@example.com", is_verified=True)
+        self.bob = User.objects.create(username="bob", email="bob@example.com", is_verified=True)
+        self.room = ChatRoom.objects.create()
+        self.room.users.add(self.alice, self.bob)
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def message(self, sender, sent_at=None):
+        message = Message.objects.create(room=self.room, sender=sender, content="[Deleted]", is_deleted=True)
+        if sent_at:
+            Message.objects.filter(id=message.id).update(sent_at=sent_at)
+        return message
+
+
+class MessageArchiveTests(MessageArchiveTestCase):
+    def setUp(self):
+        super().setUp()
+        self.archive_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.archive_root)
+
+    def export(self, month, messages):
+        """A MessageArchive for `month` whose export holds `messages`, as export_archive writes it."""
+        path = os.path.join(self.archive_root, f"{month:%Y-%m}")
+        os.makedirs(path)
+        with gzip.open(os.path.join(path, f"{self.room.id}.jsonl.gz"), 'wt', encoding='utf-8') as out:
+            for message in messages:
+                out.write(serializers.serialize('jsonl', [message]))
+        return MessageArchive.objects.create(month=month, path=path, message_count=len(messages))
+
+    def detach(self, month, messages):
+        """A MessageArchive for `month` whose detached table holds `messages`."""
+        table = partitions.partition_name(month)
+        ids = ", ".join(str(message.id) for message in messages)
+        with connection.cursor() as cursor:
+            cursor.execute(f'CREATE TABLE "{table}" AS SELECT * FROM "{partitions.TABLE}" WHERE id IN ({ids})')
+        self.addCleanup(partitions.drop_table, table)
+        return MessageArchive.objects.create(month=month, table_name=table, message_count=len(messages))
+
+    def archived_ids(self, archived):
+        return [message.id for message in archive.read_archive(archived, self.room.id, (timezone.now(), 0), 100)]
+
+    @override_settings(MESSAGE_HOT_MONTHS=1)
+    def test_messages_endpoint_stops_at_the_hot_months(self):
+        old = self.message(self.alice, timezone.now() - timedelta(days=100))
+        recent = self.message(self.bob)
+
+        messages = self.client.get(f"/api/chatrooms/{self.room.id}/messages/").data
+        self.assertEqual([message["id"] for message in messages], [str(recent.id)])
+        history = self.client.get(f"/api/chatrooms/{self.room.id}/history/").data
+        self.assertEqual([message["id"] for message in history["results"]], [str(old.id), str(recent.id)])
+
+    def test_deleting_a_room_purges_its_cold_months(self):
+        month = partitions.month_start(timezone.now() - timedelta(days=100))
+        detached = self.detach(month, [self.message(self.alice), self.message(self.bob)])
+        exported = self.export(partitions.add_months(month, -1), [self.message(self.alice)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.room.delete()
+
+        self.assertEqual(self.archived_ids(detached), [])
+        self.assertFalse(os.listdir(exported.path))
+        self.assertEqual(
+            list(MessageArchive.objects.order_by('month').values_list('message_count', flat=True)), [0, 0],
+        )
+
+    def test_deleting_a_user_purges_their_archived_messages(self):
+        month = partitions.month_start(timezone.now() - timedelta(days=100))
+        kept = self.message(self.alice)
+        detached = self.detach(month, [kept, self.message(self.bob)])
+        exported = self.export(partitions.add_months(month, -1), [kept, self.message(self.bob)])
+
+        self.bob.delete()
+        self.assertEqual(self.archived_ids(detached), [kept.id])
+        self.assertEqual(ArchivePurge.objects.count(), 1)
+
+        self.assertEqual(archive.purge_exported_senders(), 1)
+        self.assertEqual(self.archived_ids(exported), [kept.id])
+        self.assertFalse(ArchivePurge.objects.exists())
+        self.assertEqual(
+            list(MessageArchive.objects.order_by('month').values_list('message_count', flat=True)), [1, 1],
+        )
+
+
+@skipUnless(connection.vendor == 'postgresql', "Partition pruning needs Postgres")
+class PartitionPruningTests(MessageArchiveTestCase):
+    """EXPLAIN the queries recent history runs: they must only scan the hot months' partitions."""
+
+    def setUp(self):
+        super().setUp()
+        if not partitions.is_partitioned():
+            self.skipTest("chat_app_message is not partitioned")
+        current = partitions.month_start(timezone.now())
+        existing = set(partitions.attached_months())
+        with connection.cursor() as cursor:
+            for offset in range(-6, settings.MESSAGE_PARTITIONS_AHEAD + 1):
+                month = partitions.add_months(current, offset)
+                if month not in existing:
+                    partitions.create_partition(cursor, month)
+        for offset in range(7):
+            self.message(self.alice, timezone.now() - timedelta(days=30 * offset))
+
+    def assertScansFrom(self, plan, first_month):
+        scanned = partitions.scanned_partitions(plan)
+        self.assertTrue(scanned, "\n".join(plan))
+        self.assertTrue(all(partitions.month_from_name(name) >= first_month for name in scanned), "\n".join(plan))
+
+    @override_settings(MESSAGE_HOT_MONTHS=1)
+    def test_messages_endpoint_scans_only_hot_partitions(self):
+        plan = partitions.explain(archive.recent_messages(self.room)[:200])
+        self.assertScansFrom(plan, archive.hot_cutoff(1))
+
+    def test_newest_history_page_scans_only_the_current_month(self):
+        for _ in range(5):
+            self.message(self.bob)
+        with CaptureQueriesContext(connection) as context:
+            live, _ = archive.message_history(self.room, (timezone.now(), 0), 5)
+        self.assertEqual(len(live), 5)
+        history = [query["sql"] for query in context.captured_queries if f'FROM "{partitions.TABLE}"' in query["sql"]]
+        self.assertEqual(len(history), 1)
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN {history[0]}")
+            plan = [line for (line,) in cursor.fetchall()]
+        self.assertEqual(partitions.scanned_partitions(plan), [partitions.partition_name(partitions.month_start(timezone.now()))])
 
-# Create your tests here.
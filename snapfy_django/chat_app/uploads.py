@@ -0,0 +1,206 @@
+# chat_app/uploads.py
+import os
+import time
+import shutil
+import uuid
+import logging
+import requests
+import cloudinary
+import cloudinary.api
+import cloudinary.uploader
+from cloudinary import CloudinaryResource
+from cloudinary.utils import api_sign_request, verify_api_response_signature
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+logger = logging.getLogger(__name__)
+
+# Attachments go straight from the client to storage:
+#   1. POST chatrooms/upload-url/ issues a short-lived descriptor for a fresh public_id
+#   2. the client uploads the file to descriptor["url"] with descriptor["fields"]
+#   3. send-message references the asset as {"upload": {...}}; verify() checks it before it is stored
+# chat_upload:<public_id> remembers who a descriptor was issued to until it is used or expires.
+# Nothing in the descriptor stops a client uploading more than max_bytes, so verify_upload checks the
+# size storage reports and deletes oversized assets; consume_upload lets only one message have it.
+UPLOAD_KINDS = ('file', 'audio')
+
+
+def upload_key(public_id):
+    return f"chat_upload:{public_id}"
+
+
+class CloudinaryUploadBackend:
+    """Signed Cloudinary uploads. Cloudinary signs its upload response, so the client cannot
+    claim an asset it did not upload under the public_id we issued."""
+
+    def descriptor(self, public_id, kind):
+        config = cloudinary.config()
+        params = {"public_id": public_id, "timestamp": int(time.time())}
+        resource_type = 'video' if kind == 'audio' else 'auto'  # Cloudinary files audio under video
+        return {
+            "url": f"https://api.cloudinary.com/v1_1/{config.cloud_name}/{resource_type}/upload",
+            "method": "POST",
+            "fields": {
+                **params,
+                "api_key": config.api_key,
+                "signature": api_sign_request(params, config.api_secret),
+            },
+        }
+
+    def verify(self, public_id, upload):
+        """Return the CloudinaryResource to store, or None if the upload response does not check out."""
+        version, signature = upload.get('version'), upload.get('signature')
+        if not version or not signature or not verify_api_response_signature(public_id, version, signature):
+            return None
+        return CloudinaryResource(
+            public_id,
+            format=upload.get('format'),
+            version=version,
+            type='upload',
+            resource_type=upload.get('resource_type') or 'raw',
+        )
+
+    def size(self, resource):
+        """Bytes Cloudinary stored, from the Admin API rather than anything the client reported."""
+        return cloudinary.api.resource(resource.public_id, resource_type=resource.resource_type)['bytes']
+
+    def url(self, resource):
+        return resource.url
+
+    def download(self, resource, dst_path):
+        with requests.get(resource.url, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            with open(dst_path, 'wb') as out:
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    out.write(chunk)
+
+    def store(self, src_path, public_id):
+        """Server-side upload of a file we produced ourselves, e.g. a transcoded voice note."""
+        result = cloudinary.uploader.upload(src_path, public_id=public_id, resource_type='video')
+        return CloudinaryResource(
+            result['public_id'],
+            format=result.get('format'),
+            version=result.get('version'),
+            type='upload',
+            resource_type=result.get('resource_type', 'video'),
+        )
+
+    def delete(self, resource):
+        cloudinary.uploader.destroy(resource.public_id, resource_type=resource.resource_type)
+
+
+class LocalUploadBackend:
+    """Stand-in for tests and local development: files land under MEDIA_ROOT/chat_uploads
+    through chatrooms/local-upload/, authorised by a signed token instead of a Cloudinary signature."""
+
+    salt = "chat_app.uploads.local"
+
+    def __init__(self):
+        self.storage = FileSystemStorage(
+            location=os.path.join(settings.MEDIA_ROOT, 'chat_uploads'),
+            base_url=f"{settings.MEDIA_URL}chat_uploads/",
+        )
+
+    def descriptor(self, public_id, kind):
+        return {
+            "url": "/api/chatrooms/local-upload/",
+            "method": "POST",
+            "fields": {"token": signing.dumps(public_id, salt=self.salt)},
+        }
+
+    def unsign(self, token):
+        """public_id for a token issued by descriptor(), or None once it is forged or expired."""
+        try:
+            return signing.loads(token, salt=self.salt, max_age=settings.CHAT_UPLOAD_TTL)
+        except signing.BadSignature:
+            return None
+
+    def save(self, public_id, file):
+        if self.storage.exists(public_id):
+            self.storage.delete(public_id)
+        self.storage.save(public_id, file)
+
+    def verify(self, public_id, upload):
+        if not self.storage.exists(public_id):
+            return None
+        return CloudinaryResource(public_id, type='upload', resource_type='raw')
+
+    def size(self, resource):
+        return self.storage.size(resource.public_id)
+
+    def url(self, resource):
+        return self.storage.url(resource.public_id)
+
+    def download(self, resource, dst_path):
+        with self.storage.open(resource.public_id, 'rb') as src, open(dst_path, 'wb') as out:
+            shutil.copyfileobj(src, out)
+
+    def store(self, src_path, public_id):
+        with open(src_path, 'rb') as src:
+            self.save(public_id, File(src))
+        return CloudinaryResource(public_id, type='upload', resource_type='raw')
+
+    def delete(self, resource):
+        self.storage.delete(resource.public_id)
+
+
+BACKENDS = {
+    'cloudinary': CloudinaryUploadBackend,
+    'local': LocalUploadBackend,
+}
+
+
+def get_backend():
+    return BACKENDS[settings.CHAT_UPLOAD_BACKEND]()
+
+
+def issue_upload(user_id, kind):
+    public_id = f"chat/{user_id}/{uuid.uuid4().hex}"
+    cache.set(upload_key(public_id), {"user_id": str(user_id), "kind": kind}, timeout=settings.CHAT_UPLOAD_TTL)
+    descriptor = get_backend().descriptor(public_id, kind)
+    descriptor.update({
+        "public_id": public_id,
+        "kind": kind,
+        "max_bytes": settings.CHAT_UPLOAD_MAX_BYTES,
+        "expires_in": settings.CHAT_UPLOAD_TTL,
+    })
+    return descriptor
+
+
+def verify_upload(user_id, upload):
+    """Check an uploaded-asset reference sent with a message.
+    Returns (resource, kind), or (None, None) if it was not issued to this user, expired, or never arrived."""
+    public_id = upload.get('public_id') if isinstance(upload, dict) else None
+    issued = cache.get(upload_key(public_id)) if public_id else None
+    if not issued or issued["user_id"] != str(user_id):
+        return None, None
+    backend = get_backend()
+    resource = backend.verify(public_id, upload)
+    if resource is None:
+        logger.warning(f"Upload {public_id} by user {user_id} failed verification")
+        return None, None
+    size = backend.size(resource)
+    if size > settings.CHAT_UPLOAD_MAX_BYTES:
+        logger.warning(f"Upload {public_id} by user {user_id} is {size} bytes, over the limit; deleting it")
+        backend.delete(resource)
+        consume_upload(public_id)
+        return None, None
+    return resource, issued["kind"]
+
+
+def consume_upload(public_id):
+    """An asset backs one message: drop its descriptor before that message is written.
+    The delete is atomic, so of two sends racing with the same upload only one gets True."""
+    return bool(cache.delete(upload_key(public_id)))
+
+
+def release_upload(user_id, public_id, kind):
+    """Undo consume_upload when the message it was for could not be written."""
+    cache.set(upload_key(public_id), {"user_id": str(user_id), "kind": kind}, timeout=settings.CHAT_UPLOAD_TTL)
+
+
+def attachment_url(file):
+    return get_backend().url(file) if file else None
@@ -0,0 +1,139 @@
+# chat_app/utils.py
+from channels.layers import get_channel_layer
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.utils import timezone
+from django.core.cache import cache
+from django.db import models
+from .models import ChatRoom, Message
+from .uploads import attachment_url
+from .crypto import get_cipher, decrypt_message
+import logging
+import datetime
+
+logger = logging.getLogger(__name__)
+
+
+def notify_membership_change(room_id, user_ids, action):
+    """Tell the sockets of `user_ids` that they joined ('add') or left ('remove') a room,
+    so each UserChatConsumer can keep its in-memory membership set current."""
+    channel_layer = get_channel_layer()
+    if not channel_layer:
+        logger.warning("Channel layer not available, membership change not broadcast")
+        return
+
+    for user_id in user_ids:
+        async_to_sync(channel_layer.group_send)(
+            f"user_{user_id}",
+            {
+                "type": "room_membership",
+                "room_id": str(room_id),
+                "action": action,
+            }
+        )
+
+
+# Idempotent sends: chat_send:<sender_id>:<tempId> -> id of the message that tempId created
+SEND_PENDING = "pending"
+
+
+def send_key(sender_id, temp_id):
+    return f"chat_send:{sender_id}:{temp_id}"
+
+
+def claim_send(sender_id, temp_id):
+    """Reserve a client tempId before creating its message.
+    Returns None when the caller owns the send and should create the message, otherwise the id
+    of the message already created for it, or SEND_PENDING while the first attempt is in flight.
+    The claim lapses after CHAT_SEND_PENDING_TTL, should its owner die without releasing it."""
+    key = send_key(sender_id, temp_id)
+    if cache.add(key, SEND_PENDING, timeout=settings.CHAT_SEND_PENDING_TTL):
+        return None
+    return cache.get(key)
+
+
+def complete_send(sender_id, temp_id, message_id):
+    cache.set(send_key(sender_id, temp_id), str(message_id), timeout=settings.CHAT_SEND_IDEMPOTENCY_TTL)
+
+
+def release_send(sender_id, temp_id):
+    """Forget a claim whose send failed so the client's retry can go through."""
+    cache.delete(send_key(sender_id, temp_id))
+
+
+# Inbox previews: room_preview:<room_id> -> last visible message of the room, already decrypted.
+# One entry per room shared by every member, so a send rewrites one key instead of N inboxes.
+PREVIEW_LENGTH = 120
+
+
+def preview_key(room_id):
+    return f"room_preview:{room_id}"
+
+
+def build_preview(message, content):
+    return {
+        "id": str(message.id),
+        "content": content[:PREVIEW_LENGTH] if content else content,
+        "file_url": attachment_url(message.file),
+        "is_deleted": False,
+        "sent_at": message.sent_at.isoformat(),
+        "sender": {
+            "id": str(message.sender.id),
+            "username": message.sender.username,
+        },
+    }
+
+
+def set_room_preview(message, content):
+    cache.set(preview_key(message.room_id), build_preview(message, content), timeout=settings.CHAT_PREVIEW_TTL)
+
+
+def invalidate_room_preview(room_id):
+    cache.delete(preview_key(room_id))
+
+
+def get_room_previews(rooms):
+    """Previews for the inbox as {room id: preview or None}, read with one MGET.
+    Misses are rebuilt from the database in two queries and cached for the next reader."""
+    keys = {preview_key(room.id): room for room in rooms}
+    cached = cache.get_many(list(keys))
+    previews = {room.id: cached[key] or None for key, room in keys.items() if key in cached}
+
+    missing = [room for key, room in keys.items() if key not in cached]
+    if missing:
+        last_ids = dict(
+            ChatRoom.objects
+            .filter(id__in=[room.id for room in missing])
+            .annotate(last_id=models.Subquery(
+                Message.objects
+                .filter(room=models.OuterRef('pk'), is_deleted=False)
+                .order_by('-sent_at')
+                .values('id')[:1]
+            ))
+            .values_list('id', 'last_id')
+        )
+        last_messages = Message.objects.select_related('sender').in_bulk(
+            [last_id for last_id in last_ids.values() if last_id]
+        )
+        for room in missing:
+            message = last_messages.get(last_ids.get(room.id))
+            preview = build_preview(message, decrypt_message(get_cipher(room.id, room.encryption_key), message)) if message else None
+            # add(), not set(): a send that raced this rebuild has the newer preview
+            cache.add(preview_key(room.id), preview or {}, timeout=settings.CHAT_PREVIEW_TTL)
+            previews[room.id] = preview
+    return previews
+
+
+def parse_cursor(cursor):
+    """Keyset cursors are "<timestamp iso>|<id>", as handed out by reconnect sync and call history.
+    Returns (timestamp, id) or None if the cursor is malformed."""
+    try:
+        timestamp, pk = str(cursor).rsplit('|', 1)
+        parsed = datetime.datetime.fromisoformat(timestamp)
+        return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed), int(pk)
+    except (ValueError, TypeError):
+        return None
+
+
+def make_cursor(timestamp, pk):
+    return f"{timestamp.isoformat()}|{pk}"
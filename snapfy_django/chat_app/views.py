@@ -3,24 +3,39 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework import status
-from cryptography.fernet import Fernet, InvalidToken
 import base64
 import binascii
-from .models import ChatRoom, Message, CallLog
+from .models import ChatRoom, Message, CallLog, ReadReceipt
 from user_app.models import User
-from .serializers import ChatRoomSerializer, MessageSerializer, UserSerializer, CallLogSerializer
+from .serializers import ChatRoomSerializer, InboxChatRoomSerializer, MessageSerializer, UserSerializer, CallLogSerializer
 from notification_app.utils import create_call_notification, create_new_chat_notification
+from .utils import (
+    notify_membership_change, claim_send, complete_send, release_send, SEND_PENDING,
+    set_room_preview, invalidate_room_preview, get_room_previews, parse_cursor, make_cursor,
+)
+from . import presence, calls
+from .uploads import UPLOAD_KINDS, LocalUploadBackend, get_backend, issue_upload, verify_upload, consume_upload, release_upload, attachment_url
+from .crypto import get_cipher, decrypt_message, decrypt_messages, ciphertext_text
+from .archive import message_history, recent_messages
+from .receipts import room_receipts, unread_counts, advance_read_receipt, receipt_payload
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 from django.utils import timezone
 from django.db import models
 from django.core.cache import cache
+from django.conf import settings
+from django.core.exceptions import ValidationError
 import json
 
 import logging
 
 logger = logging.getLogger(__name__)
 
+CALL_HISTORY_PAGE_SIZE = 20
+CALL_HISTORY_MAX_PAGE_SIZE = 100
+MESSAGE_HISTORY_PAGE_SIZE = 50
+MESSAGE_HISTORY_MAX_PAGE_SIZE = 200
+
 class ChatAPIViewSet(viewsets.ModelViewSet):
     queryset = ChatRoom.objects.all()
     permission_classes = [IsAuthenticated]
@@ -31,41 +46,34 @@ class ChatAPIViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['get'], url_path='my-chats')
     def my_chats(self, request):
-        cache_key = f"my_chats_{request.user.id}"
-        cached_data = cache.get(cache_key)
-        if cached_data:
-            return Response(cached_data)
-
-        chat_rooms = (
+        # No per-user inbox cache: last messages come from the room previews, which every
+        # member shares and a send updates in place, so nothing here needs invalidating
+        my_receipt = ReadReceipt.objects.filter(room=models.OuterRef('pk'), user=request.user)
+        chat_rooms = list(
             self.get_queryset()
-            .select_related('admin')
+            .select_related('admin', 'last_call')
             .prefetch_related(
                 models.Prefetch(
                     'users',
                     queryset=User.objects.only('id', 'username', 'profile_picture', 'is_online', 'last_seen')
-                ),
-                models.Prefetch(
-                    'messages',
-                    queryset=Message.objects.select_related('sender').order_by('-sent_at')
                 )
             )
+            .annotate(
+                read_sent_at=models.Subquery(my_receipt.values('last_read_sent_at')[:1]),
+                read_message_id=models.Subquery(my_receipt.values('last_read_message_id')[:1]),
+            )
+            .annotate(inbox_unread_count=models.Count(
+                'messages',
+                filter=~models.Q(messages__sender=request.user) & models.Q(messages__is_deleted=False) & (
+                    models.Q(read_sent_at__isnull=True)
+                    | models.Q(messages__sent_at__gt=models.F('read_sent_at'))
+                    | models.Q(messages__sent_at=models.F('read_sent_at'), messages__id__gt=models.F('read_message_id'))
+                )
+            ))
             .order_by('-last_message_at')
         )
-        serializer = self.get_serializer(chat_rooms, many=True, context={'request': request})
-        data = serializer.data
-
-        for room_data in data:
-            if room_data['last_message'] and not room_data['last_message']['is_deleted']:
-                try:
-                    fernet = Fernet(room_data['encryption_key'].encode())
-                    room_data['last_message']['content'] = fernet.decrypt(
-                        room_data['last_message']['content'].encode()
-                    ).decode()
-                except (InvalidToken, ValueError, binascii.Error):
-                    room_data['last_message']['content'] = '[Decryption Error]'
-
-        cache.set(cache_key, data, timeout=60)  # Cache for 1 minute
-        return Response(data)
+        context = {'request': request, 'previews': get_room_previews(chat_rooms)}
+        return Response(InboxChatRoomSerializer(chat_rooms, many=True, context=context).data)
 
     @action(detail=False, methods=['post'], url_path='start-chat')
     def start_chat(self, request):
@@ -84,10 +92,10 @@ class ChatAPIViewSet(viewsets.ModelViewSet):
                 # Create a new chat room
                 chat_room = ChatRoom.objects.create()
                 chat_room.users.add(request.user, other_user)
-                cache.delete(f"my_chats_{request.user.id}")
-                cache.delete(f"my_chats_{other_user.id}")
+                notify_membership_change(chat_room.id, [request.user.id, other_user.id], 'add')
             
             serializer = ChatRoomSerializer(chat_room, context={'request': request})
+            other_presence = presence.get_presence([other_user.id])[str(other_user.id)]
             return Response({
                 "room_id": str(chat_room.id),
                 "room": serializer.data,
@@ -95,8 +103,8 @@ class ChatAPIViewSet(viewsets.ModelViewSet):
                     "id": str(other_user.id),
                     "username": other_user.username,
                     "profile_picture": other_user.profile_picture.url if other_user.profile_picture else None,
-                    "is_online": other_user.is_online,
-                    "last_seen": other_user.last_seen
+                    "is_online": other_presence["is_online"],
+                    "last_seen": other_presence["last_seen"] or other_user.last_seen
                 }
             }, status=status.HTTP_200_OK)
         except User.DoesNotExist:
@@ -112,15 +120,18 @@ class ChatAPIViewSet(viewsets.ModelViewSet):
 
         chat_room = ChatRoom.objects.create(is_group=True, group_name=group_name, admin=request.user)  # Set creator as admin
         chat_room.users.add(request.user)  # Add creator to the group
+        member_ids = [request.user.id]
 
         for username in usernames:
             try:
                 user = User.objects.get(username=username)
                 if user != request.user:
                     chat_room.users.add(user)
+                    member_ids.append(user.id)
             except User.DoesNotExist:
                 pass  # Silently skip invalid usernames
 
+        notify_membership_change(chat_room.id, member_ids, 'add')
         serializer = ChatRoomSerializer(chat_room, context={'request': request})
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -139,6 +150,7 @@ class ChatAPIViewSet(viewsets.ModelViewSet):
             if user in chat_room.users.all():
                 return Response({"error": "User already in group"}, status=status.HTTP_400_BAD_REQUEST)
             chat_room.add_user(user)
+            notify_membership_change(chat_room.id, [user.id], 'add')
             return Response(ChatRoomSerializer(chat_room, context={'request': request}).data, status=status.HTTP_200_OK)
         except User.DoesNotExist:
             return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
@@ -162,6 +174,7 @@ class ChatAPIViewSet(viewsets.ModelViewSet):
             if chat_room.users.count() <= 2:  # Prevent emptying group
                 return Response({"error": "Cannot remove last member"}, status=status.HTTP_400_BAD_REQUEST)
             chat_room.remove_user(user)
+            notify_membership_change(chat_room.id, [user.id], 'remove')
             return Response(ChatRoomSerializer(chat_room, context={'request': request}).data, status=status.HTTP_200_OK)
         except User.DoesNotExist:
             return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
@@ -176,6 +189,7 @@ class ChatAPIViewSet(viewsets.ModelViewSet):
             return Response({"error": "Admin cannot leave the group"}, status=status.HTTP_400_BAD_REQUEST)
 
         chat_room.remove_user(request.user)
+        notify_membership_change(chat_room.id, [request.user.id], 'remove')
         return Response({"message": "You have left the group"}, status=status.HTTP_200_OK)
 
     @action(detail=True, methods=['post'], url_path='update-group-name')
@@ -200,38 +214,80 @@ class ChatAPIViewSet(viewsets.ModelViewSet):
         if cached_data:
             return Response(cached_data)
 
+        # The newest page of the hot months, oldest first; older messages are paged through history/
         messages = (
-            chat_room.messages
+            recent_messages(chat_room)
             .select_related('sender')
-            .only('id', 'content', 'file', 'sent_at', 'is_read', 'read_at', 'is_deleted', 'sender__id', 'sender__username', 'sender__profile_picture')
-            .order_by('sent_at')
+            .only('id', 'content', 'content_blob', 'file', 'sent_at', 'updated_at', 'is_deleted',
+                  'audio_status', 'audio_duration', 'audio_waveform', 'sender__id', 'sender__username', 'sender__profile_picture')
         )
-        serializer = MessageSerializer(messages, many=True, context={'request': request})
-        data = serializer.data
-
+        messages = list(messages[:MESSAGE_HISTORY_MAX_PAGE_SIZE])
+        messages.reverse()
         try:
-            fernet = Fernet(chat_room.encryption_key.encode())
-            for msg in data:
-                if not msg['is_deleted'] and msg['content']:
-                    try:
-                        msg['content'] = fernet.decrypt(msg['content'].encode()).decode()
-                    except (InvalidToken, ValueError):
-                        msg['content'] = '[Decryption Error]'
+            # One cached cipher for the whole page
+            plaintexts = decrypt_messages(chat_room.id, chat_room.encryption_key, messages)
         except (ValueError, binascii.Error) as e:
             return Response({"error": f"Invalid encryption key: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+        serializer = MessageSerializer(messages, many=True, context={'request': request, 'receipts': room_receipts(chat_room.id)})
+        data = serializer.data
+        for message, msg in zip(messages, data):
+            if message.id in plaintexts:
+                msg['content'] = plaintexts[message.id]
+
         cache.set(cache_key, data, timeout=300)  # Cache for 5 minutes
         return Response(data)
 
+    @action(detail=True, methods=['get'], url_path='history')
+    def get_message_history(self, request, pk=None):
+        """Older messages, a page at a time: ?cursor=<next_cursor>&limit=. Pages are oldest first, ready to
+        prepend; each month is its own partition query, and months archived out of Postgres are read through."""
+        chat_room = self.get_object()
+        try:
+            limit = max(1, min(int(request.query_params.get('limit') or MESSAGE_HISTORY_PAGE_SIZE), MESSAGE_HISTORY_MAX_PAGE_SIZE))
+        except (TypeError, ValueError):
+            return Response({"error": "limit must be a number"}, status=status.HTTP_400_BAD_REQUEST)
+        cursor = request.query_params.get('cursor')
+        before = parse_cursor(cursor) if cursor else (timezone.now(), 0)
+        if not before:
+            return Response({"error": "Invalid cursor"}, status=status.HTTP_400_BAD_REQUEST)
+
+        live, archived = message_history(chat_room, before, limit + 1)
+        page = (live + archived)[:limit]
+        has_more = len(live) + len(archived) > limit
+        try:
+            plaintexts = decrypt_messages(chat_room.id, chat_room.encryption_key, page[:len(live)])
+            # Archived rows are not in the table any more, so there is nothing to re-encrypt
+            plaintexts.update(decrypt_messages(chat_room.id, chat_room.encryption_key, page[len(live):], migrate=False))
+        except (ValueError, binascii.Error) as e:
+            return Response({"error": f"Invalid encryption key: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        page.reverse()
+        data = MessageSerializer(page, many=True, context={'request': request, 'receipts': room_receipts(chat_room.id)}).data
+        for message, msg in zip(page, data):
+            if message.id in plaintexts:
+                msg['content'] = plaintexts[message.id]
+        return Response({
+            "results": data,
+            "next_cursor": make_cursor(page[0].sent_at, page[0].id) if has_more else None,
+        })
+
     @action(detail=False, methods=['post'], url_path='send-message')
     def send_message(self, request):
         logger.info(f"Received request to send-message: {request.data}")
         recipient_username = request.data.get('recipient_username')
         content = request.data.get('content', '')
-        file = request.FILES.get('file')
+        file = request.FILES.get('file')  # Legacy multipart path, new clients upload directly and send `upload`
+        upload = request.data.get('upload')
         temp_id = request.data.get('tempId')
 
-        if not content and not file:
+        if isinstance(upload, str):
+            try:
+                upload = json.loads(upload)
+            except json.JSONDecodeError:
+                return Response({"error": "Invalid upload reference"}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not content and not file and not upload:
             logger.warning("No content or file provided in request")
             return Response({"error": "No content or file provided"}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -252,8 +308,7 @@ class ChatAPIViewSet(viewsets.ModelViewSet):
                     chat_room = ChatRoom.objects.create()
                     chat_room.users.add(request.user, other_user)
                     new_chat = True
-                    cache.delete(f"my_chats_{request.user.id}")
-                    cache.delete(f"my_chats_{other_user.id}")
+                    notify_membership_change(chat_room.id, [request.user.id, other_user.id], 'add')
             except User.DoesNotExist:
                 logger.error(f"Recipient not found: {recipient_username}")
                 return Response({"error": "Recipient not found"}, status=status.HTTP_404_NOT_FOUND)
@@ -269,17 +324,68 @@ class ChatAPIViewSet(viewsets.ModelViewSet):
                 logger.error(f"Chat room not found: {request.data.get('room_id')}")
                 return Response({"error": "Chat room not found"}, status=status.HTTP_404_NOT_FOUND)
 
-        logger.info("Encrypting message content")
-        fernet = Fernet(chat_room.encryption_key.encode())
-        encrypted_content = fernet.encrypt(content.encode()).decode() if content else ''
+        cipher = get_cipher(chat_room.id, chat_room.encryption_key)
 
-        logger.info("Creating new message")
-        message = Message.objects.create(
-            room=chat_room,
-            sender=request.user,
-            content=encrypted_content,
-            file=file if file else None
-        )
+        # A retried tempId gets the original message back: no second row, no second fan-out
+        if temp_id:
+            existing_id = claim_send(request.user.id, temp_id)
+            if existing_id == SEND_PENDING:
+                logger.info(f"Send of tempId {temp_id} by user {request.user.id} still in flight")
+                return Response({"error": "Message is still being sent", "tempId": temp_id}, status=status.HTTP_409_CONFLICT)
+            existing = Message.objects.select_related('sender').filter(id=existing_id, room=chat_room).first() if existing_id else None
+            if existing:
+                logger.info(f"Duplicate send of tempId {temp_id} by user {request.user.id}, returning message {existing.id}")
+                message_data = MessageSerializer(existing, context={'request': request}).data
+                message_data['content'] = decrypt_message(cipher, existing)
+                message_data['encrypted_content'] = ciphertext_text(existing.content, existing.content_blob)
+                message_data['id'] = str(existing.id)
+                message_data['room_id'] = str(chat_room.id)
+                message_data['sender'] = {
+                    'id': str(request.user.id),
+                    'username': request.user.username,
+                    'profile_picture': request.user.profile_picture.url if request.user.profile_picture else None
+                }
+                message_data['tempId'] = temp_id
+                if existing.file:
+                    message_data['file_url'] = attachment_url(existing.file)
+                return Response({
+                    "message": message_data,
+                    "room": ChatRoomSerializer(chat_room, context={'request': request}).data
+                }, status=status.HTTP_200_OK)
+
+        is_audio = file is not None and file.name.endswith(('.mp3', '.wav', '.ogg', '.webm'))
+        attachment, upload_kind = None, None
+        # Until complete_send, a failure anywhere must free the tempId, or every retry gets 409
+        try:
+            logger.info("Encrypting message content")
+            stored_content, content_blob = cipher.encrypt(content)
+
+            if upload:
+                attachment, upload_kind = verify_upload(request.user.id, upload)
+                if attachment is None or not consume_upload(attachment.public_id):
+                    if temp_id:
+                        release_send(request.user.id, temp_id)
+                    return Response({"error": "Upload not found, expired, already used or not verified"}, status=status.HTTP_400_BAD_REQUEST)
+                is_audio = upload_kind == 'audio'
+
+            logger.info("Creating new message")
+            message = Message.objects.create(
+                room=chat_room,
+                sender=request.user,
+                content=stored_content,
+                content_blob=content_blob,
+                file=file or attachment,
+                audio_status='pending' if is_audio else None  # Picked up by process_voice_notes
+            )
+        except Exception:
+            if temp_id:
+                release_send(request.user.id, temp_id)
+            if attachment is not None:
+                release_upload(request.user.id, attachment.public_id, upload_kind)
+            raise
+        if temp_id:
+            complete_send(request.user.id, temp_id, message.id)
+        set_room_preview(message, content)
 
         # Send notification if this is a new chat
         if new_chat and recipient_username:
@@ -290,10 +396,10 @@ class ChatAPIViewSet(viewsets.ModelViewSet):
                 room_id=str(chat_room.id)
             )
 
-        serializer = MessageSerializer(message, context={'request': request})
+        serializer = MessageSerializer(message, context={'request': request, 'receipts': []})  # Nobody has read it yet
         message_data = serializer.data
         message_data['content'] = content
-        message_data['encrypted_content'] = encrypted_content
+        message_data['encrypted_content'] = ciphertext_text(stored_content, content_blob)
         message_data['id'] = str(message.id)
         message_data['room_id'] = str(chat_room.id)
         message_data['sender'] = {
@@ -303,9 +409,9 @@ class ChatAPIViewSet(viewsets.ModelViewSet):
         }
         if temp_id:
             message_data['tempId'] = temp_id
-        if file:
-            message_data['file_url'] = message.file.url if message.file else None
-            message_data['file_type'] = 'audio' if file and file.name.endswith(('.mp3', '.wav', '.ogg', '.webm')) else 'other'
+        if file or attachment is not None:
+            message_data['file_url'] = attachment_url(message.file)
+            message_data['file_type'] = 'audio' if is_audio else 'other'
 
         chat_room.last_message_at = message.sent_at
         chat_room.save()
@@ -313,11 +419,10 @@ class ChatAPIViewSet(viewsets.ModelViewSet):
         logger.info(f"Broadcasting message to users in room {chat_room.id}")
         channel_layer = get_channel_layer()
         if channel_layer:
-            for user in chat_room.users.all():
-                user_specific_unread_count = (
-                    0 if user == request.user
-                    else chat_room.messages.filter(is_read=False).exclude(sender=user).count()
-                )
+            members = list(chat_room.users.all())
+            counts = unread_counts(chat_room.id, [user.id for user in members if user != request.user])
+            for user in members:
+                user_specific_unread_count = counts.get(user.id, 0)
                 async_to_sync(channel_layer.group_send)(
                     f"user_{user.id}",
                     {
@@ -327,8 +432,7 @@ class ChatAPIViewSet(viewsets.ModelViewSet):
                         "unread_count": user_specific_unread_count
                     }
                 )
-            for user in chat_room.users.all():
-                cache.delete(f"my_chats_{user.id}")
+            for user in members:
                 cache.delete(f"messages_{chat_room.id}_{user.id}")
 
         logger.info(f"Message sent successfully, room_id: {chat_room.id}, message_id: {message.id}")
@@ -338,6 +442,40 @@ class ChatAPIViewSet(viewsets.ModelViewSet):
         }, status=status.HTTP_201_CREATED)
     
     
+    @action(detail=False, methods=['post'], url_path='upload-url')
+    def upload_url(self, request):
+        kind = request.data.get('kind', 'file')
+        if kind not in UPLOAD_KINDS:
+            return Response({"error": f"kind must be one of {', '.join(UPLOAD_KINDS)}"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            size = int(request.data.get('size') or 0)
+        except (TypeError, ValueError):
+            return Response({"error": "size must be a number of bytes"}, status=status.HTTP_400_BAD_REQUEST)
+        if size > settings.CHAT_UPLOAD_MAX_BYTES:
+            return Response({"error": "File too large"}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        descriptor = issue_upload(request.user.id, kind)
+        logger.info(f"Issued {kind} upload {descriptor['public_id']} to user {request.user.id}")
+        return Response(descriptor, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'], url_path='local-upload')
+    def local_upload(self, request):
+        backend = get_backend()
+        if not isinstance(backend, LocalUploadBackend):
+            return Response({"error": "Not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        public_id = backend.unsign(request.data.get('token', ''))
+        file = request.FILES.get('file')
+        if not public_id or not public_id.startswith(f"chat/{request.user.id}/"):
+            return Response({"error": "Invalid or expired upload token"}, status=status.HTTP_403_FORBIDDEN)
+        if not file:
+            return Response({"error": "No file provided"}, status=status.HTTP_400_BAD_REQUEST)
+        if file.size > settings.CHAT_UPLOAD_MAX_BYTES:
+            return Response({"error": "File too large"}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        backend.save(public_id, file)
+        return Response({"public_id": public_id}, status=status.HTTP_201_CREATED)
+
     @action(detail=True, methods=['post'], url_path='delete-message')
     def delete_message(self, request, pk=None):
         message_id = request.data.get('message_id')
@@ -345,8 +483,10 @@ class ChatAPIViewSet(viewsets.ModelViewSet):
             message = Message.objects.get(id=message_id, room__id=pk, sender=request.user)
             message.is_deleted = True
             message.content = "[Deleted]"
+            message.content_blob = None
             message.file = None  # Clear file if present
             message.save()
+            invalidate_room_preview(message.room_id)
 
             message_data = MessageSerializer(message, context={'request': request}).data
             message_data['id'] = str(message.id)
@@ -359,20 +499,20 @@ class ChatAPIViewSet(viewsets.ModelViewSet):
             message_data['file_url'] = None
 
             chat_room = message.room
-            chat_room.unread_count = chat_room.messages.filter(is_read=False).exclude(sender=request.user).count()
-            chat_room.save()
-            message_data['unread_count'] = chat_room.unread_count
+            members = list(chat_room.users.all())
+            counts = unread_counts(chat_room.id, [user.id for user in members])
+            message_data['unread_count'] = counts[request.user.id]
 
             channel_layer = get_channel_layer()
             if channel_layer:
-                for user in chat_room.users.all():
+                for user in members:
                     async_to_sync(channel_layer.group_send)(
                         f"user_{user.id}",
                         {
                             "type": "chat_message",
                             "message": message_data,
                             "room_id": str(pk),
-                            "unread_count": chat_room.unread_count
+                            "unread_count": counts[user.id]
                         }
                     )
             return Response({"message": "Message deleted"}, status=status.HTTP_200_OK)
@@ -380,6 +520,29 @@ class ChatAPIViewSet(viewsets.ModelViewSet):
             return Response({"error": "Message not found or not yours"}, status=status.HTTP_404_NOT_FOUND)
     
     
+    @action(detail=False, methods=['get'], url_path='presence')
+    def user_presence(self, request):
+        user_ids = [user_id for user_id in request.query_params.get('user_ids', '').split(',') if user_id]
+        if not user_ids:
+            return Response({"error": "user_ids required"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(user_ids) > 200:
+            return Response({"error": "At most 200 user_ids per request"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            users = User.objects.filter(id__in=user_ids).only('id', 'last_seen')
+            stored_last_seen = {str(user.id): user.last_seen for user in users}
+        except ValidationError:
+            return Response({"error": "Invalid user id"}, status=status.HTTP_400_BAD_REQUEST)
+
+        data = {}
+        for user_id, state in presence.get_presence(stored_last_seen.keys()).items():
+            last_seen = state["last_seen"] or stored_last_seen[user_id]
+            data[user_id] = {
+                "is_online": state["is_online"],
+                "last_seen": last_seen.isoformat() if last_seen else None,
+            }
+        return Response(data, status=status.HTTP_200_OK)
+
     @action(detail=False, methods=['get'], url_path='search-users')
     def search_users(self, request):
         query = request.query_params.get('q', '').strip()
@@ -395,34 +558,27 @@ class ChatAPIViewSet(viewsets.ModelViewSet):
         if request.user not in chat_room.users.all():
             return Response({"error": "Not authorized"}, status=status.HTTP_403_FORBIDDEN)
 
-        messages = chat_room.messages.filter(is_read=False).exclude(sender=request.user)
-        updated_ids = list(messages.values_list('id', flat=True))
-
-        if updated_ids:
-            messages.update(is_read=True, read_at=timezone.now())
-            chat_room.unread_count = 0
-            chat_room.save()
+        message_id = request.data.get('message_id')  # Read up to here; the newest message when omitted
+        if message_id is not None and not str(message_id).isdigit():
+            return Response({"error": "Invalid message_id"}, status=status.HTTP_400_BAD_REQUEST)
 
+        receipt = advance_read_receipt(chat_room.id, request.user.id, message_id)
+        if receipt:
+            # One watermark event instead of every id it covers
+            members = list(chat_room.users.all())
             channel_layer = get_channel_layer()
             if channel_layer:
-                for user in chat_room.users.all():
+                for user in members:
                     async_to_sync(channel_layer.group_send)(
                         f"user_{user.id}",
-                        {
-                            "type": "mark_as_read",
-                            "room_id": str(chat_room.id),
-                            "user_id": str(request.user.id),
-                            "updated_ids": [str(id) for id in updated_ids],
-                            "read_at": timezone.now().isoformat()
-                        }
+                        {"type": "mark_as_read", **receipt_payload(receipt)}
                     )
             else:
-                print("Channel layer not available")
+                logger.warning("Channel layer not available")
 
         return Response({
             "message": "Messages marked as read",
-            "count": len(updated_ids),
-            "updated_ids": [str(id) for id in updated_ids]
+            "receipt": receipt_payload(receipt) if receipt else None,
         }, status=status.HTTP_200_OK)
         
         
@@ -455,7 +611,6 @@ class ChatAPIViewSet(viewsets.ModelViewSet):
             receiver=other_user,
             call_type=call_type,
             call_status='ongoing',
-            sdp=sdp,
             call_start_time=timezone.now(),
         )
 
@@ -466,12 +621,10 @@ class ChatAPIViewSet(viewsets.ModelViewSet):
             "profile_picture": request.user.profile_picture.url if request.user.profile_picture else None,
         }
 
-        if not other_user.is_online:
-            call_log.call_status = 'missed'
-            call_log.call_end_time = timezone.now()
-            call_log.duration = 0
-            call_log.save()
-            
+        if not presence.is_online(other_user.id):
+            if call_log.finish('missed'):
+                chat_room.record_call_end(call_log)
+
             create_call_notification(
                 to_user=other_user,
                 from_user=request.user,
@@ -489,6 +642,9 @@ class ChatAPIViewSet(viewsets.ModelViewSet):
                 "status": "missed",
             }, status=status.HTTP_200_OK)
 
+        # SDP and live state go to the call registry, never to Postgres
+        calls.start_call(call_log.id, chat_room.id, request.user.id, other_user.id, call_type, sdp)
+
         if channel_layer:
             logger.info(f"Sending call_offer to user_{other_user.id} for call_id {call_log.id}")
             async_to_sync(channel_layer.group_send)(
@@ -534,18 +690,17 @@ class ChatAPIViewSet(viewsets.ModelViewSet):
                 (models.Q(caller=request.user) | models.Q(receiver=request.user))
             ).get()
 
-            if call_log.call_end_time:
+            # Both peers hang up at once: only the request that actually ends the call counts it
+            if call_log.call_end_time or not call_log.finish(call_status):
+                call_log.refresh_from_db()
                 return Response(CallLogSerializer(call_log, context={'request': request}).data, status=status.HTTP_200_OK)
+            calls.end_call(call_log.id)
+            call_log.room.record_call_end(call_log)
 
-            call_log.call_end_time = timezone.now()
-            call_log.call_status = call_status
-            call_log.duration = duration if call_status == 'completed' else 0
-            call_log.save()
-
+            call_data = CallLogSerializer(call_log, context={'request': request}).data
             channel_layer = get_channel_layer()
             if channel_layer:
                 target_user = call_log.receiver if request.user == call_log.caller else call_log.caller
-                call_data = CallLogSerializer(call_log, context={'request': request}).data
                 async_to_sync(channel_layer.group_send)(
                     f"user_{target_user.id}",
                     {
@@ -584,27 +739,37 @@ class ChatAPIViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'], url_path='call-history')
     def call_history(self, request, pk=None):
         chat_room = self.get_object()
-        cache_key = f"call_history_{pk}_{request.user.id}"
-        cached_data = cache.get(cache_key)
-        if cached_data:
-            return Response(cached_data)
-
-        call_logs = (
-            CallLog.objects
-            .filter(
-                models.Q(caller=request.user, receiver__in=chat_room.users.all()) |
-                models.Q(receiver=request.user, caller__in=chat_room.users.all())
+        try:
+            limit = max(1, min(int(request.query_params.get('limit') or CALL_HISTORY_PAGE_SIZE), CALL_HISTORY_MAX_PAGE_SIZE))
+        except (TypeError, ValueError):
+            return Response({"error": "limit must be a number"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Newest first, keyset-paginated on the (room, call_start_time, id) index
+        call_logs = CallLog.objects.filter(room=chat_room)
+        cursor = request.query_params.get('cursor')
+        if cursor:
+            parsed = parse_cursor(cursor)
+            if not parsed:
+                return Response({"error": "Invalid cursor"}, status=status.HTTP_400_BAD_REQUEST)
+            started, last_id = parsed
+            call_logs = call_logs.filter(
+                models.Q(call_start_time__lt=started) | models.Q(call_start_time=started, id__lt=last_id)
             )
+        page = list(
+            call_logs
             .select_related('caller', 'receiver')
             .only(
-                'id', 'call_type', 'call_status', 'call_start_time', 'call_end_time', 'duration',
+                'id', 'room', 'call_type', 'call_status', 'call_start_time', 'call_end_time', 'duration',
                 'caller__id', 'caller__username', 'caller__profile_picture',
                 'receiver__id', 'receiver__username', 'receiver__profile_picture'
             )
-            .order_by('-call_start_time')
+            .order_by('-call_start_time', '-id')[:limit + 1]
         )
-        serializer = CallLogSerializer(call_logs, many=True, context={'request': request})
-        data = serializer.data
+        has_more = len(page) > limit
+        page = page[:limit]
 
-        cache.set(cache_key, data, timeout=300)  # Cache for 5 minutes
-        return Response(data)
\ No newline at end of file
+        return Response({
+            "results": CallLogSerializer(page, many=True, context={'request': request}).data,
+            "next_cursor": make_cursor(page[-1].call_start_time, page[-1].id) if has_more else None,
+            "summary": ChatRoomSerializer().get_call_summary(chat_room),
+        })
\ No newline at end of file
@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Notification
+from .models import Notification, NotificationDelivery
 # Register your models here.
 
-admin.site.register(Notification)
\ No newline at end of file
+admin.site.register(Notification)
+admin.site.register(NotificationDelivery)
\ No newline at end of file
@@ -0,0 +1,82 @@
+# notification_app/aggregation.py
+import json
+import time
+import uuid
+import logging
+from django.conf import settings
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+from .outbox import append_entry, enqueue_notification, notification_payload, notification_fields
+
+logger = logging.getLogger(__name__)
+
+# Notifications of the types in NOTIFICATION_AGGREGATED_TYPES are grouped by (recipient, type, target)
+# in Redis for NOTIFICATION_AGGREGATION_WINDOW seconds, then reach the outbox as a single entry that
+# updates one row per group ("alice and 48 others liked your post") and makes one push.
+#   notification_agg:<user>:<type>:<target>          hash: latest payload and actor
+#   notification_agg:<user>:<type>:<target>:actors   set of distinct actors, kept for NOTIFICATION_AGGREGATE_ACTORS_TTL
+#   notification_agg:due                             sorted set of pending group keys by the time their window closes
+PREFIX = "notification_agg"
+DUE_KEY = f"{PREFIX}:due"
+
+
+def group_key(notification_type, target_id):
+    return f"{notification_type}:{target_id}"
+
+
+def _redis_key(to_user_id, key):
+    return f"{PREFIX}:{to_user_id}:{key}"
+
+
+def aggregate_notification(to_user, notification_type, from_user, target, extras=None):
+    """Add an actor to the recipient's pending group for (type, target). The group's window opens
+    with its first actor and is not extended by later ones, so a steady stream still gets a push per window."""
+    if notification_type not in settings.NOTIFICATION_AGGREGATED_TYPES:
+        enqueue_notification(to_user, notification_type, from_user=from_user, target=target, extras=extras)
+        return
+    key = _redis_key(to_user.id, group_key(notification_type, target[1]))
+    payload = notification_payload(notification_type, target, extras)
+    try:
+        pipe = get_redis_connection("default").pipeline()
+        pipe.hset(key, mapping={"payload": json.dumps(payload), "from_user_id": str(from_user.id)})
+        pipe.sadd(f"{key}:actors", str(from_user.id))
+        pipe.expire(f"{key}:actors", settings.NOTIFICATION_AGGREGATE_ACTORS_TTL)
+        pipe.zadd(DUE_KEY, {key: time.time() + settings.NOTIFICATION_AGGREGATION_WINDOW}, nx=True)
+        pipe.execute()
+    except RedisError as e:
+        logger.error(f"Notification aggregation unavailable, queueing {notification_type} for {to_user.id} on its own: {e}")
+        enqueue_notification(to_user, notification_type, from_user=from_user, target=target, extras=extras)
+
+
+def flush_due(limit=500):
+    """Move every group whose window has closed onto the outbox. Claiming a group and clearing its
+    pending hash is one transaction, so concurrent dispatchers never flush the same group twice.
+    Returns the number of groups flushed."""
+    redis = get_redis_connection("default")
+    flushed = 0
+    for raw_key in redis.zrangebyscore(DUE_KEY, "-inf", time.time(), start=0, num=limit):
+        key = raw_key.decode()
+        pipe = redis.pipeline()
+        pipe.zrem(DUE_KEY, key)
+        pipe.hgetall(key)
+        pipe.delete(key)
+        pipe.scard(f"{key}:actors")
+        claimed, pending, _, actor_count = pipe.execute()
+        if not claimed or not pending:
+            continue
+
+        to_user_id, notification_key = key[len(PREFIX) + 1:].split(":", 1)
+        # Groups opened before notifications had columns hold a JSON `message` instead of a payload
+        fields = notification_fields(
+            json.loads(pending[b"payload"]) if b"payload" in pending else {"message": pending[b"message"].decode()}
+        )
+        fields["extras"] = {**fields["extras"], "actor_count": actor_count}
+        append_entry("notification", {
+            "outbox_id": str(uuid.uuid4()),
+            "user_id": to_user_id,
+            "from_user_id": pending[b"from_user_id"].decode(),
+            "group_key": notification_key,
+            **fields,
+        })
+        flushed += 1
+    return flushed
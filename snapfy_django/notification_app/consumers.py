@@ -1,41 +1,96 @@
 # notification_app.consumers.py
 import json
+import logging
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
-from .models import Notification
-from .serializers import NotificationSerializer
+from rest_framework_simplejwt.tokens import AccessToken
+from .outbox import notification_group
+from .replay import latest_seq, replay_since
+
+logger = logging.getLogger(__name__)
 
 User = get_user_model()
 
 class NotificationConsumer(AsyncWebsocketConsumer):
     async def connect(self):
-        self.user_username = self.scope['url_route']['kwargs']['username']
-        self.notification_group_name = f'user_{self.user_username}_notifications'
-        
-        # Join room group
+        self.notification_group_name = None
+        query_string = self.scope.get('query_string', b'').decode()
+        params = dict(param.split('=', 1) for param in query_string.split('&') if '=' in param)
+
+        token = params.get('token')
+        if not token:
+            logger.warning("No token provided")
+            await self.close(code=4003)
+            return
+        self.user = await self.get_user_from_token(token)
+        if not self.user or self.user.username != self.scope['url_route']['kwargs']['username']:
+            logger.warning("Invalid token for notification socket")
+            await self.close(code=4003)
+            return
+
+        # Join before replaying: the dispatcher records a push before sending it, so whatever is
+        # sent from here on arrives live and anything earlier is in the replay list
+        self.notification_group_name = notification_group(self.user.username)
         await self.channel_layer.group_add(
             self.notification_group_name,
             self.channel_name
         )
-        
+
         await self.accept()
-    
+
+        # `since` is the seq of the last push the client got, not a notification id
+        since = params.get('since', '')
+        if since.isdigit():
+            await self.replay(int(since))
+        else:
+            # Where the client replays from if this socket drops; pushes after it arrive live
+            await self.send(text_data=json.dumps({
+                'type': 'sequence',
+                'seq': await latest_seq(self.user.id)
+            }))
+
+    async def replay(self, since):
+        # Live events queue behind connect(), so they can only repeat a replayed one; clients dedupe by id
+        pushes, complete, latest = await replay_since(self.user.id, since)
+        for push in pushes:
+            await self.send(text_data=json.dumps({
+                'type': 'notification',
+                'notification': push['notification'],
+                'seq': push['seq']
+            }))
+        await self.send(text_data=json.dumps({
+            'type': 'replay_done',
+            'replayed': len(pushes),
+            'complete': complete,  # False: `since` is too old to replay from, refetch the list
+            'seq': latest
+        }))
+
     async def disconnect(self, close_code):
         # Leave room group
-        await self.channel_layer.group_discard(
-            self.notification_group_name,
-            self.channel_name
-        )
-    
+        if self.notification_group_name:
+            await self.channel_layer.group_discard(
+                self.notification_group_name,
+                self.channel_name
+            )
+
     # Receive message from WebSocket
     async def receive(self, text_data):
         pass  # We don't expect to receive messages from the client
-    
+
     # Receive message from room group
     async def notification_message(self, event):
         # Send message to WebSocket
         await self.send(text_data=json.dumps({
             'type': 'notification',
-            'notification': event['notification']
-        }))
\ No newline at end of file
+            'notification': event['notification'],
+            'seq': event.get('seq')  # None when the push could not be recorded for replay
+        }))
+
+    @database_sync_to_async
+    def get_user_from_token(self, token):
+        try:
+            access_token = AccessToken(token)
+            return User.objects.get(id=access_token['user_id'])
+        except Exception:
+            return None
@@ -0,0 +1,75 @@
+# notification_app/counters.py
+import logging
+from collections import Counter
+from django.conf import settings
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+from .models import Notification
+
+logger = logging.getLogger(__name__)
+
+# notification_unread:<user_id> caches how many unread notifications a user has, so the bell badge
+# is a single GET. A missing counter is rebuilt from Postgres (an index-only count on the unread
+# partial index) and lives NOTIFICATION_UNREAD_TTL seconds; writers only adjust counters that
+# already exist, so a counter never starts from a partial number, and any drift ends with the TTL.
+# The existence check and the increment run as one script: a counter that expired in between would
+# otherwise come back as a bare delta with no TTL.
+INCRBY_IF_EXISTS = """
+for i, key in ipairs(KEYS) do
+    if redis.call('EXISTS', key) == 1 then
+        redis.call('INCRBY', key, ARGV[i])
+    end
+end
+"""
+
+
+def unread_key(user_id):
+    return f"notification_unread:{user_id}"
+
+
+def get_unread_count(user_id):
+    try:
+        redis = get_redis_connection("default")
+        cached = redis.get(unread_key(user_id))
+        if cached is not None and int(cached) >= 0:
+            return int(cached)
+    except RedisError as e:
+        logger.warning(f"Unread counter unavailable for {user_id}, counting in Postgres: {e}")
+        return Notification.objects.filter(user_id=user_id, is_read=False).count()
+
+    count = Notification.objects.filter(user_id=user_id, is_read=False).count()
+    try:
+        redis.set(unread_key(user_id), count, ex=settings.NOTIFICATION_UNREAD_TTL)
+    except RedisError as e:
+        logger.warning(f"Could not cache unread count for {user_id}: {e}")
+    return count
+
+
+def adjust_unread(deltas):
+    """Apply {user_id: delta} to the cached counters that exist; the others are rebuilt on their next read."""
+    deltas = {user_id: delta for user_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    keys = [unread_key(user_id) for user_id in deltas]
+    try:
+        redis = get_redis_connection("default")
+        redis.register_script(INCRBY_IF_EXISTS)(keys=keys, args=list(deltas.values()))
+    except RedisError as e:
+        logger.warning(f"Could not adjust unread counters, dropping them instead: {e}")
+        reset_unread(deltas)
+
+
+def count_new(user_ids):
+    """{user_id: number of times it appears}, the increments of a batch of new unread rows."""
+    return Counter(str(user_id) for user_id in user_ids)
+
+
+def reset_unread(user_ids):
+    """Forget cached counters, e.g. after a bulk change whose per-user effect is unknown."""
+    if not user_ids:
+        return
+    try:
+        get_redis_connection("default").delete(*[unread_key(user_id) for user_id in user_ids])
+    except RedisError as e:
+        logger.error(f"Could not reset unread counters: {e}")
+
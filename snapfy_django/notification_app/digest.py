@@ -0,0 +1,142 @@
+# notification_app/digest.py
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives
+from django.db.models import DateTimeField, Exists, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.html import escape
+from redis.exceptions import RedisError
+from snapfy_django.smtp_pool import is_permanent
+from chat_app.presence import get_presence
+from user_app.models import User
+from .models import Notification, NotificationDelivery
+
+logger = logging.getLogger(__name__)
+
+# A notification for someone who is offline is pushed to a group nobody listens on. send_digests()
+# rolls those up instead: a user is due an email digest when they are offline, have not had one for
+# NOTIFICATION_DIGEST_INTERVAL, and have unread notifications newer than their last digest that have
+# sat unseen for NOTIFICATION_DIGEST_DELAY. Digests go out in batches over one SMTPPool; a user whose
+# mail fails keeps their last_sent_at and is picked up again on the next pass, unless the server
+# refused it for good (smtp_pool.is_permanent): that counts as sent, so the address is only tried
+# again once another interval's worth is due.
+
+DESCRIPTIONS = {
+    'follow': "{actor} started following you",
+    'mention': "{actor} mentioned you in a post",
+    'like': "{actor} liked your post",
+    'comment': "{actor} commented on your post",
+    'call': "{actor} called you",
+    'new_chat': "{actor} started a chat with you",
+    'live': "{actor} went live",
+}
+
+
+def describe(notification):
+    actor = notification.from_user.username if notification.from_user else "Someone"
+    others = notification.extras.get('actor_count', 1) - 1
+    if notification.type == 'like' and others > 0:
+        actor = f"{actor} and {others} {'other' if others == 1 else 'others'}"
+    if notification.type == 'call' and notification.extras.get('call_status') == 'missed':
+        return f"You missed a call from {actor}"
+    return DESCRIPTIONS.get(notification.type, "{actor} sent you a notification").format(actor=actor)
+
+
+def ready_before(now):
+    """Notifications created up to this instant have sat unseen long enough to go in a digest."""
+    return now - timedelta(seconds=settings.NOTIFICATION_DIGEST_DELAY)
+
+
+def due_users(channel, now):
+    """Users owed a digest on `channel`, annotated with digest_since, the notifications it covers start after."""
+    deliveries = NotificationDelivery.objects.filter(user=OuterRef('pk'), channel=channel)
+    window_start = now - timedelta(seconds=settings.NOTIFICATION_DIGEST_INTERVAL)
+    ready = ready_before(now)
+    return (
+        User.objects.filter(is_active=True, is_verified=True)
+        .exclude(email='')
+        .exclude(Exists(deliveries.filter(enabled=False)))
+        # Without a previous digest, only the last interval's notifications count
+        .annotate(digest_since=Coalesce(
+            Subquery(deliveries.values('last_sent_at')[:1]), Value(window_start), output_field=DateTimeField(),
+        ))
+        .filter(digest_since__lte=window_start)
+        .filter(Exists(Notification.objects.filter(
+            user=OuterRef('pk'), is_read=False, created_at__gt=OuterRef('digest_since'), created_at__lte=ready,
+        )))
+        .order_by('id')
+    )
+
+
+def build_digest(user, since, ready):
+    """The email for `user`'s unread notifications after `since` and up to `ready`, or None if they
+    were read meanwhile. Newer ones may still be seen live, so they wait for the next digest."""
+    unread = Notification.objects.filter(user=user, is_read=False, created_at__gt=since, created_at__lte=ready)
+    notifications = list(unread.select_related('from_user').order_by('-created_at', '-id')[:settings.NOTIFICATION_DIGEST_MAX_ITEMS])
+    if not notifications:
+        return None
+    total = unread.count() if len(notifications) == settings.NOTIFICATION_DIGEST_MAX_ITEMS else len(notifications)
+    lines = [describe(notification) for notification in notifications]
+    more = total - len(lines)
+
+    subject = f"You have {total} new notification{'s' if total != 1 else ''} on Snapfy"
+    text = "\n".join([f"Hi {user.username},", "", *[f"- {line}" for line in lines]]
+                     + ([f"- and {more} more"] if more else []) + ["", "Best,", "The Snapfy Team"])
+    html = (
+        f"<p>Hi {escape(user.username)},</p><ul>"
+        + "".join(f"<li>{escape(line)}</li>" for line in lines)
+        + (f"<li>and {more} more</li>" if more else "")
+        + "</ul><p>Best,<br>The Snapfy Team</p>"
+    )
+    message = EmailMultiAlternatives(subject=subject, body=text, from_email=settings.DEFAULT_FROM_EMAIL, to=[user.email])
+    message.attach_alternative(html, "text/html")
+    return message
+
+
+def send_digests(pool, channel='email', batch_size=None):
+    """One pass over every user due a digest. Returns (digests sent, digests failed)."""
+    batch_size = batch_size or settings.NOTIFICATION_DIGEST_BATCH_SIZE
+    now = timezone.now()
+    ready = ready_before(now)
+    sent, failed, after = 0, 0, None
+    while True:
+        users = due_users(channel, now)
+        if after:
+            users = users.filter(id__gt=after)
+        users = list(users[:batch_size])
+        if not users:
+            return sent, failed
+        after = users[-1].id
+
+        try:
+            presence = get_presence([user.id for user in users])
+        except RedisError as e:
+            logger.warning(f"Presence unavailable, deferring {len(users)} digests: {e}")
+            return sent, failed
+        digests = []
+        for user in users:
+            if presence[str(user.id)]["is_online"]:
+                continue  # They are seeing their notifications live
+            message = build_digest(user, user.digest_since, ready)
+            if message:
+                digests.append((user, message))
+
+        results = pool.send_many([message for _, message in digests])
+        delivered = [user for (user, _), ok in zip(digests, results) if ok]
+        refused = []
+        for index, (user, _) in enumerate(digests):
+            if is_permanent(pool.errors.get(index)):
+                refused.append(user)
+                logger.warning(f"Digest to {user.email} refused, not retrying before the next interval: {pool.errors[index]}")
+        NotificationDelivery.objects.bulk_create(
+            [NotificationDelivery(user=user, channel=channel, last_sent_at=now) for user in delivered + refused],
+            update_conflicts=True,
+            unique_fields=['user', 'channel'],
+            update_fields=['last_sent_at'],
+        )
+        sent += len(delivered)
+        failed += len(digests) - len(delivered)
+        if len(users) < batch_size:
+            return sent, failed
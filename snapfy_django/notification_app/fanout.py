@@ -0,0 +1,108 @@
+# notification_app/fanout.py
+import uuid
+import logging
+from django.conf import settings
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+from story_app.models import LiveStream
+from user_app.models import User, BlockedUser
+from .models import Notification
+from .outbox import append_entry, notification_group, notification_event, notification_payload
+from .replay import remember
+from .counters import adjust_unread, count_new
+
+logger = logging.getLogger(__name__)
+
+# Going live notifies every follower who has not blocked the host. The request only queues a
+# live_fanout outbox entry; the dispatcher works through the followers LIVE_FANOUT_CHUNK_SIZE at a
+# time in id order, re-queueing the entry with its cursor after each chunk so other notifications
+# keep flowing in between. Progress is kept in the live_fanout:<live_id> hash for the host to poll.
+# Row outbox_ids are derived from (live_id, follower), so a chunk redelivered after a crash adds nothing.
+FANOUT_NAMESPACE = uuid.UUID("6f1c2a4e-3b7d-4f0a-9c55-2d8e1b7a4c90")
+
+
+def progress_key(live_id):
+    return f"live_fanout:{live_id}"
+
+
+def eligible_followers(host):
+    """Followers of `host` minus those who blocked them, as one anti-join."""
+    blocked_host = BlockedUser.objects.filter(blocker=OuterRef('pk'), blocked=host)
+    return User.objects.filter(following=host).filter(~Exists(blocked_host))
+
+
+def fanout_progress(live_id):
+    progress = get_redis_connection("default").hgetall(progress_key(live_id))
+    if not progress:
+        return None
+    progress = {key.decode(): value.decode() for key, value in progress.items()}
+    for field in ("total", "notified", "push_failed"):
+        progress[field] = int(progress.get(field, 0))
+    return progress
+
+
+def _update_progress(live_id, increments=None, **fields):
+    pipe = get_redis_connection("default").pipeline()
+    if fields:
+        pipe.hset(progress_key(live_id), mapping=fields)
+    for field, amount in (increments or {}).items():
+        pipe.hincrby(progress_key(live_id), field, amount)
+    pipe.expire(progress_key(live_id), settings.LIVE_FANOUT_PROGRESS_TTL)
+    pipe.execute()
+
+
+def start_live_fanout(live_stream):
+    """Queue the follower notifications of a stream that just went live."""
+    total = eligible_followers(live_stream.host).count()
+    try:
+        _update_progress(
+            live_stream.id, status="queued", total=total, notified=0, push_failed=0,
+            started_at=timezone.now().isoformat(),
+        )
+        append_entry("live_fanout", {"live_id": live_stream.id, "after": None})
+    except RedisError as e:
+        logger.error(f"Notification outbox unavailable, stream {live_stream.id} goes live without follower notifications: {e}")
+        return
+    logger.info(f"Queued live fan-out of stream {live_stream.id} to {total} followers")
+
+
+def run_fanout_chunk(payload, dispatcher):
+    """Notify the next chunk of followers. Returns the payload of the following chunk, or None when done."""
+    live_id = payload["live_id"]
+    live_stream = LiveStream.objects.select_related('host').filter(id=live_id).first()
+    if live_stream is None or not live_stream.is_active:
+        _update_progress(live_id, status="cancelled", finished_at=timezone.now().isoformat())
+        return None
+
+    host = live_stream.host
+    followers = eligible_followers(host).order_by('id')
+    if payload["after"]:
+        followers = followers.filter(id__gt=payload["after"])
+    chunk = list(followers.values_list('id', 'username')[:settings.LIVE_FANOUT_CHUNK_SIZE])
+    if not chunk:
+        _update_progress(live_id, status="done", finished_at=timezone.now().isoformat())
+        logger.info(f"Live fan-out of stream {live_id} done")
+        return None
+
+    fields = notification_payload('live', target=('live', live_id), extras={'stream_url': f'/live/{live_id}'})
+    outbox_ids = {uuid.uuid5(FANOUT_NAMESPACE, f"{live_id}:{follower_id}"): username for follower_id, username in chunk}
+    existing = set(Notification.objects.filter(outbox_id__in=list(outbox_ids)).values_list('outbox_id', flat=True))
+    Notification.objects.bulk_create(
+        [
+            Notification(outbox_id=outbox_id, user_id=follower_id, from_user=host, **fields)
+            for outbox_id, (follower_id, _) in zip(outbox_ids, chunk)
+        ],
+        ignore_conflicts=True,
+    )
+    adjust_unread(count_new(
+        follower_id for outbox_id, (follower_id, _) in zip(outbox_ids, chunk) if outbox_id not in existing
+    ))
+    rows = Notification.objects.filter(outbox_id__in=list(outbox_ids)).select_related('from_user').order_by('id')
+    pushes = [(row, notification_event(row)) for row in rows]
+    remember([(row.user_id, event) for row, event in pushes])
+    failed = dispatcher.push_many([(notification_group(outbox_ids[row.outbox_id]), event) for row, event in pushes])
+
+    _update_progress(live_id, increments={"notified": len(chunk), "push_failed": failed}, status="running")
+    return {"live_id": live_id, "after": str(chunk[-1][0])}
@@ -0,0 +1,51 @@
+# notification_app/legacy.py
+import json
+
+# Notifications used to keep everything in `message`, a json.dumps string such as
+# {"type": "call", "from_user": {...}, "call_id": "7", "room_id": "3", "call_type": "audio", ...}.
+# fields_from_message() maps one onto the structured columns; migration 0007 uses it for existing
+# rows and the dispatcher for outbox entries queued before the upgrade.
+
+# The first id key found names the target; every other key except type and from_user is an extra
+TARGET_KEYS = [('call_id', 'call'), ('post_id', 'post'), ('live_id', 'live'), ('room_id', 'chat')]
+
+
+def fields_from_message(message):
+    """{"type", "target_type", "target_id", "extras", "from_username"} for a legacy message;
+    unparseable text is kept as an extra."""
+    try:
+        data = json.loads(message)
+        if not isinstance(data, dict):
+            raise ValueError(message)
+    except (TypeError, ValueError):
+        return {"type": "", "target_type": "", "target_id": "", "extras": {"text": message or ""}, "from_username": None}
+
+    extras = {key: value for key, value in data.items() if key not in ('type', 'from_user')}
+    target_type, target_id = "", ""
+    for key, name in TARGET_KEYS:
+        if extras.get(key) is not None:
+            target_type, target_id = name, str(extras.pop(key))
+            break
+    from_user = data.get('from_user') if isinstance(data.get('from_user'), dict) else {}
+    return {
+        "type": data.get('type') or "",
+        "target_type": target_type,
+        "target_id": target_id,
+        "extras": extras,
+        "from_username": from_user.get('username'),
+    }
+
+
+def message_from_fields(notification_type, from_user, target_type, target_id, extras):
+    """The legacy message of a structured notification, for reversing the migration."""
+    data = {"type": notification_type}
+    if from_user is not None:
+        data["from_user"] = {
+            "username": from_user.username,
+            "profile_picture": str(from_user.profile_picture) if from_user.profile_picture else None,
+        }
+    data.update(extras or {})
+    target_key = {name: key for key, name in TARGET_KEYS}.get(target_type)
+    if target_key:
+        data[target_key] = int(target_id) if target_type == 'post' and target_id.isdigit() else target_id
+    return json.dumps(data)
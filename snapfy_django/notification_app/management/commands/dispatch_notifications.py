@@ -0,0 +1,43 @@
+# notification_app/management/commands/dispatch_notifications.py
+import time
+import logging
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from notification_app.aggregation import flush_due
+from notification_app.outbox import Dispatcher
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ("Drain the notification outbox: flush closed aggregation windows, write Notification rows "
+            "in bulk and push them to websocket groups")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Dispatch whatever is queued and exit")
+        parser.add_argument('--batch-size', type=int, default=settings.NOTIFICATION_OUTBOX_BATCH_SIZE)
+        parser.add_argument('--requeue-dead', action='store_true',
+                            help="Move dead-lettered entries back onto the outbox and exit")
+
+    def handle(self, *args, **options):
+        dispatcher = Dispatcher(batch_size=options['batch_size'])
+        if options['requeue_dead']:
+            self.stdout.write(f"Requeued {dispatcher.requeue_dead()} dead-lettered notifications")
+            return
+
+        while True:
+            try:
+                flush_due()
+                entries = dispatcher.reclaim() or dispatcher.read_new(
+                    None if options['once'] else settings.NOTIFICATION_OUTBOX_BLOCK_MS
+                )
+                if entries:
+                    dispatched = dispatcher.dispatch(entries)
+                    self.stdout.write(f"Dispatched {dispatched} of {len(entries)} outbox entries")
+                elif options['once']:
+                    return
+            except Exception as e:
+                logger.error(f"Notification dispatch failed: {e}")
+                if options['once']:
+                    return
+                time.sleep(1)
@@ -0,0 +1,50 @@
+# notification_app/management/commands/prune_notifications.py
+import time
+import logging
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from notification_app import retention
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ("Enforce notification retention: delete read notifications older than --days and anything "
+            "past each user's newest --keep, in bounded batches")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Run a single pass and exit")
+        parser.add_argument('--interval', type=int, default=settings.NOTIFICATION_RETENTION_INTERVAL)
+        parser.add_argument('--days', type=int, default=settings.NOTIFICATION_RETENTION_DAYS)
+        parser.add_argument('--keep', type=int, default=settings.NOTIFICATION_KEEP_PER_USER,
+                            help="Notifications kept per user; 0 disables the cap")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--pause', type=float, default=0.1, help="Seconds to sleep between delete batches")
+        parser.add_argument('--no-vacuum', action='store_true', help="Skip VACUUM ANALYZE after deleting")
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                self.run_pass(options)
+            except Exception as e:
+                logger.error(f"Notification retention failed: {e}")
+            if options['once']:
+                return
+            time.sleep(options['interval'])
+
+    def run_pass(self, options):
+        started = time.monotonic()
+        expired = retention.prune_expired(options['days'], options['batch_size'], options['pause'])
+        capped, users = 0, 0
+        if options['keep'] > 0:
+            capped, users = retention.prune_over_cap(options['keep'], options['batch_size'], options['pause'])
+
+        report = (f"Removed {expired} read notifications older than {options['days']} days and "
+                  f"{capped} past the newest {options['keep']} of {users} users in {time.monotonic() - started:.1f}s")
+        if (expired or capped) and not options['no_vacuum'] and retention.vacuum():
+            report += ", vacuumed"
+        sizes = retention.table_sizes()
+        if sizes:
+            report += f"; table {sizes[0] // 1024} KiB, indexes {sizes[1] // 1024} KiB"
+        self.stdout.write(report)
+        logger.info(report)
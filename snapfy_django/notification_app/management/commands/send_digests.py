@@ -0,0 +1,37 @@
+# notification_app/management/commands/send_digests.py
+import time
+import logging
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from notification_app.digest import send_digests
+from snapfy_django.smtp_pool import SMTPPool
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Email offline users a digest of their unread notifications, over a pool of SMTP connections"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Run a single pass and exit")
+        parser.add_argument('--interval', type=int, default=settings.NOTIFICATION_DIGEST_POLL)
+        parser.add_argument('--batch-size', type=int, default=settings.NOTIFICATION_DIGEST_BATCH_SIZE)
+        parser.add_argument('--connections', type=int, default=settings.SMTP_POOL_SIZE,
+                            help="Concurrent SMTP connections")
+
+    def handle(self, *args, **options):
+        while True:
+            pool = SMTPPool(size=options['connections'])
+            try:
+                sent, failed = send_digests(pool, batch_size=options['batch_size'])
+                if sent or failed:
+                    stats = pool.stats()
+                    report = (f"Sent {sent} notification digests, {failed} failed: {stats['per_second']}/s over "
+                              f"{stats['connections']} connections, {stats['retries']} retries")
+                    self.stdout.write(report)
+                    logger.info(report)
+            except Exception as e:
+                logger.error(f"Notification digests failed: {e}")
+            if options['once']:
+                return
+            time.sleep(options['interval'])
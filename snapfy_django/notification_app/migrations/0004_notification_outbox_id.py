@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-19 13:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notification_app', '0003_notification_from_user_notification_live_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='outbox_id',
+            field=models.UUIDField(blank=True, editable=False, null=True, unique=True),
+        ),
+    ]
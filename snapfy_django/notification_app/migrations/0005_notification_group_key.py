@@ -0,0 +1,24 @@
+# Generated by Django 5.1.6 on 2026-10-19 13:31
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notification_app', '0004_notification_outbox_id'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='group_key',
+            field=models.CharField(blank=True, editable=False, max_length=128, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='notification',
+            constraint=models.UniqueConstraint(fields=('user', 'group_key'), name='unique_notification_group'),
+        ),
+    ]
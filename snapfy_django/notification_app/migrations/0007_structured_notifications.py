@@ -0,0 +1,106 @@
+# Generated by Django 5.1.6 on 2026-10-19 13:49
+
+from django.conf import settings
+from django.db import migrations, models
+from notification_app.legacy import fields_from_message, message_from_fields
+
+BATCH_SIZE = 2000
+
+
+def structure_messages(apps, schema_editor):
+    Notification = apps.get_model('notification_app', 'Notification')
+    User = apps.get_model('user_app', 'User')
+
+    def save(batch):
+        # Notifications never recorded from_user; the username in the message is all there is
+        usernames = {fields["from_username"] for _, fields in batch if fields["from_username"]}
+        user_ids = {}
+        for user_id, username in User.objects.filter(username__in=usernames).order_by('is_verified').values_list('id', 'username'):
+            user_ids[username] = user_id  # Verified accounts come last and win
+        notifications = []
+        for notification, fields in batch:
+            notification.type = fields["type"]
+            notification.target_type = fields["target_type"]
+            notification.target_id = fields["target_id"]
+            notification.extras = fields["extras"]
+            if not notification.target_id and notification.live_id:
+                notification.target_type, notification.target_id = 'live', str(notification.live_id)
+            if notification.from_user_id is None:
+                notification.from_user_id = user_ids.get(fields["from_username"])
+            notifications.append(notification)
+        Notification.objects.bulk_update(
+            notifications, ['type', 'target_type', 'target_id', 'extras', 'from_user'], batch_size=BATCH_SIZE,
+        )
+
+    batch = []
+    for notification in Notification.objects.only('id', 'message', 'live_id', 'from_user_id').iterator(chunk_size=BATCH_SIZE):
+        batch.append((notification, fields_from_message(notification.message)))
+        if len(batch) >= BATCH_SIZE:
+            save(batch)
+            batch = []
+    if batch:
+        save(batch)
+
+
+def rebuild_messages(apps, schema_editor):
+    Notification = apps.get_model('notification_app', 'Notification')
+    batch = []
+    for notification in Notification.objects.select_related('from_user').iterator(chunk_size=BATCH_SIZE):
+        notification.message = message_from_fields(
+            notification.type, notification.from_user, notification.target_type, notification.target_id, notification.extras,
+        )
+        if notification.target_type == 'live' and notification.target_id.isdigit():
+            notification.live_id = int(notification.target_id)
+        batch.append(notification)
+        if len(batch) >= BATCH_SIZE:
+            Notification.objects.bulk_update(batch, ['message', 'live_id'])
+            batch = []
+    if batch:
+        Notification.objects.bulk_update(batch, ['message', 'live_id'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notification_app', '0006_notification_list_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='extras',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='target_id',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='target_type',
+            field=models.CharField(blank=True, choices=[('post', 'Post'), ('call', 'Call'), ('chat', 'Chat room'), ('live', 'Live stream')], max_length=10),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='type',
+            field=models.CharField(choices=[('follow', 'Follow'), ('mention', 'Mention'), ('like', 'Like'), ('comment', 'Comment'), ('call', 'Call'), ('new_chat', 'New chat'), ('live', 'Live')], default='', max_length=20),
+            preserve_default=False,
+        ),
+        # Blank so that reversing 0008 can add the column back to existing rows
+        migrations.AlterField(
+            model_name='notification',
+            name='message',
+            field=models.TextField(blank=True),
+        ),
+        migrations.RunPython(structure_messages, rebuild_messages),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', 'type', '-created_at', '-id'], name='notification_user_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['target_type', 'target_id'], name='notification_target_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.6 on 2026-10-19 13:49
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notification_app', '0007_structured_notifications'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='notification',
+            name='live_id',
+        ),
+        migrations.RemoveField(
+            model_name='notification',
+            name='message',
+        ),
+    ]
@@ -2,12 +2,67 @@ from django.db import models
 from user_app.models import User
 
 class Notification(models.Model):
+    TYPES = [
+        ('follow', 'Follow'),
+        ('mention', 'Mention'),
+        ('like', 'Like'),
+        ('comment', 'Comment'),
+        ('call', 'Call'),
+        ('new_chat', 'New chat'),
+        ('live', 'Live'),
+    ]
+
+    TARGET_TYPES = [
+        ('post', 'Post'),
+        ('call', 'Call'),
+        ('chat', 'Chat room'),
+        ('live', 'Live stream'),
+    ]
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="notifications")
     from_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="sent_notifications", null=True)
-    message = models.TextField()
+    type = models.CharField(max_length=20, choices=TYPES)
+    target_type = models.CharField(max_length=10, choices=TARGET_TYPES, blank=True)
+    target_id = models.CharField(max_length=64, blank=True)
+    extras = models.JSONField(default=dict, blank=True)  # Type-specific details, e.g. a comment's text or a call's status
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
-    live_id = models.IntegerField(null=True, blank=True)
+    outbox_id = models.UUIDField(unique=True, null=True, blank=True, editable=False)  # Set by the outbox, makes redelivery idempotent
+    group_key = models.CharField(max_length=128, null=True, blank=True, editable=False)  # Aggregated notifications: one row per (user, group_key)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'group_key'], name='unique_notification_group'),
+        ]
+        indexes = [
+            # Cursor pages: newest first per user
+            models.Index(fields=['user', '-created_at', '-id'], name='notification_user_created_idx'),
+            # The same, for one type (?type= on the list)
+            models.Index(fields=['user', 'type', '-created_at', '-id'], name='notification_user_type_idx'),
+            # Unread counts and bulk mark-read only touch unread rows
+            models.Index(fields=['user'], condition=models.Q(is_read=False), name='notification_unread_idx'),
+            # Everything about one post, call, room or stream, e.g. to clean up after it is deleted
+            models.Index(fields=['target_type', 'target_id'], name='notification_target_idx'),
+        ]
 
     def __str__(self):
         return f"Notification for {self.user.username}"
+
+
+class NotificationDelivery(models.Model):
+    """Out-of-app delivery of a user's notifications on one channel: whether they want it, and when
+    the last digest went out. Users without a row get digests, nothing has been sent to them yet."""
+    CHANNELS = [
+        ('email', 'Email'),
+    ]
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="notification_deliveries")
+    channel = models.CharField(max_length=10, choices=CHANNELS)
+    enabled = models.BooleanField(default=True)
+    last_sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'channel'], name='unique_notification_delivery'),
+        ]
+
+    def __str__(self):
+        return f"{self.channel} delivery for {self.user.username}"
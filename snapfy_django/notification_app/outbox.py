@@ -0,0 +1,295 @@
+# notification_app/outbox.py
+import json
+import asyncio
+import uuid
+import socket
+import os
+import logging
+from channels.layers import get_channel_layer
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.utils import timezone
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError, ResponseError
+from user_app.models import User
+from .models import Notification
+from .counters import adjust_unread, count_new
+from .legacy import fields_from_message
+from .replay import remember
+from .serializers import NotificationSerializer
+
+logger = logging.getLogger(__name__)
+
+# Request handlers never touch Notification or the channel layer directly: they append to a Redis
+# stream and the dispatch_notifications worker does the rest, in batches.
+#   notification_outbox        entries {"kind": "notification" | "event" | "live_fanout", "payload": JSON}
+#   notification_outbox:dead   entries that failed NOTIFICATION_OUTBOX_MAX_ATTEMPTS times, with the reason
+# Each notification carries an outbox_id, unique on Notification, so a redelivered entry never
+# makes a second row. Pushes are at least once and carry the row id, which clients dedupe on.
+# Entries with a group_key come from notification_app.aggregation and update their group's row instead.
+# Every notification push is numbered and recorded in notification_app.replay first, for sockets that reconnect.
+STREAM = "notification_outbox"
+DEAD_LETTER_STREAM = "notification_outbox:dead"
+GROUP = "dispatchers"
+
+
+def notification_group(username):
+    return f"user_{username}_notifications"
+
+
+def append_entry(kind, payload):
+    get_redis_connection("default").xadd(STREAM, {"kind": kind, "payload": json.dumps(payload)})
+
+
+def notification_payload(notification_type, target=None, extras=None):
+    """The structured fields of a notification as queued: target is (target_type, target_id) or None."""
+    target_type, target_id = target or ("", "")
+    return {"type": notification_type, "target_type": target_type, "target_id": str(target_id), "extras": extras or {}}
+
+
+def notification_fields(payload):
+    """Model fields of a queued notification. Entries queued before notifications had columns carry a JSON `message`."""
+    if "type" not in payload:
+        payload = fields_from_message(payload.get("message"))
+    return {key: payload[key] for key in ("type", "target_type", "target_id", "extras")}
+
+
+def enqueue_notification(to_user, notification_type, from_user=None, target=None, extras=None):
+    """Queue a notification for `to_user`. If Redis is unreachable the row is written directly
+    so it still shows up on the next fetch; only the live push is lost."""
+    payload = {
+        "outbox_id": str(uuid.uuid4()),
+        "user_id": str(to_user.id),
+        "from_user_id": str(from_user.id) if from_user else None,
+        **notification_payload(notification_type, target, extras),
+    }
+    try:
+        append_entry("notification", payload)
+    except RedisError as e:
+        logger.error(f"Notification outbox unavailable, writing notification for {to_user.id} without a push: {e}")
+        Notification.objects.create(
+            user=to_user, from_user=from_user, outbox_id=payload["outbox_id"], **notification_fields(payload),
+        )
+        adjust_unread({to_user.id: 1})
+
+
+def enqueue_event(group, event):
+    """Queue a plain group_send, for broadcasts that are not per-user notifications."""
+    try:
+        append_entry("event", {"group": group, "event": event})
+    except RedisError as e:
+        logger.error(f"Notification outbox unavailable, dropping {event.get('type')} event for {group}: {e}")
+
+
+def notification_event(notification):
+    """The push of a row; select_related('from_user') it first."""
+    return {"type": "notification_message", "notification": NotificationSerializer(notification).data}
+
+
+class Dispatcher:
+    """One consumer in the `dispatchers` group. Entries are acked and deleted once their row exists
+    and their push went out; anything left pending is retried after NOTIFICATION_OUTBOX_RETRY_AFTER
+    seconds, and dead-lettered after NOTIFICATION_OUTBOX_MAX_ATTEMPTS deliveries."""
+
+    def __init__(self, batch_size, name=None):
+        self.redis = get_redis_connection("default")
+        self.batch_size = batch_size
+        self.name = name or f"{socket.gethostname()}-{os.getpid()}"
+        self.channel_layer = get_channel_layer()
+        try:
+            self.redis.xgroup_create(STREAM, GROUP, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def read_new(self, block_ms):
+        response = self.redis.xreadgroup(GROUP, self.name, {STREAM: ">"}, count=self.batch_size, block=block_ms)
+        return [entry for _, entries in response or [] for entry in entries]
+
+    def reclaim(self):
+        """Take over entries another delivery left pending for too long; dead-letter the hopeless ones."""
+        pending = self.redis.xpending_range(
+            STREAM, GROUP, min="-", max="+", count=self.batch_size,
+            idle=settings.NOTIFICATION_OUTBOX_RETRY_AFTER * 1000,
+        )
+        if not pending:
+            return []
+        exhausted = [p["message_id"] for p in pending if p["times_delivered"] >= settings.NOTIFICATION_OUTBOX_MAX_ATTEMPTS]
+        retry = [p["message_id"] for p in pending if p["times_delivered"] < settings.NOTIFICATION_OUTBOX_MAX_ATTEMPTS]
+        for entry_id in exhausted:
+            self.dead_letter(entry_id)
+        if not retry:
+            return []
+        return [
+            entry for entry in self.redis.xclaim(
+                STREAM, GROUP, self.name, min_idle_time=settings.NOTIFICATION_OUTBOX_RETRY_AFTER * 1000, message_ids=retry,
+            )
+            if entry[1]  # Entries deleted in the meantime come back empty
+        ]
+
+    def dead_letter(self, entry_id):
+        entries = self.redis.xrange(STREAM, min=entry_id, max=entry_id)
+        if entries:
+            fields = entries[0][1]
+            self.redis.xadd(DEAD_LETTER_STREAM, {**fields, b"entry_id": entry_id, b"reason": b"max attempts exceeded"})
+            logger.error(f"Notification outbox entry {entry_id!r} dead-lettered after {settings.NOTIFICATION_OUTBOX_MAX_ATTEMPTS} attempts")
+        self.ack([entry_id])
+
+    def ack(self, entry_ids):
+        if entry_ids:
+            pipe = self.redis.pipeline()
+            pipe.xack(STREAM, GROUP, *entry_ids)
+            pipe.xdel(STREAM, *entry_ids)
+            pipe.execute()
+
+    def dispatch(self, entries):
+        """Bulk-insert the notifications of a batch, push everything, ack what went out.
+        Returns the number of entries acked; the rest stay pending for a retry."""
+        notifications, grouped, events, fanouts, done = {}, [], [], [], []
+        for entry_id, fields in entries:
+            try:
+                kind = fields[b"kind"].decode()
+                payload = json.loads(fields[b"payload"])
+            except (KeyError, ValueError) as e:
+                logger.error(f"Malformed notification outbox entry {entry_id!r}: {e}")
+                self.dead_letter(entry_id)
+                continue
+            if kind == "notification" and payload.get("group_key"):
+                grouped.append((entry_id, payload))
+            elif kind == "notification":
+                notifications[payload["outbox_id"]] = (entry_id, payload)
+            elif kind == "live_fanout":
+                fanouts.append((entry_id, payload))
+            else:
+                events.append((entry_id, payload["group"], payload["event"]))
+
+        if notifications:
+            user_ids = {payload[key] for _, payload in notifications.values() for key in ("user_id", "from_user_id") if payload[key]}
+            usernames = {str(user_id): username for user_id, username in User.objects.filter(id__in=user_ids).values_list('id', 'username')}
+            # Recipients deleted since the entry was queued get nothing, rather than failing the batch
+            for outbox_id, (entry_id, payload) in list(notifications.items()):
+                if payload["user_id"] not in usernames:
+                    done.append(entry_id)
+                    del notifications[outbox_id]
+
+            # An entry redelivered after a crash already has its row: ignore_conflicts skips it and it is not counted again
+            existing = set(str(outbox_id) for outbox_id in Notification.objects.filter(
+                outbox_id__in=list(notifications)
+            ).values_list('outbox_id', flat=True))
+            Notification.objects.bulk_create(
+                [
+                    Notification(
+                        outbox_id=outbox_id,
+                        user_id=payload["user_id"],
+                        from_user_id=payload["from_user_id"] if payload["from_user_id"] in usernames else None,
+                        **notification_fields(payload),
+                    )
+                    for outbox_id, (_, payload) in notifications.items()
+                ],
+                ignore_conflicts=True,
+            )
+            adjust_unread(count_new(
+                payload["user_id"] for outbox_id, (_, payload) in notifications.items() if outbox_id not in existing
+            ))
+            rows = Notification.objects.filter(outbox_id__in=list(notifications)).select_related('from_user').order_by('id')
+            pushes = [(row, notification_event(row)) for row in rows]
+            remember([(row.user_id, event) for row, event in pushes])
+            for row, event in pushes:
+                entry_id = notifications[str(row.outbox_id)][0]
+                if self.push(notification_group(usernames[str(row.user_id)]), event):
+                    done.append(entry_id)
+
+        upserted = []
+        for entry_id, payload in grouped:
+            row = self.upsert_group(payload)
+            if row is None:
+                done.append(entry_id)
+            else:
+                upserted.append((entry_id, row, notification_event(row)))
+        remember([(row.user_id, event) for _, row, event in upserted])
+        for entry_id, row, event in upserted:
+            if self.push(notification_group(row.user.username), event):
+                done.append(entry_id)
+
+        for entry_id, group, event in events:
+            if self.push(group, event):
+                done.append(entry_id)
+
+        for entry_id, payload in fanouts:
+            if self.fan_out(payload):
+                done.append(entry_id)
+
+        self.ack(done)
+        return len(done)
+
+    def fan_out(self, payload):
+        """Run one chunk of a live fan-out and queue the next one behind whatever else is waiting."""
+        from .fanout import run_fanout_chunk
+        try:
+            next_payload = run_fanout_chunk(payload, self)
+        except Exception as e:
+            logger.error(f"Live fan-out chunk of stream {payload.get('live_id')} failed, will retry: {e}")
+            return False
+        if next_payload:
+            append_entry("live_fanout", next_payload)
+        return True
+
+    def upsert_group(self, payload):
+        """Write an aggregated group over its row, unread again and moved to the top.
+        The payload carries absolute counts, so a redelivery rewrites the same content."""
+        users = User.objects.in_bulk([user_id for user_id in (payload["user_id"], payload["from_user_id"]) if user_id])
+        user = users.get(uuid.UUID(payload["user_id"]))
+        if user is None:
+            return None
+        from_user = users.get(uuid.UUID(payload["from_user_id"])) if payload["from_user_id"] else None
+        was_unread = Notification.objects.filter(user=user, group_key=payload["group_key"], is_read=False).exists()
+        row, _ = Notification.objects.update_or_create(
+            user=user,
+            group_key=payload["group_key"],
+            defaults={
+                "outbox_id": payload["outbox_id"],
+                "from_user": from_user,
+                **notification_fields(payload),
+                "is_read": False,
+                "created_at": timezone.now(),
+            },
+        )
+        if not was_unread:
+            adjust_unread({user.id: 1})
+        return row
+
+    def push(self, group, event):
+        if not self.channel_layer:
+            return True  # Nothing to push to; the row is what matters
+        try:
+            async_to_sync(self.channel_layer.group_send)(group, event)
+            return True
+        except Exception as e:
+            logger.warning(f"Push of {event.get('type')} to {group} failed, will retry: {e}")
+            return False
+
+    def push_many(self, sends):
+        """Send a batch of (group, event) concurrently on one event loop. Returns how many failed;
+        those are not retried, their rows are already there for the next fetch."""
+        if not self.channel_layer or not sends:
+            return 0
+
+        async def send_all():
+            return await asyncio.gather(
+                *(self.channel_layer.group_send(group, event) for group, event in sends), return_exceptions=True,
+            )
+
+        failures = [result for result in async_to_sync(send_all)() if isinstance(result, Exception)]
+        if failures:
+            logger.warning(f"{len(failures)} of {len(sends)} batched pushes failed: {failures[0]}")
+        return len(failures)
+
+    def requeue_dead(self):
+        """Move every dead-lettered entry back onto the outbox, e.g. after fixing what made it fail."""
+        moved = 0
+        for entry_id, fields in self.redis.xrange(DEAD_LETTER_STREAM):
+            if b"kind" in fields and b"payload" in fields:
+                self.redis.xadd(STREAM, {"kind": fields[b"kind"], "payload": fields[b"payload"]})
+                moved += 1
+            self.redis.xdel(DEAD_LETTER_STREAM, entry_id)
+        return moved
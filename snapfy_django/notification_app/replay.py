@@ -0,0 +1,92 @@
+# notification_app/replay.py
+import json
+import logging
+from django.conf import settings
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+from snapfy_django.redis_pool import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Every push to a user is stamped with the next number of notification_seq:<user_id>, sent with it
+# as `seq`. notification_replay:<user_id> is a list of the user's last NOTIFICATION_REPLAY_LENGTH
+# pushes, newest first, each {"seq", "notification"} with the notification exactly as it went over
+# the socket. Numbering a push and recording it is one script, so the list is in sequence order with
+# no gaps. The dispatcher records before pushing, so anything a reconnecting socket misses between
+# the two is in the list by the time it joins its group. A socket connecting with ?since=<seq> gets
+# every push numbered after it. Aggregated rows are pushed again under the same notification id,
+# so replay goes by push, never by id.
+RECORD = """
+-- KEYS: the seq and list key of each push; ARGV: each push's notification JSON, then the last list index kept, then the TTL
+local seqs = {}
+for i = 1, #ARGV - 2 do
+    local seq = redis.call('INCR', KEYS[2 * i - 1])
+    redis.call('EXPIRE', KEYS[2 * i - 1], ARGV[#ARGV])
+    redis.call('LPUSH', KEYS[2 * i], '{"seq": ' .. seq .. ', "notification": ' .. ARGV[i] .. '}')
+    redis.call('LTRIM', KEYS[2 * i], 0, ARGV[#ARGV - 1])
+    redis.call('EXPIRE', KEYS[2 * i], ARGV[#ARGV])
+    seqs[i] = seq
+end
+return seqs
+"""
+
+
+def seq_key(user_id):
+    return f"notification_seq:{user_id}"
+
+
+def replay_key(user_id):
+    return f"notification_replay:{user_id}"
+
+
+def remember(pushes):
+    """Record a batch of (user_id, push event) ahead of their push, stamping each event with its `seq`.
+    Failing here only costs reconnecting sockets their replay, never the push itself."""
+    if not pushes:
+        return
+    keys = [key for user_id, _ in pushes for key in (seq_key(user_id), replay_key(user_id))]
+    args = [json.dumps(event["notification"]) for _, event in pushes]
+    try:
+        redis = get_redis_connection("default")
+        seqs = redis.register_script(RECORD)(
+            keys=keys, args=[*args, settings.NOTIFICATION_REPLAY_LENGTH - 1, settings.NOTIFICATION_REPLAY_TTL],
+        )
+    except RedisError as e:
+        logger.warning(f"Could not record {len(pushes)} notifications for replay: {e}")
+        return
+    for (_, event), seq in zip(pushes, seqs):
+        event["seq"] = seq
+
+
+async def latest_seq(user_id):
+    """The seq of the user's newest push, 0 when there is none (or it expired)."""
+    try:
+        return int(await get_redis().get(seq_key(user_id)) or 0)
+    except RedisError as e:
+        logger.warning(f"Push sequence of {user_id} unavailable: {e}")
+        return 0
+
+
+async def replay_since(user_id, since):
+    """(pushes numbered after `since` as {"seq", "notification"}, oldest first; whether that is all of
+    them; the newest seq). Incomplete means some fell off the list or expired, or the sequence restarted,
+    and the client has to refetch instead."""
+    try:
+        pipe = get_redis().pipeline(transaction=True)
+        pipe.lrange(replay_key(user_id), 0, -1)
+        pipe.get(seq_key(user_id))
+        entries, latest = await pipe.execute()
+    except RedisError as e:
+        logger.warning(f"Replay list of {user_id} unavailable: {e}")
+        return [], False, 0
+
+    latest = int(latest or 0)
+    newer = []
+    for entry in entries:
+        push = json.loads(entry)
+        if push.get("seq", 0) <= since:  # Entries recorded before pushes were numbered have none
+            break
+        newer.append(push)
+    # Seqs in the list are consecutive, so it is complete when it reaches back to the one after `since`
+    complete = since <= latest and since + len(newer) == latest
+    return newer[::-1], complete, latest
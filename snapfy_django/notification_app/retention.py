@@ -0,0 +1,83 @@
+# notification_app/retention.py
+import time
+import logging
+from datetime import timedelta
+from django.db import connection, models
+from django.db.models import Count
+from django.utils import timezone
+from .models import Notification
+from .counters import reset_unread
+
+logger = logging.getLogger(__name__)
+
+# Notifications are kept under two rules, enforced by the prune_notifications command:
+#   age   read notifications older than NOTIFICATION_RETENTION_DAYS go
+#   cap   past a user's newest NOTIFICATION_KEEP_PER_USER, everything goes, read or not
+# Deletes run in batches of primary keys so no statement holds its locks for long, and
+# vacuum() lets Postgres reuse the freed pages instead of growing the table and its indexes.
+
+
+def delete_in_batches(queryset, batch_size, pause=0):
+    """Delete the rows of `queryset` batch_size at a time. Returns the number deleted."""
+    deleted = 0
+    while True:
+        ids = list(queryset.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += Notification.objects.filter(id__in=ids).delete()[0]
+        if len(ids) < batch_size:
+            return deleted
+        if pause:
+            time.sleep(pause)
+
+
+def prune_expired(days, batch_size, pause=0):
+    """Delete read notifications older than `days`."""
+    cutoff = timezone.now() - timedelta(days=days)
+    return delete_in_batches(Notification.objects.filter(is_read=True, created_at__lt=cutoff), batch_size, pause)
+
+
+def prune_over_cap(keep, batch_size, pause=0):
+    """Delete whatever is past each user's newest `keep` notifications. Returns (rows deleted, users trimmed)."""
+    over = (
+        Notification.objects.values('user_id')
+        .annotate(total=Count('id'))
+        .filter(total__gt=keep)
+        .values_list('user_id', flat=True)
+    )
+    deleted, user_ids = 0, []
+    for user_id in list(over):
+        newest = Notification.objects.filter(user_id=user_id).order_by('-created_at', '-id')
+        boundary = newest.values_list('created_at', 'id')[keep - 1:keep].first()
+        if not boundary:
+            continue
+        created, boundary_id = boundary
+        older = Notification.objects.filter(user_id=user_id).filter(
+            models.Q(created_at__lt=created) | models.Q(created_at=created, id__lt=boundary_id)
+        )
+        deleted += delete_in_batches(older, batch_size, pause)
+        user_ids.append(user_id)
+    # Some of those may have been unread
+    reset_unread(user_ids)
+    return deleted, len(user_ids)
+
+
+def table_sizes():
+    """(table bytes, index bytes) of the notification table on Postgres, None elsewhere."""
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT pg_relation_size(%s), pg_indexes_size(%s)",
+            [Notification._meta.db_table, Notification._meta.db_table],
+        )
+        return cursor.fetchone()
+
+
+def vacuum():
+    """VACUUM ANALYZE the notification table so freed space is reused; Postgres only, outside a transaction."""
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(f'VACUUM (ANALYZE) "{Notification._meta.db_table}"')
+    return True
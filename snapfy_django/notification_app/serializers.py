@@ -3,11 +3,24 @@ from rest_framework import serializers
 from .models import Notification
 
 class NotificationSerializer(serializers.ModelSerializer):
+    user = serializers.UUIDField(source='user_id', read_only=True)
+    from_user = serializers.SerializerMethodField()
+
     class Meta:
         model = Notification
-        fields = ['id', 'user', 'message', 'is_read', 'from_user', 'created_at', 'live_id']
+        fields = ['id', 'user', 'type', 'from_user', 'target_type', 'target_id', 'extras', 'is_read', 'created_at']
         read_only_fields = ['user']
-    
+
+    def get_from_user(self, obj):
+        # Querysets select_related('from_user'), so a page loads its actors in the same query
+        if obj.from_user is None:
+            return None
+        return {
+            'id': str(obj.from_user.id),
+            'username': obj.from_user.username,
+            'profile_picture': str(obj.from_user.profile_picture) if obj.from_user.profile_picture else None,
+        }
+
     def create(self, validated_data):
         validated_data['user'] = self.context['request'].user
         return super().create(validated_data)
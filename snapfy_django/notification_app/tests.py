@@ -1,3 +1,381 @@
-from django.test import TestCase
+import io
+import time
+import asyncio
+from datetime import timedelta
+from unittest import mock
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from django.core.mail import EmailMessage
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings, tag
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django_redis import get_redis_connection
+from rest_framework.test import APIClient
+from chat_app import presence
+from snapfy_django.smtp_pool import SMTPPool
+from snapfy_django.testing import FakeRedisMixin, SMTPStandIn, connect_socket, receive_all, smtp_settings
+from user_app.models import BlockedUser, User
+from . import outbox, retention
+from .aggregation import flush_due
+from .counters import adjust_unread, get_unread_count, unread_key
+from .replay import remember
+from .routing import websocket_urlpatterns
+from .digest import send_digests
+from .fanout import fanout_progress, run_fanout_chunk
+from .models import Notification, NotificationDelivery
+from .utils import create_follow_notification, create_like_notification
+
+
+class NotificationTestCase(FakeRedisMixin, TestCase):
+    def make_user(self, username):
+        return User.objects.create(username=username, email=f"{username}@example.com", is_verified=True)
+
+    def dispatch_all(self):
+        dispatcher = outbox.Dispatcher(batch_size=1000, name="test")
+        return dispatcher.dispatch(dispatcher.read_new(None))
+
+
+class OutboxLatencyTests(NotificationTestCase):
+    STALL = 2  # Seconds a stalled channel layer takes per group_send
+
+    def setUp(self):
+        super().setUp()
+        self.alice = self.make_user("alice")
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def follow(self, username):
+        """Seconds POST /users/<username>/follow/ took."""
+        self.make_user(username)
+        started = time.perf_counter()
+        response = self.client.post(f"/api/users/{username}/follow/")
+        self.assertEqual(response.status_code, 200)
+        return time.perf_counter() - started
+
+    def test_request_latency_does_not_depend_on_the_channel_layer(self):
+        async def stalled(*args, **kwargs):
+            await asyncio.sleep(self.STALL)
+
+        healthy = [self.follow(f"healthy{i}") for i in range(5)]
+        with mock.patch("channels.layers.InMemoryChannelLayer.group_send", side_effect=stalled) as group_send:
+            slow = [self.follow(f"slow{i}") for i in range(5)]
+        with mock.patch("channels.layers.InMemoryChannelLayer.group_send", side_effect=ConnectionError) as failing:
+            broken = [self.follow(f"broken{i}") for i in range(5)]
+        print(f"\nfollow latency: healthy max {max(healthy):.3f}s, stalled layer max {max(slow):.3f}s, "
+              f"failing layer max {max(broken):.3f}s")
+
+        group_send.assert_not_called()
+        failing.assert_not_called()
+        self.assertLess(max(slow + broken), self.STALL / 2)
+        # Nothing was lost: every follow is queued and the worker delivers it
+        self.assertEqual(get_redis_connection("default").xlen(outbox.STREAM), 15)
+        self.assertEqual(self.dispatch_all(), 15)
+        self.assertEqual(Notification.objects.filter(type="follow").count(), 15)
+
+
+class UnreadCounterTests(NotificationTestCase):
+    def test_only_cached_counters_are_adjusted(self):
+        alice, bob = self.make_user("alice"), self.make_user("bob")
+        Notification.objects.create(user=alice, type="follow")
+        self.assertEqual(get_unread_count(alice.id), 1)
+        redis = get_redis_connection("default")
+
+        adjust_unread({alice.id: 2, bob.id: 1})
+        self.assertEqual(int(redis.get(unread_key(alice.id))), 3)
+        self.assertGreater(redis.ttl(unread_key(alice.id)), 0)
+        # An absent counter is left to be rebuilt, never started from the delta without a TTL
+        self.assertFalse(redis.exists(unread_key(bob.id)))
+
+
+class RetentionTests(NotificationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice, self.bob = self.make_user("alice"), self.make_user("bob")
+
+    def notify(self, user, count, days_old=0, is_read=False):
+        """`count` notifications for `user`, all created at the same instant `days_old` days ago."""
+        rows = Notification.objects.bulk_create(Notification(user=user, type="follow", is_read=is_read) for _ in range(count))
+        created_at = timezone.now().replace(microsecond=0) - timedelta(days=days_old)
+        Notification.objects.filter(id__in=[row.id for row in rows]).update(created_at=created_at)
+        return sorted(row.id for row in rows)
+
+    def test_prune_expired_deletes_only_old_read_rows(self):
+        self.notify(self.alice, 3, days_old=40, is_read=True)
+        kept = self.notify(self.alice, 2, days_old=40) + self.notify(self.bob, 2, days_old=10, is_read=True)
+        self.assertEqual(retention.prune_expired(30, batch_size=2), 3)
+        self.assertEqual(sorted(Notification.objects.values_list("id", flat=True)), sorted(kept))
+
+    def test_delete_in_batches_runs_until_nothing_is_left(self):
+        self.notify(self.alice, 7)
+        table = Notification._meta.db_table
+        with CaptureQueriesContext(connection) as queries:
+            deleted = retention.delete_in_batches(Notification.objects.filter(user=self.alice), batch_size=3)
+        self.assertEqual(deleted, 7)
+        self.assertEqual(len([query for query in queries if query["sql"].startswith(f'DELETE FROM "{table}"')]), 3)
+        self.assertFalse(Notification.objects.exists())
+
+    def test_prune_over_cap_splits_ties_by_id_and_resets_counters(self):
+        self.notify(self.alice, 2, days_old=5)
+        tied = self.notify(self.alice, 4, days_old=1)
+        self.notify(self.bob, 3)
+        for user in (self.alice, self.bob):
+            get_unread_count(user.id)  # Caches the counter
+        redis = get_redis_connection("default")
+
+        self.assertEqual(retention.prune_over_cap(3, batch_size=2), (3, 1))
+        # Of the four created at the same instant, the three newest ids stay
+        self.assertEqual(sorted(Notification.objects.filter(user=self.alice).values_list("id", flat=True)), tied[1:])
+        self.assertEqual(Notification.objects.filter(user=self.bob).count(), 3)
+        self.assertFalse(redis.exists(unread_key(self.alice.id)))
+        self.assertTrue(redis.exists(unread_key(self.bob.id)))
+        self.assertEqual(get_unread_count(self.alice.id), 3)
+
+    def test_command_runs_both_rules(self):
+        self.notify(self.alice, 2, days_old=40, is_read=True)
+        self.notify(self.bob, 5)
+        out = io.StringIO()
+        call_command("prune_notifications", "--once", "--days=30", "--keep=3", "--pause=0", stdout=out)
+        self.assertIn("Removed 2 read notifications older than 30 days and 2 past the newest 3 of 1 users", out.getvalue())
+        self.assertEqual(Notification.objects.count(), 3)
+
+
+@override_settings(LIVE_FANOUT_CHUNK_SIZE=10)
+class LiveFanoutTests(NotificationTestCase):
+    FOLLOWERS = 25
+
+    def setUp(self):
+        super().setUp()
+        self.host = self.make_user("host")
+        self.followers = User.objects.bulk_create(
+            User(username=f"follower{i}", email=f"follower{i}@example.com", is_verified=True) for i in range(self.FOLLOWERS)
+        )
+        self.host.followers.add(*self.followers)
+        self.blocker = self.followers[7]
+        BlockedUser.objects.create(blocker=self.blocker, blocked=self.host)
+        self.client = APIClient()
+        self.client.force_authenticate(self.host)
+
+    def test_every_follower_is_notified_once_across_chunks(self):
+        response = self.client.post("/api/live/", {"title": "Hello"})
+        self.assertEqual(response.status_code, 201)
+        live_id = response.data["id"]
+        # The request only queued the fan-out
+        self.assertFalse(Notification.objects.filter(type="live").exists())
+        self.assertEqual(get_redis_connection("default").xlen(outbox.STREAM), 1)
+        self.assertEqual(fanout_progress(live_id)["status"], "queued")
+
+        passes = 0
+        while self.dispatch_all():  # Each chunk re-queues the next one
+            passes += 1
+        self.assertEqual(passes, 4)  # 24 eligible followers in chunks of 10, then the pass that finds none
+
+        notified = Notification.objects.filter(type="live", target_id=str(live_id)).values_list("user_id", flat=True)
+        self.assertEqual(sorted(notified), sorted(user.id for user in self.followers if user != self.blocker))
+        self.assertEqual(
+            self.client.get(f"/api/live/{live_id}/fanout/").data,
+            {**fanout_progress(live_id), "status": "done", "total": self.FOLLOWERS - 1, "notified": self.FOLLOWERS - 1},
+        )
+
+        # A chunk delivered again adds nothing
+        run_fanout_chunk({"live_id": live_id, "after": None}, outbox.Dispatcher(batch_size=10, name="test"))
+        self.assertEqual(Notification.objects.filter(type="live").count(), self.FOLLOWERS - 1)
+        self.assertEqual(get_unread_count(self.followers[0].id), 1)
+
+
+class ReplayTests(FakeRedisMixin, TransactionTestCase):
+    # TransactionTestCase: the consumer authenticates through database_sync_to_async
+
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create(username="alice", email="alice@example.com", is_verified=True)
+
+    async def connect(self, since=None):
+        return await connect_socket(
+            URLRouter(websocket_urlpatterns), "/ws/notifications/alice/", self.alice,
+            "" if since is None else f"since={since}",
+        )
+
+    def push(self, notification_id, text):
+        remember([(self.alice.id, {"type": "notification_message", "notification": {"id": notification_id, "text": text}})])
+
+    async def test_replay_follows_pushes_not_notification_ids(self):
+        await database_sync_to_async(self.push)(7, "bob liked your post")
+        communicator = await self.connect()
+        self.assertEqual(await receive_all(communicator), [{"type": "sequence", "seq": 1}])
+        await communicator.disconnect()
+
+        # While the socket is away a comment arrives, then the like group is pushed again under its id
+        await database_sync_to_async(self.push)(8, "bob commented")
+        await database_sync_to_async(self.push)(7, "bob and 1 other liked your post")
+        communicator = await self.connect(since=1)
+        frames = await receive_all(communicator)
+        self.assertEqual(
+            [(frame["seq"], frame["notification"]["text"]) for frame in frames[:-1]],
+            [(2, "bob commented"), (3, "bob and 1 other liked your post")],
+        )
+        self.assertEqual(frames[-1], {"type": "replay_done", "replayed": 2, "complete": True, "seq": 3})
+        await communicator.disconnect()
+
+    @override_settings(NOTIFICATION_REPLAY_LENGTH=2)
+    async def test_a_socket_too_far_behind_is_told_to_refetch(self):
+        for notification_id in range(4):
+            await database_sync_to_async(self.push)(notification_id, "follow")
+        communicator = await self.connect(since=1)
+        frames = await receive_all(communicator)
+        self.assertEqual([frame["seq"] for frame in frames[:-1]], [3, 4])
+        self.assertEqual(frames[-1], {"type": "replay_done", "replayed": 2, "complete": False, "seq": 4})
+        await communicator.disconnect()
+
+    async def test_live_pushes_carry_their_seq(self):
+        bob = await database_sync_to_async(lambda: User.objects.create(username="bob", email="bob@example.com"))()
+        communicator = await self.connect()
+        await receive_all(communicator)
+
+        def follow_and_dispatch():
+            create_follow_notification(self.alice, bob)
+            dispatcher = outbox.Dispatcher(batch_size=10, name="test")
+            dispatcher.dispatch(dispatcher.read_new(None))
+
+        await database_sync_to_async(follow_and_dispatch)()
+        frames = await receive_all(communicator)
+        self.assertEqual([(frame["type"], frame["seq"]) for frame in frames], [("notification", 1)])
+        await communicator.disconnect()
+
+
+@tag('load')
+@override_settings(NOTIFICATION_AGGREGATION_WINDOW=0)
+class LikeAggregationLoadTests(NotificationTestCase):
+    LIKES = 10000
+    WINDOWS = 2  # Flushes while the likes arrive, as the dispatcher would between them
+
+    def test_ten_thousand_likes_make_one_row_and_a_push_per_window(self):
+        author = self.make_user("author")
+        post_id = 42
+        likers = User.objects.bulk_create(
+            User(username=f"liker{i}", email=f"liker{i}@example.com", is_verified=True) for i in range(self.LIKES)
+        )
+        layer = get_channel_layer()
+        async_to_sync(layer.group_add)(outbox.notification_group(author.username), "author-socket")
+
+        started = time.perf_counter()
+        per_window = self.LIKES // self.WINDOWS
+        for start in range(0, self.LIKES, per_window):
+            for liker in likers[start:start + per_window]:
+                create_like_notification(author, liker, post_id)
+            self.assertEqual(flush_due(), 1)
+            self.assertEqual(self.dispatch_all(), 1)
+        elapsed = time.perf_counter() - started
+
+        frames = []
+        while "author-socket" in layer.channels:  # The in-memory layer drops a channel once it is drained
+            frames.append(async_to_sync(layer.receive)("author-socket"))
+        rows = Notification.objects.filter(user=author)
+        print(f"\n{self.LIKES} likes in {elapsed:.2f}s: {rows.count()} row, {len(frames)} frames")
+
+        self.assertEqual(rows.count(), 1)
+        self.assertEqual(rows.get().extras["actor_count"], self.LIKES)
+        self.assertEqual(len(frames), self.WINDOWS)
+        self.assertEqual(frames[-1]["notification"]["extras"]["actor_count"], self.LIKES)
+
+
+class SMTPTestCase(NotificationTestCase):
+    LATENCY = 0.01  # Seconds the stand-in spends on each message, like a remote relay
+
+    def start_smtp(self, **options):
+        server = SMTPStandIn(latency=self.LATENCY, **options)
+        self.addCleanup(server.stop)
+        mail = smtp_settings(server)
+        mail.enable()
+        self.addCleanup(mail.disable)
+        return server
+
+
+@override_settings(SMTP_RETRY_BACKOFF=0.01)
+class SMTPPoolTests(SMTPTestCase):
+    def test_pooled_connections_raise_throughput(self):
+        server = self.start_smtp()
+        messages = [EmailMessage("Hi", "Body", to=[f"user{i}@example.com"]) for i in range(200)]
+        single, pooled = SMTPPool(size=1), SMTPPool(size=8)
+        single.send_many(messages[:50])
+        self.assertEqual(pooled.send_many(messages), [True] * 200)
+        print(f"\n1 connection: {single.stats()}\n8 connections: {pooled.stats()}")
+
+        self.assertEqual(len(server.messages), 250)
+        self.assertEqual(pooled.stats()["connections"], 8)  # One per worker, kept for all its messages
+        self.assertGreater(pooled.stats()["per_second"], 3 * single.stats()["per_second"])
+
+    def test_dropped_connections_are_retried_and_rejections_are_not(self):
+        server = self.start_smtp(reject={"gone@example.com"}, drop_on={2})
+        pool = SMTPPool(size=1)
+        results = pool.send_many([
+            EmailMessage("Hi", "Body", to=[address]) for address in ("a@example.com", "b@example.com", "gone@example.com")
+        ])
+        self.assertEqual(results, [True, True, False])
+        self.assertEqual(pool.stats()["retries"], 1)  # b's first transaction was dropped
+        self.assertEqual(pool.errors[2].recipients["gone@example.com"][0], 550)
+        self.assertEqual([recipients for recipients, _ in server.messages], [["a@example.com"], ["b@example.com"]])
+
+
+class DigestTests(SMTPTestCase):
+    USERS = 60
+
+    def setUp(self):
+        super().setUp()
+        self.server = self.start_smtp()
+        self.actor = self.make_user("actor")
+        self.users = User.objects.bulk_create(
+            User(username=f"user{i}", email=f"user{i}@example.com", is_verified=True) for i in range(self.USERS)
+        )
+        Notification.objects.bulk_create(
+            Notification(user=user, from_user=self.actor, type="follow") for user in self.users for _ in range(3)
+        )
+        Notification.objects.bulk_create(
+            Notification(user=self.users[0], from_user=self.actor, type="follow") for _ in range(20)
+        )
+        Notification.objects.update(created_at=timezone.now() - timedelta(hours=1))
+
+    def test_offline_users_get_one_digest_each(self):
+        online, opted_out, caught_up, fresh = self.users[1:5]
+        async_to_sync(presence.register_connection)(online.id, "socket", "session")
+        NotificationDelivery.objects.create(user=opted_out, channel="email", enabled=False)
+        Notification.objects.filter(user=caught_up).update(is_read=True)
+        Notification.objects.filter(user=fresh).update(created_at=timezone.now())
+
+        pool = SMTPPool(size=4)
+        self.assertEqual(send_digests(pool, batch_size=16), (self.USERS - 4, 0))
+        print(f"\ndigests: {pool.stats()}, {self.server.connections} SMTP connections")
+
+        self.assertEqual(len(self.server.messages), self.USERS - 4)
+        for user in (online, opted_out, caught_up, fresh):
+            self.assertEqual(self.server.sent_to(user.email), [])
+        [digest] = self.server.sent_to(self.users[0].email)
+        self.assertIn("23 new notifications", digest)
+        self.assertIn("and 13 more", digest)
+        # Until something new arrives, nobody is due another one
+        self.assertEqual(send_digests(SMTPPool(size=4)), (0, 0))
+
+    def test_failed_digests_are_retried_on_the_next_pass(self):
+        self.server.drop_on = {1}  # The connection dies during the first digest
+        self.assertEqual(send_digests(SMTPPool(size=1, max_attempts=1)), (self.USERS - 1, 1))
+        self.assertEqual(send_digests(SMTPPool(size=4)), (1, 0))
+
+    def test_refused_digests_wait_for_the_next_interval(self):
+        refused = self.users[0]
+        self.server.reject = {refused.email}
+        self.assertEqual(send_digests(SMTPPool(size=4)), (self.USERS - 1, 1))
+        # A 550 will not change by retrying, so the address is not tried again on every pass
+        self.assertEqual(send_digests(SMTPPool(size=4)), (0, 0))
+        self.assertIsNotNone(NotificationDelivery.objects.get(user=refused, channel="email").last_sent_at)
+        self.assertEqual(self.server.sent_to(refused.email), [])
+
+    def test_digests_leave_out_notifications_inside_the_delay(self):
+        user = self.users[0]
+        Notification.objects.bulk_create(Notification(user=user, from_user=self.actor, type="follow") for _ in range(5))
+        send_digests(SMTPPool(size=4))
+        [digest] = self.server.sent_to(user.email)
+        self.assertIn("23 new notifications", digest)  # Not the 5 still being seen live
 
-# Create your tests here.
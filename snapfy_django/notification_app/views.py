@@ -2,32 +2,121 @@ from rest_framework import status, viewsets
 from rest_framework.decorators import api_view, action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from django.db import models
 from django.shortcuts import get_object_or_404
-from .models import Notification
+from chat_app.utils import parse_cursor, make_cursor
+from .models import Notification, NotificationDelivery
 from .serializers import NotificationSerializer
-import json
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
+from .counters import get_unread_count, adjust_unread, reset_unread
+
+NOTIFICATION_PAGE_SIZE = 20
+NOTIFICATION_MAX_PAGE_SIZE = 100
+MARK_READ_MAX_IDS = 500
+
 
 class NotificationViewSet(viewsets.ModelViewSet):
     serializer_class = NotificationSerializer
     permission_classes = [IsAuthenticated]
-    
+
     def get_queryset(self):
-        return Notification.objects.filter(user=self.request.user).order_by('-created_at')
-    
+        return Notification.objects.filter(user=self.request.user).select_related('from_user').order_by('-created_at', '-id')
+
+    def list(self, request):
+        """Newest first, a page at a time: ?cursor=<next_cursor>&limit=&type=, keyset-paginated on the
+        (user, created_at, id) index, or (user, type, created_at, id) for one type."""
+        try:
+            limit = max(1, min(int(request.query_params.get('limit') or NOTIFICATION_PAGE_SIZE), NOTIFICATION_MAX_PAGE_SIZE))
+        except (TypeError, ValueError):
+            return Response({"error": "limit must be a number"}, status=status.HTTP_400_BAD_REQUEST)
+
+        notifications = self.get_queryset()
+        notification_type = request.query_params.get('type')
+        if notification_type:
+            if notification_type not in dict(Notification.TYPES):
+                return Response({"error": "Unknown notification type"}, status=status.HTTP_400_BAD_REQUEST)
+            notifications = notifications.filter(type=notification_type)
+        cursor = request.query_params.get('cursor')
+        if cursor:
+            parsed = parse_cursor(cursor)
+            if not parsed:
+                return Response({"error": "Invalid cursor"}, status=status.HTTP_400_BAD_REQUEST)
+            created, last_id = parsed
+            notifications = notifications.filter(
+                models.Q(created_at__lt=created) | models.Q(created_at=created, id__lt=last_id)
+            )
+        page = list(notifications[:limit + 1])
+        has_more = len(page) > limit
+        page = page[:limit]
+
+        return Response({
+            "results": self.get_serializer(page, many=True).data,
+            "next_cursor": make_cursor(page[-1].created_at, page[-1].id) if has_more else None,
+        })
+
+    def perform_destroy(self, instance):
+        was_unread = not instance.is_read
+        instance.delete()
+        if was_unread:
+            adjust_unread({instance.user_id: -1})
+
+    @action(detail=False, methods=['get'], url_path='unread-count')
+    def unread_count(self, request):
+        return Response({'unread_count': get_unread_count(request.user.id)})
+
     @action(detail=True, methods=['patch'])
     def read(self, request, pk=None):
         notification = self.get_object()
-        notification.is_read = True
-        notification.save()
+        if Notification.objects.filter(id=notification.id, is_read=False).update(is_read=True):
+            adjust_unread({request.user.id: -1})
         return Response({'status': 'notification marked as read'})
-    
-    @action(detail=False, methods=['post'])
+
+    @action(detail=False, methods=['post'], url_path='mark-read')
+    def mark_read(self, request):
+        """Mark several notifications read at once: {"ids": [...]} for a selection, or
+        {"up_to": <id>} for that notification and everything older, as a watermark."""
+        unread = self.get_queryset().filter(is_read=False)
+        ids, up_to = request.data.get('ids'), request.data.get('up_to')
+        try:
+            if ids is not None and not isinstance(ids, list):
+                raise TypeError(ids)
+            ids = [int(notification_id) for notification_id in ids] if ids is not None else None
+            up_to = int(up_to) if up_to is not None else None
+        except (TypeError, ValueError):
+            return Response({"error": "ids and up_to must be notification ids"}, status=status.HTTP_400_BAD_REQUEST)
+
+        if ids is not None:
+            if len(ids) > MARK_READ_MAX_IDS:
+                return Response({"error": f"At most {MARK_READ_MAX_IDS} ids at a time"}, status=status.HTTP_400_BAD_REQUEST)
+            unread = unread.filter(id__in=ids)
+        elif up_to is not None:
+            watermark = self.get_queryset().filter(id=up_to).values_list('created_at', 'id').first()
+            if not watermark:
+                return Response({"error": "Notification not found"}, status=status.HTTP_404_NOT_FOUND)
+            created, watermark_id = watermark
+            unread = unread.filter(models.Q(created_at__lt=created) | models.Q(created_at=created, id__lte=watermark_id))
+        else:
+            return Response({"error": "Provide ids or up_to"}, status=status.HTTP_400_BAD_REQUEST)
+
+        updated = unread.update(is_read=True)
+        adjust_unread({request.user.id: -updated})
+        return Response({'marked': updated, 'unread_count': get_unread_count(request.user.id)})
+
+    @action(detail=False, methods=['post'], url_path='mark-all-read')
     def mark_all_read(self, request):
-        queryset = self.get_queryset().filter(is_read=False)
-        count = queryset.count()
-        if count == 0:
+        updated = self.get_queryset().filter(is_read=False).update(is_read=True)
+        reset_unread([request.user.id])  # Recounted on the next read, so rows arriving meanwhile still count
+        if updated == 0:
             return Response({'message': 'No unread notifications to mark as read'}, status=status.HTTP_200_OK)
-        queryset.update(is_read=True)
-        return Response({'message': f'Marked {count} notifications as read'}, status=status.HTTP_200_OK)
\ No newline at end of file
+        return Response({'message': f'Marked {updated} notifications as read'}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get', 'patch'])
+    def delivery(self, request):
+        """Out-of-app channels and whether they are on, e.g. {"email": true}; PATCH a subset to change them."""
+        if request.method == 'PATCH':
+            channels = dict(NotificationDelivery.CHANNELS)
+            if not request.data or any(channel not in channels or not isinstance(enabled, bool) for channel, enabled in request.data.items()):
+                return Response({"error": f"Expected booleans for {', '.join(channels)}"}, status=status.HTTP_400_BAD_REQUEST)
+            for channel, enabled in request.data.items():
+                NotificationDelivery.objects.update_or_create(user=request.user, channel=channel, defaults={'enabled': enabled})
+        enabled = dict(NotificationDelivery.objects.filter(user=request.user).values_list('channel', 'enabled'))
+        return Response({channel: enabled.get(channel, True) for channel, _ in NotificationDelivery.CHANNELS})
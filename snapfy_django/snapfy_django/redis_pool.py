@@ -0,0 +1,73 @@
+# snapfy_django/redis_pool.py
+import asyncio
+import time
+import weakref
+import logging
+import redis.asyncio as redis
+from redis.exceptions import ConnectionError as RedisConnectionError
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# One pool per event loop: redis.asyncio connections are bound to the loop that opened them.
+_pools = weakref.WeakKeyDictionary()
+
+
+class InstrumentedConnectionPool(redis.BlockingConnectionPool):
+    """Blocking pool that records how long callers wait to borrow a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.acquired = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    async def get_connection(self, command_name, *keys, **options):
+        start = time.perf_counter()
+        try:
+            connection = await super().get_connection(command_name, *keys, **options)
+        except RedisConnectionError:
+            self.timeouts += 1
+            raise
+        waited = time.perf_counter() - start
+        self.acquired += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        return connection
+
+    def stats(self):
+        return {
+            "max_connections": self.max_connections,
+            "in_use": len(self._in_use_connections),
+            "available": len(self._available_connections),
+            "acquired": self.acquired,
+            "timeouts": self.timeouts,
+            "avg_wait_ms": round(self.total_wait / self.acquired * 1000, 3) if self.acquired else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 3),
+        }
+
+
+def get_pool():
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is None:
+        pool = InstrumentedConnectionPool.from_url(
+            settings.REDIS_URL,
+            max_connections=settings.REDIS_POOL_MAX_CONNECTIONS,
+            timeout=settings.REDIS_POOL_TIMEOUT,
+        )
+        _pools[loop] = pool
+        logger.info(f"Created async Redis pool (max_connections={settings.REDIS_POOL_MAX_CONNECTIONS})")
+    return pool
+
+
+def get_redis():
+    """Return an async Redis client borrowing from the process-wide pool.
+    Clients are cheap; never close them, the pool owns the sockets."""
+    return redis.Redis(connection_pool=get_pool())
+
+
+def pool_metrics():
+    """Pool size and wait-time metrics for every live pool in this process."""
+    return [pool.stats() for pool in list(_pools.values())]
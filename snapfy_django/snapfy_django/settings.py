@@ -233,6 +233,26 @@ REDIS_PORT = env('REDIS_PORT', default='6379')
 REDIS_PASSWORD = env('REDIS_PASSWORD', default='')
 REDIS_URL = f"redis://:{REDIS_PASSWORD}@{REDIS_HOST}:{REDIS_PORT}/0" if REDIS_PASSWORD else f"redis://{REDIS_HOST}:{REDIS_PORT}/0"
 
+# Shared async pool used by websocket consumers (see snapfy_django/redis_pool.py)
+REDIS_POOL_MAX_CONNECTIONS = env.int('REDIS_POOL_MAX_CONNECTIONS', default=50)
+REDIS_POOL_TIMEOUT = env.int('REDIS_POOL_TIMEOUT', default=5)  # Seconds to wait for a free connection
+
+# Presence (see chat_app/presence.py), all in seconds
+PRESENCE_HEARTBEAT_INTERVAL = 30
+PRESENCE_TTL = 90  # A connection missing three heartbeats counts as gone
+PRESENCE_OFFLINE_GRACE = 5  # Reconnects within this window never show as offline
+PRESENCE_BROADCAST_WINDOW = 5  # At most one status update per user per window reaches contacts
+PRESENCE_FLUSH_INTERVAL = 60  # How often flush_presence copies last_seen to Postgres
+
+# How long a client tempId stays bound to the message it created; retries inside it never duplicate
+CHAT_SEND_IDEMPOTENCY_TTL = 3600
+CHAT_SEND_PENDING_TTL = 30  # A tempId whose first attempt never finished can be retried after this
+
+# Write format for message bodies, 'aesgcm' (binary column) or 'fernet' (legacy text tokens)
+MESSAGE_CIPHER = env('MESSAGE_CIPHER', default='aesgcm')
+MESSAGE_CRYPTO_LAZY_MIGRATE = True  # Rewrite Fernet rows as AES-GCM when history pages read them
+CHAT_PREVIEW_TTL = 86400  # Decrypted last-message preview per room, rebuilt on miss
+
 CACHES = {
     "default": {
         "BACKEND": "django_redis.cache.RedisCache",
@@ -286,6 +306,29 @@ cloudinary.config(
 
 DEFAULT_FILE_STORAGE = 'cloudinary_storage.storage.MediaCloudinaryStorage'
 
+# Chat attachments are uploaded by the client straight to storage with a signed descriptor.
+# 'local' swaps Cloudinary for MEDIA_ROOT, for tests and offline development.
+CHAT_UPLOAD_BACKEND = env('CHAT_UPLOAD_BACKEND', default='cloudinary')
+CHAT_UPLOAD_TTL = 900  # Seconds a descriptor stays usable
+CHAT_UPLOAD_MAX_BYTES = 25 * 1024 * 1024
+
+# Voice notes are transcoded by the process_voice_notes worker
+VOICE_NOTE_BITRATE = '24k'  # Opus bitrate, ample for speech
+VOICE_NOTE_WAVEFORM_BUCKETS = 64
+VOICE_NOTE_POLL_INTERVAL = 5
+VOICE_NOTE_CLAIM_TIMEOUT = 600  # Seconds a worker may hold a note before it is requeued for another
+
+# Call registry in Redis (chat_app.calls); CallLog keeps only the summary
+CALL_RING_TTL = 60  # An unanswered call stops counting as active after this
+CALL_STATE_TTL = 4 * 3600  # An answered call, refreshed by every offer/answer
+CALL_SDP_TTL = 120  # SDP is only needed while the peers connect
+CALL_ICE_BATCH_WINDOW = 0.03  # Seconds trickle ICE candidates are held to go out as one frame
+
+# Messages are partitioned by month on Postgres (chat_app.partitions), maintained by manage_message_partitions
+MESSAGE_PARTITIONS_AHEAD = 3  # Future months kept ready so inserts never land in the default partition
+MESSAGE_HOT_MONTHS = env.int('MESSAGE_HOT_MONTHS', default=0)  # Months kept attached; 0 never archives
+MESSAGE_ARCHIVE_ROOT = env('MESSAGE_ARCHIVE_ROOT', default=os.path.join(BASE_DIR, 'message_archive'))
+
 
 
 # Google Client ID
@@ -314,3 +357,57 @@ LOGGING = {
 
 
 ASGI_APPLICATION = 'snapfy_django.asgi.application'
+
+# Notification outbox (notification_app.outbox), drained by dispatch_notifications
+NOTIFICATION_OUTBOX_BATCH_SIZE = 200
+NOTIFICATION_OUTBOX_BLOCK_MS = 2000  # How long the dispatcher waits on an empty outbox
+NOTIFICATION_OUTBOX_RETRY_AFTER = 30  # Seconds an unacked entry stays pending before it is retried
+NOTIFICATION_OUTBOX_MAX_ATTEMPTS = 5  # Deliveries before an entry goes to notification_outbox:dead
+
+# Notification aggregation (notification_app.aggregation), flushed by dispatch_notifications
+NOTIFICATION_AGGREGATED_TYPES = ('like',)  # Grouped per (recipient, type, target)
+NOTIFICATION_AGGREGATION_WINDOW = env.int('NOTIFICATION_AGGREGATION_WINDOW', default=30)  # Seconds a group collects actors before its push
+NOTIFICATION_AGGREGATE_ACTORS_TTL = 7 * 24 * 3600  # How long a group's distinct actors are remembered for its count
+
+# Go-live fan-out (notification_app.fanout), run in chunks by dispatch_notifications
+LIVE_FANOUT_CHUNK_SIZE = 1000  # Followers notified per outbox entry
+LIVE_FANOUT_PROGRESS_TTL = 24 * 3600
+
+# Per-user unread counters in Redis (notification_app.counters)
+NOTIFICATION_UNREAD_TTL = 3600  # A cached count is rebuilt from Postgres at least this often
+
+# Notification retention, enforced by prune_notifications (notification_app.retention)
+NOTIFICATION_RETENTION_DAYS = env.int('NOTIFICATION_RETENTION_DAYS', default=90)  # Read notifications older than this are deleted
+NOTIFICATION_KEEP_PER_USER = env.int('NOTIFICATION_KEEP_PER_USER', default=1000)  # Newest notifications kept per user; 0 keeps all
+NOTIFICATION_RETENTION_INTERVAL = 6 * 3600
+
+# Replay for reconnecting notification sockets (notification_app.replay)
+NOTIFICATION_REPLAY_LENGTH = 100  # Pushes kept per user; a socket further behind refetches instead
+NOTIFICATION_REPLAY_TTL = 24 * 3600
+
+# Pooled SMTP for bulk mail (snapfy_django.smtp_pool)
+SMTP_POOL_SIZE = env.int('SMTP_POOL_SIZE', default=4)  # Concurrent connections per sender
+SMTP_MAX_ATTEMPTS = 3
+SMTP_RETRY_BACKOFF = 1.0  # Seconds before the first retry, doubling after each
+SMTP_IDLE_TIMEOUT = 60  # Seconds a kept-open connection may sit unused before it is reopened
+
+# Email digests for offline users (notification_app.digest)
+NOTIFICATION_DIGEST_INTERVAL = env.int('NOTIFICATION_DIGEST_INTERVAL', default=6 * 3600)  # At most one digest per user this often
+NOTIFICATION_DIGEST_DELAY = 15 * 60  # How long a notification sits unread before it goes in a digest
+NOTIFICATION_DIGEST_MAX_ITEMS = 10  # Listed per digest; the rest are counted
+NOTIFICATION_DIGEST_BATCH_SIZE = 200
+NOTIFICATION_DIGEST_POLL = 300
+
+# Account mail outbox, delivered by send_emails (user_app.email_outbox)
+EMAIL_OUTBOX_BATCH_SIZE = 50
+EMAIL_OUTBOX_POLL = 1  # Seconds between polls of an empty outbox; an OTP waits at most about this long
+EMAIL_OUTBOX_CLAIM_TIMEOUT = 120  # A claimed email not finished by then is retried by another worker
+EMAIL_OUTBOX_MAX_ATTEMPTS = 6
+EMAIL_OUTBOX_RETRY_BACKOFF = 5  # Seconds before the first retry, doubling after each
+EMAIL_RATE_LIMIT = 5  # Emails per address per window
+EMAIL_RATE_WINDOW = 15 * 60
+EMAIL_OUTBOX_RETENTION = 24 * 3600  # Finished rows are deleted after this long; their bodies are blanked at once
+OTP_TTL = 5 * 60  # Seconds an OTP stays valid; mail that cannot go out by then is dropped
+
+# Follower graph mirrored in Redis (user_app.graph)
+FOLLOW_GRAPH_TTL = 24 * 3600  # A user's sets are reloaded from Postgres at least this often
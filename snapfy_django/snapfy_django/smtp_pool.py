@@ -0,0 +1,143 @@
+# snapfy_django/smtp_pool.py
+import queue
+import smtplib
+import threading
+import time
+import logging
+from django.conf import settings
+from django.core.mail import get_connection
+
+logger = logging.getLogger(__name__)
+
+# Bulk mail goes out over SMTP_POOL_SIZE connections, one per worker thread, each kept open for
+# every message its thread sends instead of a TLS handshake and login per message. A failed send
+# closes that connection and is retried on a fresh one after SMTP_RETRY_BACKOFF seconds, doubling,
+# up to SMTP_MAX_ATTEMPTS; rejections the server means permanently (5xx) are not retried.
+# With keep_open, a long-running sender also keeps connections between calls, for up to
+# SMTP_IDLE_TIMEOUT seconds idle, so small frequent batches do not reconnect every time.
+
+
+def is_permanent(error):
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    return isinstance(error, smtplib.SMTPResponseException) and 500 <= error.smtp_code < 600
+
+
+class SMTPPool:
+    def __init__(self, size=None, max_attempts=None, backoff=None, keep_open=False):
+        self.size = size or settings.SMTP_POOL_SIZE
+        self.max_attempts = max_attempts or settings.SMTP_MAX_ATTEMPTS
+        self.backoff = settings.SMTP_RETRY_BACKOFF if backoff is None else backoff
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.connections = 0
+        self.elapsed = 0.0
+        self.errors = {}
+        self.keep_open = keep_open
+        self.idle = []  # (connection, time it was last used), when keep_open
+
+    def send_many(self, messages):
+        """Send EmailMessages concurrently. Returns a list of booleans, whether each was delivered;
+        self.errors maps the index of each undelivered one to its last exception."""
+        results = [False] * len(messages)
+        self.errors = {}
+        if not messages:
+            return results
+        pending = queue.Queue()
+        for index, message in enumerate(messages):
+            pending.put((index, message))
+
+        started = time.monotonic()
+        workers = [
+            threading.Thread(target=self.work, args=(pending, results), daemon=True)
+            for _ in range(min(self.size, len(messages)))
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        with self.lock:
+            self.elapsed += time.monotonic() - started
+        return results
+
+    def work(self, pending, results):
+        connection = self.checkout() if self.keep_open else None
+        try:
+            while True:
+                try:
+                    index, message = pending.get_nowait()
+                except queue.Empty:
+                    return
+                connection, error = self.send(connection, message)
+                results[index] = error is None
+                if error is not None:
+                    self.errors[index] = error
+        finally:
+            if connection is not None and self.keep_open:
+                with self.lock:
+                    self.idle.append((connection, time.monotonic()))
+            elif connection is not None:
+                self.close(connection)
+
+    def checkout(self):
+        """An idle connection to reuse, or None to open a new one."""
+        while True:
+            with self.lock:
+                if not self.idle:
+                    return None
+                connection, last_used = self.idle.pop()
+            if time.monotonic() - last_used < settings.SMTP_IDLE_TIMEOUT:
+                return connection
+            self.close(connection)  # The server has likely dropped it already
+
+    def close_all(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for connection, _ in idle:
+            self.close(connection)
+
+    def send(self, connection, message):
+        """Deliver one message, reusing `connection` while it works. Returns (connection, None) once
+        delivered, or (None, the last error) once out of attempts."""
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                if connection is None:
+                    connection = get_connection(fail_silently=False)
+                    connection.open()
+                    self.count('connections')
+                message.connection = connection
+                if connection.send_messages([message]):
+                    self.count('sent')
+                    return connection, None
+                raise smtplib.SMTPException("Message was not accepted")
+            except (smtplib.SMTPException, OSError) as e:
+                self.close(connection)
+                connection = None
+                if is_permanent(e) or attempt == self.max_attempts:
+                    logger.error(f"Could not send mail to {message.to} after {attempt} attempts: {e}")
+                    self.count('failed')
+                    return None, e
+                self.count('retries')
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+
+    def close(self, connection):
+        try:
+            connection.close()
+        except Exception as e:
+            logger.warning(f"Error closing SMTP connection: {e}")
+
+    def count(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def stats(self):
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries": self.retries,
+            "connections": self.connections,
+            "seconds": round(self.elapsed, 3),
+            "per_second": round(self.sent / self.elapsed, 1) if self.elapsed else 0.0,
+        }
@@ -0,0 +1,187 @@
+# snapfy_django/testing.py
+import time
+import uuid
+import asyncio
+import weakref
+import threading
+import contextlib
+import socketserver
+from unittest import mock
+import fakeredis
+import fakeredis.aioredis
+import redis.asyncio
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework_simplejwt.tokens import AccessToken
+
+# Tests never need the Redis in REDIS_URL: FakeRedisMixin gives every test its own in-process
+# fakeredis server, shared by the django_redis cache (get_redis_connection), the async pool the
+# consumers borrow from (snapfy_django.redis_pool) and nothing else. Channel layers run in memory.
+# Mail goes to an SMTPStandIn on a local port, see smtp_settings.
+
+
+class FakeRedisMixin:
+    def setUp(self):
+        super().setUp()
+        self.redis_server = fakeredis.FakeServer()
+        pools = weakref.WeakKeyDictionary()
+
+        def get_pool():
+            # One pool per event loop, like the real one
+            loop = asyncio.get_running_loop()
+            if loop not in pools:
+                pools[loop] = redis.asyncio.ConnectionPool(
+                    connection_class=fakeredis.aioredis.FakeConnection, server=self.redis_server,
+                )
+            return pools[loop]
+
+        settings = override_settings(
+            CACHES={
+                "default": {
+                    "BACKEND": "django_redis.cache.RedisCache",
+                    # django_redis keeps its pools per URL for the whole process
+                    "LOCATION": f"redis://fake-{uuid.uuid4().hex}/0",
+                    "OPTIONS": {
+                        "CLIENT_CLASS": "django_redis.client.DefaultClient",
+                        "CONNECTION_POOL_KWARGS": {
+                            "connection_class": fakeredis.FakeConnection,
+                            "server": self.redis_server,
+                        },
+                    },
+                }
+            },
+            CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        patcher = mock.patch('snapfy_django.redis_pool.get_pool', get_pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+async def connect_socket(consumer, path, user=None, params=""):
+    """A connected WebsocketCommunicator for `consumer`, authenticated as `user` when given. `consumer`
+    may also be an ASGI application, e.g. a URLRouter for consumers that read their url_route."""
+    query = params
+    if user is not None:
+        token = await database_sync_to_async(lambda: str(AccessToken.for_user(user)))()
+        query = f"token={token}" + (f"&{params}" if params else "")
+    application = consumer.as_asgi() if hasattr(consumer, "as_asgi") else consumer
+    communicator = WebsocketCommunicator(application, f"{path}?{query}" if query else path)
+    connected, _ = await communicator.connect()
+    assert connected, f"{getattr(consumer, '__name__', consumer)} refused the connection"
+    return communicator
+
+
+async def receive_all(communicator, timeout=0.2):
+    """Every frame the socket sends until it has been quiet for `timeout` seconds."""
+    frames = []
+    while not await communicator.receive_nothing(timeout=timeout):
+        frames.append(await communicator.receive_json_from())
+    return frames
+
+
+@contextlib.asynccontextmanager
+async def capture_queries():
+    """CaptureQueriesContext for async tests. The connection only resolves to the test's own one
+    inside database_sync_to_async, so the captured SQL is copied into the yielded list on exit."""
+    context = CaptureQueriesContext(connection)
+    queries = []
+    await database_sync_to_async(context.__enter__)()
+    try:
+        yield queries
+    finally:
+        await database_sync_to_async(context.__exit__)(None, None, None)
+        queries.extend(query["sql"] for query in await database_sync_to_async(lambda: context.captured_queries)())
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for Django's backend: no TLS, no auth, every command but MAIL, RCPT and DATA accepted."""
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+        self.wfile.flush()
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        self.reply("220 stand-in ready")
+        recipients = []
+        while line := self.rfile.readline():
+            command = line.decode().strip()
+            verb = command.split(" ", 1)[0].upper()
+            if verb in ("EHLO", "HELO"):
+                self.reply("250 stand-in")
+            elif verb == "MAIL":
+                with server.lock:
+                    server.transactions += 1
+                    drop = server.transactions in server.drop_on
+                if drop:
+                    return  # The connection dies mid-transaction
+                recipients = []
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                address = command.split(":", 1)[1].strip(" <>")
+                if address in server.reject:
+                    self.reply("550 No such user")
+                else:
+                    recipients.append(address)
+                    self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = []
+                while (chunk := self.rfile.readline()) not in (b".\r\n", b""):
+                    data.append(chunk)
+                time.sleep(server.latency)
+                with server.lock:
+                    server.messages.append((recipients, b"".join(data).decode()))
+                self.reply("250 Queued")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("250 OK")
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    """A local SMTP server that takes `latency` seconds per message, refuses the addresses in `reject`
+    (550) and drops the connection on the transactions numbered in `drop_on`. Accepted mail is in
+    `messages` as (recipients, raw message)."""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, latency=0.0, reject=(), drop_on=()):
+        super().__init__(("127.0.0.1", 0), _SMTPHandler)
+        self.latency = latency
+        self.reject = set(reject)
+        self.drop_on = set(drop_on)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.transactions = 0
+        self.messages = []
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def sent_to(self, address):
+        return [message for recipients, message in self.messages if address in recipients]
+
+
+def smtp_settings(server):
+    """override_settings sending Django's mail to `server`."""
+    return override_settings(
+        EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+        EMAIL_HOST='127.0.0.1',
+        EMAIL_PORT=server.server_address[1],
+        EMAIL_USE_TLS=False,
+        EMAIL_HOST_USER='',
+        EMAIL_HOST_PASSWORD='',
+        DEFAULT_FROM_EMAIL='noreply@snapfy.test',
+    )
+
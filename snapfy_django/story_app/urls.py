@@ -12,6 +12,7 @@ urlpatterns = [
     path('live/<int:live_id>/', LiveStreamDetailView.as_view(), name='live-stream-detail'),
     path('live/<int:live_id>/join/', LiveStreamJoinView.as_view(), name='live-stream-join'),
     path('live/<int:live_id>/leave/', LiveStreamLeaveView.as_view(), name='live-stream-leave'),
+    path('live/<int:live_id>/fanout/', LiveStreamFanoutView.as_view(), name='live-stream-fanout'),
 ]
 
 websocket_urlpatterns = [
@@ -15,7 +15,7 @@ import cloudinary.uploader
 from user_app.models import User, BlockedUser
 from .serializers import StorySerializer, StoryViewerSerializer, MusicTrackSerializer, LiveStreamSerializer
 from django.db.models import Q
-from notification_app.utils import create_live_notification
+from notification_app.fanout import start_live_fanout, fanout_progress
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 from channels.db import database_sync_to_async
@@ -251,27 +251,31 @@ class LiveStreamView(APIView):
             is_active=True
         )
 
-        # Notify followers
-        followers = request.user.followers.all()
-        for follower in followers:
-            # Skip if follower has blocked the host
-            if BlockedUser.objects.filter(blocker=follower, blocked=request.user).exists():
-                continue
-            create_live_notification(follower, request.user, live_stream.id)
+        # Notify followers, in chunks off the request (notification_app.fanout)
+        start_live_fanout(live_stream)
 
         # Notify global listeners
+        live_stream_data = LiveStreamSerializer(live_stream, context={'request': request}).data
         async_to_sync(channel_layer.group_send)(
             'live_global',
             {
                 'type': 'live_stream_update',
-                'live_stream': LiveStreamSerializer(live_stream, context={'request': request}).data
+                'live_stream': live_stream_data
             }
         )
 
-        return Response(
-            LiveStreamSerializer(live_stream, context={'request': request}).data,
-            status=status.HTTP_201_CREATED
-        )
+        return Response(live_stream_data, status=status.HTTP_201_CREATED)
+
+class LiveStreamFanoutView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, live_id):
+        if not LiveStream.objects.filter(id=live_id, host=request.user).exists():
+            return Response({"error": "Live stream not found or not yours"}, status=status.HTTP_404_NOT_FOUND)
+        progress = fanout_progress(live_id)
+        if progress is None:
+            return Response({"error": "No follower notifications recorded for this stream"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(progress)
 
 class LiveStreamDetailView(APIView):
     permission_classes = [IsAuthenticated]
@@ -5,4 +5,4 @@ from .models import *
 
 admin.site.register(User)
 admin.site.register(Report)
-admin.site.register(BlockedUser)
\ No newline at end of file
+admin.site.register(BlockedUser)
@@ -0,0 +1,147 @@
+# user_app/email_outbox.py
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+from snapfy_django.smtp_pool import is_permanent
+from .models import OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+# Requests never talk to SMTP: queue_email() writes an OutboundEmail row, in the request's own
+# transaction, and the send_emails worker delivers it. A row is claimed by setting it to `sending`
+# with next_attempt_at as the claim's expiry, so mail a crashed worker was holding is picked up
+# again. Failures back off EMAIL_OUTBOX_RETRY_BACKOFF seconds, doubling, until
+# EMAIL_OUTBOX_MAX_ATTEMPTS; an address past EMAIL_RATE_LIMIT mails per EMAIL_RATE_WINDOW waits,
+# without using up an attempt. Mail with an expires_at (OTPs) that cannot go out before it is dropped
+# as `expired` instead of waiting: a late code is useless. Bodies can hold OTPs, so they are blanked
+# as soon as a row is finished, and finished rows are deleted after EMAIL_OUTBOX_RETENTION.
+FINISHED = ('sent', 'failed', 'expired')
+
+
+def queue_email(kind, to, subject, body, html="", expires_at=None):
+    return OutboundEmail.objects.create(kind=kind, to=to, subject=subject, body=body, html=html, expires_at=expires_at)
+
+
+def supersede(kind, to):
+    """Drop queued `kind` mail to `to`, about to be replaced by a newer one. Mail already being sent is left alone."""
+    return finish(OutboundEmail.objects.filter(kind=kind, to=to, status='queued'), 'expired', last_error="Superseded")
+
+
+def finish(emails, status, **fields):
+    """Mark a queryset of emails finished, blanking what they carried."""
+    return emails.update(status=status, body="", html="", **fields)
+
+
+def outlives(email, delay):
+    """Whether `email` is still worth sending `delay` seconds from now."""
+    return email.expires_at is None or timezone.now() + timedelta(seconds=delay) < email.expires_at
+
+
+def prune_finished():
+    """Delete finished rows past EMAIL_OUTBOX_RETENTION. Returns how many."""
+    cutoff = timezone.now() - timedelta(seconds=settings.EMAIL_OUTBOX_RETENTION)
+    return OutboundEmail.objects.filter(status__in=FINISHED, created_at__lt=cutoff).delete()[0]
+
+
+def email_message(email):
+    message = EmailMultiAlternatives(subject=email.subject, body=email.body, from_email=settings.DEFAULT_FROM_EMAIL, to=[email.to])
+    if email.html:
+        message.attach_alternative(email.html, "text/html")
+    return message
+
+
+def claim_due(batch_size):
+    """Mark up to batch_size due emails as sending and return them. skip_locked lets several workers
+    poll at once without claiming the same rows."""
+    now = timezone.now()
+    with transaction.atomic():
+        emails = list(
+            OutboundEmail.objects.select_for_update(skip_locked=True)
+            .filter(Q(status='queued') | Q(status='sending'), next_attempt_at__lte=now)
+            .order_by('next_attempt_at')[:batch_size]
+        )
+        OutboundEmail.objects.filter(id__in=[email.id for email in emails]).update(
+            status='sending', next_attempt_at=now + timedelta(seconds=settings.EMAIL_OUTBOX_CLAIM_TIMEOUT),
+        )
+    return emails
+
+
+def rate_limited(addresses):
+    """{address: seconds until it may be mailed again} for the addresses over their limit, counting
+    one send against every address that is not."""
+    if not addresses:
+        return {}
+    try:
+        redis = get_redis_connection("default")
+        pipe = redis.pipeline(transaction=False)
+        for address in addresses:
+            key = f"email_rate:{address.lower()}"
+            pipe.set(key, 0, ex=settings.EMAIL_RATE_WINDOW, nx=True)  # Starts the window on the first send
+            pipe.incr(key)
+            pipe.ttl(key)
+        replies = pipe.execute()
+    except RedisError as e:
+        logger.warning(f"Email rate limiter unavailable, sending without it: {e}")
+        return {}
+    limited = {}
+    for address, count, ttl in zip(addresses, replies[1::3], replies[2::3]):
+        if count > settings.EMAIL_RATE_LIMIT:
+            limited[address] = max(ttl, 1)
+    return limited
+
+
+def deliver_due(pool, batch_size=None):
+    """Claim a batch, send it over `pool` and record the outcome. Returns (sent, failed, deferred, expired)."""
+    emails = claim_due(batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE)
+    if not emails:
+        return 0, 0, 0, 0
+    now = timezone.now()
+    expired = [email.id for email in emails if not outlives(email, 0)]
+    emails = [email for email in emails if email.id not in expired]
+    limited = rate_limited([email.to for email in emails])
+    deferred = 0
+    for email in emails:
+        if email.to not in limited:
+            continue
+        if not outlives(email, limited[email.to]):
+            expired.append(email.id)  # It would only arrive once its code no longer works
+            continue
+        deferred += 1
+        OutboundEmail.objects.filter(id=email.id).update(
+            status='queued', next_attempt_at=now + timedelta(seconds=limited[email.to]), last_error="Rate limited",
+        )
+    finish(OutboundEmail.objects.filter(id__in=expired), 'expired', last_error="Expired before it could be sent")
+
+    sending = [email for email in emails if email.to not in limited]
+    results = pool.send_many([email_message(email) for email in sending])
+    sent, failed = [], 0
+    for index, (email, delivered) in enumerate(zip(sending, results)):
+        attempts = email.attempts + 1
+        if delivered:
+            sent.append(email.id)
+            continue
+        error = pool.errors.get(index)
+        backoff = settings.EMAIL_OUTBOX_RETRY_BACKOFF * 2 ** (attempts - 1)
+        if attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS or is_permanent(error):
+            failed += 1
+            finish(OutboundEmail.objects.filter(id=email.id), 'failed', attempts=attempts, last_error=str(error))
+            logger.error(f"Giving up on {email.kind} mail {email.id} after {attempts} attempts: {error}")
+        elif not outlives(email, backoff):
+            expired.append(email.id)
+            finish(OutboundEmail.objects.filter(id=email.id), 'expired', attempts=attempts, last_error=str(error))
+        else:
+            OutboundEmail.objects.filter(id=email.id).update(
+                status='queued', attempts=attempts, last_error=str(error),
+                next_attempt_at=timezone.now() + timedelta(seconds=backoff),
+            )
+    finish(
+        OutboundEmail.objects.filter(id__in=sent), 'sent',
+        attempts=F('attempts') + 1, sent_at=timezone.now(), last_error="",
+    )
+    return len(sent), failed, deferred, len(expired)
@@ -0,0 +1,175 @@
+# user_app/graph.py
+import uuid
+import logging
+from django.conf import settings
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+from .models import User
+
+logger = logging.getLogger(__name__)
+
+# The User.followers M2M, mirrored in Redis so follow checks, counts and follower pages never load
+# a whole list:
+#   graph:followers:<user_id>   who follows the user
+#   graph:following:<user_id>   whom the user follows
+# Both are sorted sets of user ids, every score 0, so ZRANGEBYLEX pages them by id. A loaded set
+# always holds the LOADED member, which keeps an empty one from disappearing. A missing set is
+# loaded from Postgres and lives FOLLOW_GRAPH_TTL seconds; writers only touch sets that are loaded,
+# so any drift ends with the TTL. rebuild_follow_graph reloads everything. Without Redis, every
+# read falls back to Postgres.
+LOADED = ""
+
+# Through table of User.followers, where from_user is followed by to_user: for each direction,
+# the column holding the set's owner and the one holding its members
+Follow = User.followers.through
+COLUMNS = {
+    'followers': ('from_user_id', 'to_user_id'),
+    'following': ('to_user_id', 'from_user_id'),
+}
+
+
+# Adds (ARGV[1] == "1") or removes ARGV[i + 1] in KEYS[i], for each key that exists. The check and
+# the write are one step, so a set expiring in between is never recreated without TTL or LOADED.
+APPLY = """
+for i, key in ipairs(KEYS) do
+    if redis.call('EXISTS', key) == 1 then
+        if ARGV[1] == '1' then
+            redis.call('ZADD', key, 0, ARGV[i + 1])
+        else
+            redis.call('ZREM', key, ARGV[i + 1])
+        end
+    end
+end
+"""
+
+
+def graph_key(direction, user_id):
+    return f"graph:{direction}:{user_id}"
+
+
+def _edges(direction, user_ids):
+    """{user_id: [member ids]} from Postgres for one direction."""
+    owner, member = COLUMNS[direction]
+    edges = {str(user_id): [] for user_id in user_ids}
+    rows = Follow.objects.filter(**{f"{owner}__in": user_ids}).values_list(owner, member)
+    for user_id, other_id in rows.iterator():
+        edges[str(user_id)].append(str(other_id))
+    return edges
+
+
+def load(redis, direction, user_ids):
+    """Replace the sets of `user_ids` with what Postgres has."""
+    pipe = redis.pipeline()
+    for user_id, members in _edges(direction, user_ids).items():
+        key = graph_key(direction, user_id)
+        pipe.delete(key)
+        pipe.zadd(key, {member: 0 for member in [LOADED, *members]})
+        pipe.expire(key, settings.FOLLOW_GRAPH_TTL)
+    pipe.execute()
+
+
+def _ensure(redis, direction, user_id):
+    key = graph_key(direction, user_id)
+    if not redis.exists(key):
+        load(redis, direction, [user_id])
+    return key
+
+
+def _apply(add, follower_id, followee_id):
+    """Mirror one edge change onto whichever of its two sets are loaded."""
+    keys = [graph_key('followers', followee_id), graph_key('following', follower_id)]
+    members = [str(follower_id), str(followee_id)]
+    try:
+        redis = get_redis_connection("default")
+        redis.register_script(APPLY)(keys=keys, args=[int(add), *members])
+    except RedisError as e:
+        logger.warning(f"Could not update follow graph, dropping the sets instead: {e}")
+        try:
+            get_redis_connection("default").delete(*keys)
+        except RedisError:
+            logger.error(f"Follow graph sets {keys} may be stale until they expire")
+
+
+def follow(follower, followee):
+    followee.followers.add(follower)
+    _apply(True, follower.id, followee.id)
+
+
+def unfollow(follower, followee):
+    followee.followers.remove(follower)
+    _apply(False, follower.id, followee.id)
+
+
+def is_following(follower_id, followee_id):
+    try:
+        redis = get_redis_connection("default")
+        return redis.zscore(_ensure(redis, 'following', follower_id), str(followee_id)) is not None
+    except RedisError as e:
+        logger.warning(f"Follow graph unavailable, checking Postgres: {e}")
+        return Follow.objects.filter(from_user_id=followee_id, to_user_id=follower_id).exists()
+
+
+def count(direction, user_id):
+    """How many followers ('followers') or followed users ('following') the user has."""
+    try:
+        redis = get_redis_connection("default")
+        return redis.zcard(_ensure(redis, direction, user_id)) - 1  # Minus LOADED
+    except RedisError as e:
+        logger.warning(f"Follow graph unavailable, counting in Postgres: {e}")
+        owner, _ = COLUMNS[direction]
+        return Follow.objects.filter(**{owner: user_id}).count()
+
+
+def page(direction, user_id, after=None, limit=20):
+    """(up to `limit` member ids after the id `after`, in id order; the id to continue after, or None)."""
+    try:
+        redis = get_redis_connection("default")
+        key = _ensure(redis, direction, user_id)
+        ids = [member.decode() for member in redis.zrangebylex(key, f"({after or LOADED}", "+", start=0, num=limit + 1)]
+    except RedisError as e:
+        logger.warning(f"Follow graph unavailable, paging in Postgres: {e}")
+        # uuids sort the same by value as by their text, so both orders agree
+        owner, member = COLUMNS[direction]
+        rows = Follow.objects.filter(**{owner: user_id}).order_by(member)
+        if after:
+            rows = rows.filter(**{f"{member}__gt": after})
+        ids = [str(other_id) for other_id in rows.values_list(member, flat=True)[:limit + 1]]
+    if len(ids) > limit:
+        return ids[:limit], ids[limit - 1]
+    return ids, None
+
+
+def mutuals(viewer_id, user_id):
+    """Ids of `user_id`'s followers whom `viewer_id` follows, in id order."""
+    try:
+        redis = get_redis_connection("default")
+        keys = [_ensure(redis, 'followers', user_id), _ensure(redis, 'following', viewer_id)]
+        return [member.decode() for member in redis.zinter(keys) if member.decode() != LOADED]
+    except RedisError as e:
+        logger.warning(f"Follow graph unavailable, intersecting in Postgres: {e}")
+        followed = Follow.objects.filter(to_user_id=viewer_id).values('from_user_id')
+        rows = Follow.objects.filter(from_user_id=user_id, to_user_id__in=followed).order_by('to_user_id')
+        return [str(member_id) for member_id in rows.values_list('to_user_id', flat=True)]
+
+
+def users(ids):
+    """The Users of `ids`, in that order; ids of users deleted since they were cached are skipped."""
+    found = User.objects.in_bulk(ids)
+    return [found[user_id] for user_id in map(uuid.UUID, ids) if user_id in found]
+
+
+def rebuild(batch_size=1000):
+    """Reload both directions of every user from Postgres. Returns the number of users."""
+    redis = get_redis_connection("default")
+    rebuilt, after = 0, None
+    while True:
+        user_ids = User.objects.order_by('id')
+        if after:
+            user_ids = user_ids.filter(id__gt=after)
+        user_ids = list(user_ids.values_list('id', flat=True)[:batch_size])
+        if not user_ids:
+            return rebuilt
+        for direction in COLUMNS:
+            load(redis, direction, user_ids)
+        rebuilt += len(user_ids)
+        after = user_ids[-1]
@@ -0,0 +1,14 @@
+# user_app/management/commands/rebuild_follow_graph.py
+from django.core.management.base import BaseCommand
+from user_app import graph
+
+
+class Command(BaseCommand):
+    help = "Reload the Redis follow graph (user_app.graph) of every user from Postgres"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        rebuilt = graph.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(f"Rebuilt the follow graph of {rebuilt} users")
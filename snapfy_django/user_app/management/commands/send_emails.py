@@ -0,0 +1,47 @@
+# user_app/management/commands/send_emails.py
+import time
+import logging
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from snapfy_django.smtp_pool import SMTPPool
+from user_app.email_outbox import deliver_due, prune_finished
+
+logger = logging.getLogger(__name__)
+
+PRUNE_INTERVAL = 3600  # Seconds between deletions of finished rows, done while the outbox is idle
+
+
+class Command(BaseCommand):
+    help = "Deliver queued account mail (OTPs) over reused SMTP connections, with backoff and per-address rate limits"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Deliver whatever is due and exit")
+        parser.add_argument('--batch-size', type=int, default=settings.EMAIL_OUTBOX_BATCH_SIZE)
+        parser.add_argument('--connections', type=int, default=settings.SMTP_POOL_SIZE,
+                            help="Concurrent SMTP connections")
+
+    def handle(self, *args, **options):
+        # Connections stay open between polls. One quick reconnect covers a connection the server
+        # dropped while idle; anything else is retried by the outbox, with backoff.
+        pool = SMTPPool(size=options['connections'], max_attempts=2, backoff=0, keep_open=True)
+        pruned_at = float('-inf')
+        try:
+            while True:
+                try:
+                    sent, failed, deferred, expired = deliver_due(pool, options['batch_size'])
+                    if sent or failed or deferred or expired:
+                        self.stdout.write(f"Sent {sent} emails, {failed} failed, {deferred} rate limited, {expired} expired")
+                    elif options['once']:
+                        return
+                    else:
+                        if time.monotonic() - pruned_at > PRUNE_INTERVAL:
+                            pruned_at = time.monotonic()
+                            prune_finished()
+                        time.sleep(settings.EMAIL_OUTBOX_POLL)
+                except Exception as e:
+                    logger.error(f"Email delivery failed: {e}")
+                    if options['once']:
+                        return
+                    time.sleep(1)
+        finally:
+            pool.close_all()
@@ -4,6 +4,7 @@ import uuid
 from django.core.cache import cache
 from cloudinary.models import CloudinaryField
 from django.utils import timezone
+from django.conf import settings
 
 class User(AbstractUser):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4)
@@ -21,7 +22,7 @@ class User(AbstractUser):
         unique_together = [['username', 'is_verified'], ['email', 'is_verified']]
     
     def set_otp(self, otp):
-        cache.set(f'otp_{self.email}', otp, timeout=300)  # Store OTP for 5 minutes
+        cache.set(f'otp_{self.email}', otp, timeout=settings.OTP_TTL)
 
     def verify_otp(self, otp):
         stored_otp = cache.get(f'otp_{self.email}')
@@ -58,3 +59,39 @@ class Report(models.Model):
 
     def __str__(self):
         return f"Report by {self.reporter.username} against {self.reported_user.username}"
+
+
+class OutboundEmail(models.Model):
+    """Account mail waiting for, or done with, delivery by the send_emails worker."""
+    STATUSES = [
+        ('queued', 'Queued'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+        ('expired', 'Expired'),  # Dropped unsent: its content stopped being valid, or newer mail replaced it
+    ]
+    KINDS = [
+        ('otp', 'One-time password'),
+    ]
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4)
+    kind = models.CharField(max_length=20, choices=KINDS)
+    to = models.EmailField(max_length=255)
+    subject = models.CharField(max_length=255)
+    body = models.TextField()  # Blanked once the mail is finished, it may hold an OTP
+    html = models.TextField(blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)  # Not sent by then, it is dropped
+    status = models.CharField(max_length=10, choices=STATUSES, default='queued')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)  # While sending: when the claim lapses
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # The worker's poll: due mail that is not finished
+            models.Index(fields=['next_attempt_at'], condition=models.Q(status__in=['queued', 'sending']), name='outbound_email_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} mail to {self.to} ({self.status})"
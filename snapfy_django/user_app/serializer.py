@@ -2,9 +2,12 @@ from django.db import transaction
 from django.db.models import Q
 from rest_framework import serializers
 from .models import User, Report
+from . import graph
 from django.contrib.auth import authenticate
 from post_app.serializer import PostSerializer, SavedPostSerializer, ArchivedPostSerializer
 
+FOLLOW_LIST_PREVIEW = 50  # Followers and following inlined in a UserSerializer
+
 
 class UserCreateSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
@@ -119,6 +122,9 @@ class UserSerializer(serializers.ModelSerializer):
     following_count = serializers.SerializerMethodField()
     followers = serializers.SerializerMethodField()
     following = serializers.SerializerMethodField()
+    is_following = serializers.SerializerMethodField()
+    follows_you = serializers.SerializerMethodField()
+    mutual_count = serializers.SerializerMethodField()
     profile_picture = serializers.SerializerMethodField()
     blocked_users = serializers.SerializerMethodField()
     last_seen = serializers.DateTimeField(read_only=True, allow_null=True)
@@ -127,7 +133,7 @@ class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ('id', 'posts', 'is_staff', 'username', 'email', 'first_name', 'last_name', 'bio', 'profile_picture',
-                  'followers', 'following', 'is_blocked', 'is_verified', 'is_google_signIn', 'saved_posts', 'archived_posts', 'follower_count', 'following_count', 'blocked_users', 'is_online', 'last_seen')
+                  'followers', 'following', 'is_blocked', 'is_verified', 'is_google_signIn', 'saved_posts', 'archived_posts', 'follower_count', 'following_count', 'is_following', 'follows_you', 'mutual_count', 'blocked_users', 'is_online', 'last_seen')
 
     def get_posts(self, obj):
         archived_post_ids = obj.archived_posts.values_list('post_id', flat=True)
@@ -135,29 +141,48 @@ class UserSerializer(serializers.ModelSerializer):
         return PostSerializer(posts, many=True).data
     
     def get_follower_count(self, obj):
-        return obj.followers.count()
+        return graph.count('followers', obj.id)
 
     def get_following_count(self, obj):
-        return obj.following.count()
+        return graph.count('following', obj.id)
     
+    # The first FOLLOW_LIST_PREVIEW of each list; the rest is paged from users/<username>/followers/ and following/
     def get_followers(self, obj):
-        return [
-            {
-                'username': user.username,
-                'profile_picture': str(user.profile_picture) if user.profile_picture else None
-            } 
-            for user in obj.followers.all()
-        ]
+        return self.follow_preview('followers', obj)
 
     def get_following(self, obj):
+        return self.follow_preview('following', obj)
+
+    def follow_preview(self, direction, obj):
+        ids, _ = graph.page(direction, obj.id, limit=FOLLOW_LIST_PREVIEW)
         return [
             {
                 'username': user.username,
                 'profile_picture': str(user.profile_picture) if user.profile_picture else None
             } 
-            for user in obj.following.all()
+            for user in graph.users(ids)
         ]
 
+    # Relative to the requesting user, so clients need not search the lists above
+    def get_is_following(self, obj):
+        viewer = self.viewer(obj)
+        return graph.is_following(viewer.id, obj.id) if viewer else False
+
+    def get_follows_you(self, obj):
+        viewer = self.viewer(obj)
+        return graph.is_following(obj.id, viewer.id) if viewer else False
+
+    def get_mutual_count(self, obj):
+        # Followers of obj whom the viewer follows; the names are at users/<username>/mutuals/
+        viewer = self.viewer(obj)
+        return len(graph.mutuals(viewer.id, obj.id)) if viewer else 0
+
+    def viewer(self, obj):
+        request = self.context.get('request')
+        if request is None or not request.user.is_authenticated or request.user.id == obj.id:
+            return None
+        return request.user
+
     def get_profile_picture(self, obj):
         # If profile_picture exists, convert it to string (Cloudinary public ID)
         return str(obj.profile_picture) if obj.profile_picture else None
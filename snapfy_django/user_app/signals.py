@@ -4,13 +4,12 @@ from django.dispatch import receiver
 from django.utils import timezone
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
+from chat_app import presence
 
 @receiver(user_logged_in)
 def set_user_online(sender, request, user, **kwargs):
-    user.is_online = True
-    user.last_seen = timezone.now()
-    user.save()
-    print(f"User {user.username} logged in: last_seen={user.last_seen}")
+    presence.record_seen(user.id)
+    print(f"User {user.username} logged in")
     channel_layer = get_channel_layer()
     async_to_sync(channel_layer.group_send)(
         f"user_{user.id}",
@@ -18,16 +17,14 @@ def set_user_online(sender, request, user, **kwargs):
             "type": "user_status_update",
             "user_id": str(user.id),
             "is_online": True,
-            "last_seen": user.last_seen.isoformat(),
+            "last_seen": timezone.now().isoformat(),
         }
     )
 
 @receiver(user_logged_out)
 def set_user_offline(sender, request, user, **kwargs):
-    user.is_online = False
-    user.last_seen = timezone.now()
-    user.save()
-    print(f"User {user.username} logged out: last_seen={user.last_seen}")
+    presence.mark_offline(user.id)
+    print(f"User {user.username} logged out")
     channel_layer = get_channel_layer()
     async_to_sync(channel_layer.group_send)(
         f"user_{user.id}",
@@ -35,7 +32,7 @@ def set_user_offline(sender, request, user, **kwargs):
             "type": "user_status_update",
             "user_id": str(user.id),
             "is_online": False,
-            "last_seen": user.last_seen.isoformat(),
+            "last_seen": timezone.now().isoformat(),
         }
     )
 # @receiver(user_logged_out)
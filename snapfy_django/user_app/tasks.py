@@ -1,8 +1,10 @@
 import logging
-from django.core.mail import send_mail
-from django.conf import settings
 import random
 from .models import User
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from .email_outbox import queue_email, supersede
 from django.shortcuts import get_object_or_404
 
 logger = logging.getLogger(__name__)
@@ -10,7 +12,9 @@ logger = logging.getLogger(__name__)
 def generate_otp():
     return ''.join(str(random.randint(0, 9)) for _ in range(4))
 
-def send_otp_email(user_email):
+def queue_otp_email(user_email):
+    """Store a fresh OTP for user_email and queue the mail carrying it; the send_emails worker
+    delivers it. Returns the OutboundEmail, whose id the client can poll for delivery."""
     otp = generate_otp()
     logger.info(f"OTP :: {otp}")
     user = get_object_or_404(User, email=user_email)
@@ -20,29 +24,29 @@ def send_otp_email(user_email):
         logger.error(f"Failed to store OTP in Redis for {user_email}: {str(e)}")
         raise  # Re-raise to handle the error in the view
 
-    try:
-        send_mail(
-            subject="Verify Your Snapfy Account",
-            message=(
-                f"Hi there,\n\n"
-                f"Thanks for signing up with Snapfy! Your One-Time Password (OTP) is: {otp}\n\n"
-                f"Please enter this code to verify your email. It’s valid for 10 minutes.\n\n"
-                f"If you didn’t request this, feel free to ignore this email.\n\n"
-                f"Best,\nThe Snapfy Team"
-            ),
-            from_email=settings.EMAIL_HOST_USER,
-            recipient_list=[user_email],
-            fail_silently=False,
-            html_message=(
-                f"<h2>Welcome to Snapfy!</h2>"
-                f"<p>Hi there,</p>"
-                f"<p>Thanks for signing up! Your One-Time Password (OTP) is: <strong>{otp}</strong></p>"
-                f"<p>Please enter this code to verify your email. It’s valid for 5 minutes.</p>"
-                f"<p>If you didn’t request this, feel free to ignore this email.</p>"
-                f"<p>Best,<br>The Snapfy Team</p>"
-            ),
-        )
-        logger.info(f"Email sent to {user_email}")
-    except Exception as e:
-        logger.error(f"Failed to send email to {user_email}: {str(e)}")
-        raise  # Re-raise to handle the error in the view
\ No newline at end of file
+    # The stored OTP was just replaced, so mail still queued with the old one is useless
+    supersede('otp', user_email)
+    minutes = settings.OTP_TTL // 60
+    email = queue_email(
+        kind='otp',
+        to=user_email,
+        subject="Verify Your Snapfy Account",
+        body=(
+            f"Hi there,\n\n"
+            f"Thanks for signing up with Snapfy! Your One-Time Password (OTP) is: {otp}\n\n"
+            f"Please enter this code to verify your email. It’s valid for {minutes} minutes.\n\n"
+            f"If you didn’t request this, feel free to ignore this email.\n\n"
+            f"Best,\nThe Snapfy Team"
+        ),
+        html=(
+            f"<h2>Welcome to Snapfy!</h2>"
+            f"<p>Hi there,</p>"
+            f"<p>Thanks for signing up! Your One-Time Password (OTP) is: <strong>{otp}</strong></p>"
+            f"<p>Please enter this code to verify your email. It’s valid for {minutes} minutes.</p>"
+            f"<p>If you didn’t request this, feel free to ignore this email.</p>"
+            f"<p>Best,<br>The Snapfy Team</p>"
+        ),
+        expires_at=timezone.now() + timedelta(seconds=settings.OTP_TTL),
+    )
+    logger.info(f"Email to {user_email} queued as {email.id}")
+    return email
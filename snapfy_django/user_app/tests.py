@@ -1,3 +1,169 @@
-from django.test import TestCase
+import time
+from datetime import timedelta
+from unittest import mock
+from django.test import TestCase, override_settings, tag
+from django.utils import timezone
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+from rest_framework.test import APIClient
+from snapfy_django.smtp_pool import SMTPPool
+from snapfy_django.testing import FakeRedisMixin, SMTPStandIn, smtp_settings
+from . import graph
+from .email_outbox import deliver_due, prune_finished, queue_email
+from .models import OutboundEmail, User
+from .serializer import FOLLOW_LIST_PREVIEW
+from .tasks import queue_otp_email
 
-# Create your tests here.
+
+class EmailOutboxTestCase(FakeRedisMixin, TestCase):
+    LATENCY = 0.05  # Seconds the stand-in spends on each message, like a remote relay
+
+    def setUp(self):
+        super().setUp()
+        self.server = SMTPStandIn(latency=self.LATENCY)
+        self.addCleanup(self.server.stop)
+        mail = smtp_settings(self.server)
+        mail.enable()
+        self.addCleanup(mail.disable)
+        self.client = APIClient()
+
+    def make_user(self, username):
+        return User.objects.create(username=username, email=f"{username}@example.com")
+
+    def deliver(self):
+        return deliver_due(SMTPPool(size=4), batch_size=1000)
+
+
+@tag('load')
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class SignupLatencyTests(EmailOutboxTestCase):
+    SIGNUPS = 200
+
+    def test_signup_latency_does_not_include_smtp(self):
+        timings = []
+        for i in range(self.SIGNUPS):
+            started = time.perf_counter()
+            response = self.client.post("/api/register/", {
+                "username": f"user{i}", "email": f"user{i}@example.com", "password": "s3cret-pass",
+            })
+            timings.append(time.perf_counter() - started)
+            self.assertEqual(response.status_code, 201)
+        timings.sort()
+        p99 = timings[int(len(timings) * 0.99) - 1]
+        print(f"\nsignup p99 {p99 * 1000:.1f}ms, SMTP {self.LATENCY * 1000:.0f}ms per message")
+
+        self.assertEqual(self.server.messages, [])  # Nothing was sent inside a request
+        self.assertLess(p99, self.LATENCY)
+        self.assertEqual(self.deliver(), (self.SIGNUPS, 0, 0, 0))
+        self.assertEqual(len(self.server.messages), self.SIGNUPS)
+        email_id = response.data["email_id"]
+        status = self.client.get(f"/api/email-status/{email_id}/", {"email": f"user{self.SIGNUPS - 1}@example.com"})
+        self.assertEqual(status.data["status"], "sent")
+
+
+class OTPMailTests(EmailOutboxTestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = self.make_user("alice")
+
+    def test_sent_mail_keeps_no_otp(self):
+        email = queue_otp_email(self.alice.email)
+        self.assertIn("OTP", email.body)
+        self.assertEqual(self.deliver(), (1, 0, 0, 0))
+        [message] = self.server.sent_to(self.alice.email)
+        self.assertIn("valid for 5 minutes", message)
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.body, email.html), ("sent", "", ""))
+
+    def test_a_new_otp_supersedes_the_queued_one(self):
+        first, second = queue_otp_email(self.alice.email), queue_otp_email(self.alice.email)
+        self.assertEqual(self.deliver(), (1, 0, 0, 0))
+        first.refresh_from_db()
+        self.assertEqual((first.status, first.body), ("expired", ""))
+        self.assertEqual(OutboundEmail.objects.get(id=second.id).status, "sent")
+
+    @override_settings(EMAIL_RATE_LIMIT=1)
+    def test_rate_limited_otps_are_dropped_not_deferred(self):
+        queue_email("welcome", self.alice.email, "Hi", "Body")
+        self.assertEqual(self.deliver(), (1, 0, 0, 0))
+        otp = queue_otp_email(self.alice.email)
+        other = queue_email("welcome", self.alice.email, "Hi again", "Body")
+        # The window outlasts the OTP, so only the mail without an expiry waits for it
+        self.assertEqual(self.deliver(), (0, 0, 1, 1))
+        otp.refresh_from_db()
+        self.assertEqual((otp.status, otp.body), ("expired", ""))
+        self.assertEqual(OutboundEmail.objects.get(id=other.id).status, "queued")
+        self.assertEqual(len(self.server.sent_to(self.alice.email)), 1)
+
+    def test_mail_past_its_expiry_is_not_sent(self):
+        queue_email("otp", self.alice.email, "Code", "1234", expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.deliver(), (0, 0, 0, 1))
+        self.assertEqual(self.server.messages, [])
+
+    @override_settings(EMAIL_OUTBOX_RETENTION=60)
+    def test_finished_rows_are_pruned(self):
+        queue_otp_email(self.alice.email)
+        queued = queue_email("welcome", self.alice.email, "Hi", "Body")
+        self.deliver()
+        queue_email("welcome", self.alice.email, "Later", "Body")
+        OutboundEmail.objects.update(created_at=timezone.now() - timedelta(minutes=2))
+        OutboundEmail.objects.filter(id=queued.id).update(status="queued")
+        self.assertEqual(prune_finished(), 1)
+        self.assertEqual(OutboundEmail.objects.filter(status="queued").count(), 2)
+
+    def test_status_is_only_shown_to_the_recipient(self):
+        email = queue_otp_email(self.alice.email)
+        url = f"/api/email-status/{email.id}/"
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.get(url, {"email": "bob@example.com"}).status_code, 404)
+        self.assertEqual(self.client.get(url, {"email": "Alice@example.com"}).data["status"], "queued")
+
+        self.client.force_authenticate(self.make_user("bob"))
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.client.force_authenticate(self.alice)
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.client.force_authenticate(User.objects.create(username="admin", email="admin@example.com", is_staff=True))
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class FollowGraphTests(FakeRedisMixin, TestCase):
+    def test_writes_only_touch_loaded_sets(self):
+        alice = User.objects.create(username="alice", email="alice@example.com")
+        bob = User.objects.create(username="bob", email="bob@example.com")
+        redis = get_redis_connection("default")
+        self.assertEqual(graph.count('followers', bob.id), 0)  # Loads bob's followers only
+
+        graph.follow(alice, bob)
+        followers = graph.graph_key('followers', bob.id)
+        self.assertEqual(graph.page('followers', bob.id), ([str(alice.id)], None))
+        self.assertGreater(redis.ttl(followers), 0)
+        # alice's following set was never loaded, so it is not started without TTL or LOADED
+        self.assertFalse(redis.exists(graph.graph_key('following', alice.id)))
+
+        redis.delete(followers)  # Expired
+        graph.unfollow(alice, bob)
+        self.assertFalse(redis.exists(followers))
+        self.assertEqual(graph.count('followers', bob.id), 0)
+        self.assertFalse(graph.is_following(alice.id, bob.id))
+
+    def test_mutuals_are_not_limited_to_the_inlined_lists(self):
+        viewer = User.objects.create(username="viewer", email="viewer@example.com")
+        star = User.objects.create(username="star", email="star@example.com")
+        fans = User.objects.bulk_create(
+            User(username=f"fan{i}", email=f"fan{i}@example.com") for i in range(FOLLOW_LIST_PREVIEW + 10)
+        )
+        star.followers.add(*fans)
+        viewer.following.add(*fans[-5:])  # viewer follows five of them
+        graph.follow(viewer, star)
+        client = APIClient()
+        client.force_authenticate(viewer)
+
+        profile = client.get("/api/users/star/").data
+        self.assertEqual(len(profile["followers"]), FOLLOW_LIST_PREVIEW)
+        self.assertEqual((profile["follower_count"], profile["is_following"], profile["mutual_count"]), (len(fans) + 1, True, 5))
+        mutuals = client.get("/api/users/star/mutuals/").data
+        self.assertEqual(mutuals["count"], 5)
+        self.assertEqual(sorted(user["username"] for user in mutuals["results"]), sorted(fan.username for fan in fans[-5:]))
+        # Postgres gives the same answer while Redis is away
+        with mock.patch.object(graph, "get_redis_connection", side_effect=RedisError):
+            self.assertEqual(graph.mutuals(viewer.id, star.id), sorted(str(fan.id) for fan in fans[-5:]))
@@ -6,6 +6,7 @@ urlpatterns = [
    path('register/', views.RegisterUserView.as_view(), name='register'),
     path('verify-otp/', views.VerifyOTPView.as_view(), name='verify-otp'),
     path('resend-otp/', views.ResendOTPView.as_view(), name='resend-otp'),
+    path('email-status/<uuid:email_id>/', views.EmailStatusView.as_view(), name='email-status'),
     path('login/', views.LoginView.as_view(), name='login'),
     path('logout/', views.logout_view, name='logout'),
     path('verify-auth/', views.verify_auth, name='verify-auth'),
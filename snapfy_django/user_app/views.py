@@ -11,22 +11,28 @@ from rest_framework_simplejwt.views import TokenRefreshView
 from rest_framework.parsers import MultiPartParser, FormParser
 from google.oauth2 import id_token
 from google.auth.transport import requests as google_requests
-import requests, socket
+import requests, socket, uuid
 from django.http import HttpResponse
 from django.conf import settings
+from django.db import transaction
 from django.db.models import Q
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 from django.utils import timezone
 from notification_app.utils import create_follow_notification
+from chat_app import presence
 
 from .serializer import UserSerializer, UserCreateSerializer, VerifyOTPSerializer, LoginSerializer, ResendOTPSerializer, ResetPasswordSerializer, UserProfileUpdateSerializer
-from .models import User, Report, BlockedUser
-from .tasks import send_otp_email
+from .models import User, Report, BlockedUser, OutboundEmail
+from .tasks import queue_otp_email
+from . import graph
+
+FOLLOW_PAGE_SIZE = 20
+FOLLOW_MAX_PAGE_SIZE = 100
 
 
 class UserAPIViewSet(viewsets.ModelViewSet):
-    queryset = User.objects.prefetch_related('following', 'posts').order_by('-date_joined')
+    queryset = User.objects.prefetch_related('posts').order_by('-date_joined')
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated]
     lookup_field = 'username'
@@ -57,10 +63,10 @@ class UserAPIViewSet(viewsets.ModelViewSet):
         if current_user == user_to_follow:
             return Response({"error": "You cannot follow yourself"}, status=status.HTTP_400_BAD_REQUEST)
 
-        if current_user in user_to_follow.followers.all():
+        if graph.is_following(current_user.id, user_to_follow.id):
             return Response({"error": "You already follow this user"}, status=status.HTTP_400_BAD_REQUEST)
 
-        user_to_follow.followers.add(current_user)
+        graph.follow(current_user, user_to_follow)
         serializer = self.get_serializer(user_to_follow)
 
         # Trigger follow notification
@@ -77,12 +83,65 @@ class UserAPIViewSet(viewsets.ModelViewSet):
         if current_user == user_to_unfollow:
             return Response({"error": "You cannot unfollow yourself"}, status=status.HTTP_400_BAD_REQUEST)
 
-        if current_user not in user_to_unfollow.followers.all():
+        if not graph.is_following(current_user.id, user_to_unfollow.id):
             return Response({"error": "You do not follow this user"}, status=status.HTTP_400_BAD_REQUEST)
 
-        user_to_unfollow.followers.remove(current_user)
+        graph.unfollow(current_user, user_to_unfollow)
         serializer = self.get_serializer(user_to_unfollow)
         return Response(serializer.data, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['get'])
+    def followers(self, request, username=None):
+        """Who follows this user, a page at a time: ?cursor=<next_cursor>&limit="""
+        return self.follow_page(request, 'followers')
+
+    @action(detail=True, methods=['get'])
+    def following(self, request, username=None):
+        """Whom this user follows, a page at a time: ?cursor=<next_cursor>&limit="""
+        return self.follow_page(request, 'following')
+
+    @action(detail=True, methods=['get'])
+    def mutuals(self, request, username=None):
+        """Followers of this user whom the requesting user follows: the first FOLLOW_MAX_PAGE_SIZE, and how many there are."""
+        user = self.get_object()
+        ids = graph.mutuals(request.user.id, user.id) if user != request.user else []
+        return Response({
+            "results": [
+                {
+                    'id': str(member.id),
+                    'username': member.username,
+                    'profile_picture': str(member.profile_picture) if member.profile_picture else None,
+                }
+                for member in graph.users(ids[:FOLLOW_MAX_PAGE_SIZE])
+            ],
+            "count": len(ids),
+        })
+
+    def follow_page(self, request, direction):
+        user = self.get_object()
+        try:
+            limit = max(1, min(int(request.query_params.get('limit') or FOLLOW_PAGE_SIZE), FOLLOW_MAX_PAGE_SIZE))
+        except (TypeError, ValueError):
+            return Response({"error": "limit must be a number"}, status=status.HTTP_400_BAD_REQUEST)
+        cursor = request.query_params.get('cursor')
+        if cursor:
+            try:
+                cursor = str(uuid.UUID(cursor))
+            except ValueError:
+                return Response({"error": "Invalid cursor"}, status=status.HTTP_400_BAD_REQUEST)
+
+        ids, next_cursor = graph.page(direction, user.id, after=cursor, limit=limit)
+        return Response({
+            "results": [
+                {
+                    'id': str(member.id),
+                    'username': member.username,
+                    'profile_picture': str(member.profile_picture) if member.profile_picture else None,
+                }
+                for member in graph.users(ids)
+            ],
+            "next_cursor": next_cursor,
+        })
     
 
 @api_view(['POST'])
@@ -110,9 +169,7 @@ def logout_view(request):
 
         user = request.user
         if user.is_authenticated:
-            user.is_online = False
-            user.last_seen = timezone.now()
-            user.save()
+            presence.mark_offline(user.id)
             logger.info(f"User {user.username} marked offline")
 
             channel_layer = get_channel_layer()
@@ -122,7 +179,7 @@ def logout_view(request):
                     "type": "user_status",
                     "user_id": str(user.id),
                     "is_online": False,
-                    "last_seen": user.last_seen.isoformat(),
+                    "last_seen": timezone.now().isoformat(),
                 }
             )
             logger.info("Channel update sent")
@@ -146,21 +203,11 @@ class BlockUserView(APIView):
             if BlockedUser.objects.filter(blocker=request.user, blocked=user_to_block).exists():
                 return Response({"error": f"{username} is already blocked"}, status=status.HTTP_400_BAD_REQUEST)
 
-            print(f"Before block: {user_to_block.username}’s following: {list(user_to_block.following.all())}")
-            if user_to_block in request.user.following.all():
-                request.user.following.remove(user_to_block)
-                request.user.save()
-            if request.user in user_to_block.following.all():
-                user_to_block.following.remove(request.user)  # Naruto unfollows Sanji
-                user_to_block.save()  # Persist the change
-            if request.user in user_to_block.followers.all():
-                user_to_block.followers.remove(request.user)
-                user_to_block.save()
-            if user_to_block in request.user.followers.all():
-                request.user.followers.remove(user_to_block)
-                request.user.save()
-                
-            print(f"After block: {user_to_block.username}’s following: {list(user_to_block.following.all())}")
+            # Blocking ends the follow in both directions
+            if graph.is_following(request.user.id, user_to_block.id):
+                graph.unfollow(request.user, user_to_block)
+            if graph.is_following(user_to_block.id, request.user.id):
+                graph.unfollow(user_to_block, request.user)
 
             BlockedUser.objects.create(blocker=request.user, blocked=user_to_block)
             
@@ -202,15 +249,14 @@ class RegisterUserView(APIView):
     def post(self, request):
         serializer = UserCreateSerializer(data=request.data)
         if serializer.is_valid():
-            user = serializer.save()
             try:
-                # Call the synchronous send_otp_email function
-                send_otp_email(user.email)
-                return Response({"message": "OTP sent to email."}, status=status.HTTP_201_CREATED)
+                # The account and its OTP mail are created together; the send_emails worker delivers it
+                with transaction.atomic():
+                    user = serializer.save()
+                    email = queue_otp_email(user.email)
+                return Response({"message": "OTP sent to email.", "email_id": str(email.id)}, status=status.HTTP_201_CREATED)
             except Exception as e:
-                logger.error(f"Failed to send OTP email to {user.email}: {str(e)}")
-                # delete the user if email sending fails to avoid unverified accounts
-                user.delete()
+                logger.error(f"Failed to queue OTP email to {request.data.get('email')}: {str(e)}")
                 return Response(
                     {"message": "Failed to send OTP email. Please try again."},
                     status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -244,11 +290,10 @@ class ResendOTPView(APIView):
         if serializer.is_valid():
             email = serializer.validated_data['email']
             try:
-                # Call the synchronous send_otp_email function
-                send_otp_email(email)
-                return Response({"message": "OTP has been sent to your email."}, status=status.HTTP_200_OK)
+                queued = queue_otp_email(email)
+                return Response({"message": "OTP has been sent to your email.", "email_id": str(queued.id)}, status=status.HTTP_200_OK)
             except Exception as e:
-                logger.error(f"Failed to send OTP email to {email}: {str(e)}")
+                logger.error(f"Failed to queue OTP email to {email}: {str(e)}")
                 return Response(
                     {"message": "Failed to send OTP email. Please try again."},
                     status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -256,6 +301,28 @@ class ResendOTPView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class EmailStatusView(APIView):
+    """Delivery state of a queued email, by the email_id signup and resend-otp return. Signed-in users
+    see mail to their own address (staff see any); before signing in, the caller must also pass the
+    address it was sent to as ?email=. Anything else is a 404, so ids cannot be probed."""
+    permission_classes = [AllowAny]
+
+    def get(self, request, email_id):
+        email = get_object_or_404(OutboundEmail, id=email_id)
+        if request.user.is_authenticated:
+            allowed = request.user.is_staff or email.to.lower() == request.user.email.lower()
+        else:
+            allowed = email.to.lower() == request.query_params.get('email', '').strip().lower()
+        if not allowed:
+            return Response({"error": "Not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response({
+            "email_id": str(email.id),
+            "status": email.status,
+            "attempts": email.attempts,
+            "sent_at": email.sent_at,
+        }, status=status.HTTP_200_OK)
+
+
 class LoginView(APIView):
     permission_classes = [AllowAny]
     
@@ -264,9 +331,7 @@ class LoginView(APIView):
         if serializer.is_valid():
             user = serializer.validated_data['user']
             refresh = RefreshToken.for_user(user)
-            user.is_online = True
-            user.last_seen = timezone.now()
-            user.save()
+            presence.record_seen(user.id)
             channel_layer = get_channel_layer()
             async_to_sync(channel_layer.group_send)(
                 f"user_{user.id}",
@@ -274,7 +339,7 @@ class LoginView(APIView):
                     "type": "user_status_update",
                     "user_id": str(user.id),
                     "is_online": True,
-                    "last_seen": user.last_seen.isoformat(),
+                    "last_seen": timezone.now().isoformat(),
                 }
             )
             response = Response({
@@ -353,9 +418,7 @@ class GoogleLoginView(APIView):
                     is_verified=True
                 )
             refresh = RefreshToken.for_user(user)
-            user.is_online = True
-            user.last_seen = timezone.now()
-            user.save()
+            presence.record_seen(user.id)
             channel_layer = get_channel_layer()
             async_to_sync(channel_layer.group_send)(
                 f"user_{user.id}",
@@ -363,7 +426,7 @@ class GoogleLoginView(APIView):
                     "type": "user_status_update",
                     "user_id": str(user.id),
                     "is_online": True,
-                    "last_seen": user.last_seen.isoformat(),
+                    "last_seen": timezone.now().isoformat(),
                 }
             )
             response = Response({
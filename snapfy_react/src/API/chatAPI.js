@@ -12,6 +12,20 @@ export const getMessages = async (conversationId) => {
   }
 };
 
+// One page of a room's history, oldest first: { results, next_cursor }. Without a cursor it is the newest
+// page; pass next_cursor to get the page before it, including months archived out of the message table.
+export const getMessageHistory = async (conversationId, cursor) => {
+  try {
+    const response = await axiosInstance.get(`/chatrooms/${conversationId}/history/`, {
+      params: cursor ? { cursor } : {},
+    });
+    return response.data;
+  } catch (error) {
+    console.error('Error fetching message history:', error);
+    throw error;
+  }
+};
+
 export const sendMessage = async (roomId, content, file) => {
   const formData = new FormData();
   if (content) formData.append('content', content);
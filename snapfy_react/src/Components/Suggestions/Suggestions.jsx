@@ -120,11 +120,11 @@ const Suggestions = () => {
     const retrieveUsers = async () => {
       try {
         const response = await getAllUser();
-        const followingUsernames = (user?.following || []).map(f => f.username);
         const blockedUsernames = user?.blocked_users || [];
+        // is_following is relative to us and complete; user.following only inlines the first few
         const filteredUsers = response
           .filter((s) => s.username !== user?.username)
-          .filter((s) => !followingUsernames.includes(s.username))
+          .filter((s) => !s.is_following)
           .filter((s) => !followedUsers.includes(s.username))
           .filter((s) => !blockedUsernames.includes(s.username));
         const shuffledUsers = shuffleArray(filteredUsers);
@@ -155,7 +155,7 @@ const Suggestions = () => {
       dispatch(showToast({ message: `Now following ${username}`, type: 'success' }));
       const updatedUser = { 
         ...user, 
-        following: [...(user.following || []), { username, profile_picture: null }] 
+        following_count: (user.following_count || 0) + 1
       };
       dispatch(setUser(updatedUser));
       setFollowedUsers((prev) => [...prev, username]);
@@ -172,13 +172,10 @@ const Suggestions = () => {
   };
 
   const getSuggestionInfo = (suggestion) => {
-    const suggestionFollowers = (suggestion.followers || []).map(f => f.username);
-    const userFollowing = (user?.following || []).map(f => f.username);
-    const mutualFollowers = suggestionFollowers.filter((follower) =>
-      userFollowing.includes(follower)
-    ).length;
-    const isFollowingMe = (suggestion.following || []).some(f => f.username === user?.username);
-    const isAlreadyFollowing = userFollowing.includes(suggestion.username);
+    // All relative to the logged-in user, computed on the server over the full follow graph
+    const mutualFollowers = suggestion.mutual_count || 0;
+    const isFollowingMe = suggestion.follows_you || false;
+    const isAlreadyFollowing = suggestion.is_following || false;
     return { mutualFollowers, isFollowingMe, isAlreadyFollowing };
   };
 
@@ -42,13 +42,30 @@ const ProfilePage = ({ isLoggedInUser, userData: initialUserData, onPostDeleted,
     } else {
       userList = (type === 'followers' ? userData?.followers : userData?.following) || [];
     }
-    const formattedList = userList.map(user => ({
+    const formatList = (list) => list.map(user => ({
       id: user?.username,
       username: user?.username,
       profile_picture: user.profile_picture ? `${CLOUDINARY_ENDPOINT}${user.profile_picture}` : '/default-profile.png'
     }));
-    setFollowList(formattedList);
+    setFollowList(formatList(userList));
     setShowFollowModal(type || 'mutual followers'); // Use type or default to 'mutual followers'
+    if (!customList && type) loadFullFollowList(type, formatList);
+  };
+
+  // The profile only inlines the first few followers/following; page through the rest when the list is opened
+  const loadFullFollowList = async (type, formatList) => {
+    try {
+      let all = [];
+      let cursor = null;
+      do {
+        const response = await axiosInstance.get(`users/${userData?.username}/${type}/`, { params: { limit: 100, cursor } });
+        all = [...all, ...response.data.results];
+        cursor = response.data.next_cursor;
+        setFollowList(formatList(all));
+      } while (cursor);
+    } catch (error) {
+      console.error(`Error fetching ${type}:`, error);
+    }
   };
 
   const closeModal = () => {
@@ -197,7 +214,8 @@ const OtherUserProfile = ({ userData, onUserUpdate, fetchFollowList }) => {
   
         console.log(`${updatedLoggedInUser?.username} following:`, updatedLoggedInUser.following);
         console.log(`${userData?.username} username:`, userData?.username);
-        const isUserFollowing = updatedLoggedInUser.following?.some(f => f?.username === userData?.username) || false;
+        // is_following/follows_you come from the server; the inlined lists only hold the first few users
+        const isUserFollowing = userData?.is_following || false;
         console.log('isUserFollowing:', isUserFollowing);
   
         const isUserBlocked = updatedLoggedInUser.blocked_users?.includes(userData?.username) || false;
@@ -210,21 +228,17 @@ const OtherUserProfile = ({ userData, onUserUpdate, fetchFollowList }) => {
           setFollowerCount(userData?.followerCount || userData?.follower_count);
         }
   
-        const isFollowedBack = userData?.following?.some(f => f?.username === user?.username) || false;
+        const isFollowedBack = userData?.follows_you || false;
         if (isMounted) setFollowsBack(isFollowedBack);
   
-        const loggedInFollowing = (updatedLoggedInUser.following || []).map(f => f?.username);
-        const profileFollowers = (userData.followers || []).map(f => f?.username);
-        const mutuals = userData?.followers
-          ?.filter(follower => 
-            loggedInFollowing.includes(follower?.username) && follower?.username !== user?.username // Exclude self
-          )
-          .map(follower => ({
-            username: follower?.username,
-            profile_picture: follower.profile_picture
-              ? `${follower.profile_picture}`
-              : '/default-profile.png'
-          }));
+        // Worked out on the server: the inlined lists would miss mutuals past their first few
+        const response = await axiosInstance.get(`users/${userData?.username}/mutuals/`);
+        const mutuals = response.data.results.map(follower => ({
+          username: follower?.username,
+          profile_picture: follower.profile_picture
+            ? `${follower.profile_picture}`
+            : '/default-profile.png'
+        }));
         if (isMounted) setMutualFollowers(mutuals);
       }
     };
@@ -257,7 +271,7 @@ const OtherUserProfile = ({ userData, onUserUpdate, fetchFollowList }) => {
         dispatch(showToast({ message: `Unfollowed ${userData?.username}`, type: 'success' }));
         const updatedLoggedInUser = await getUser(user?.username);
         dispatch(setUser(updatedLoggedInUser));
-        setFollowsBack(updatedProfileUser.following?.some(f => f?.username === user?.username) || false);
+        setFollowsBack(updatedProfileUser.follows_you || false);
         setMutualFollowers(prev => prev.filter(f => f?.username !== user?.username));
       } else {
         const updatedProfileUser = await followUser(userData?.username);
@@ -267,8 +281,8 @@ const OtherUserProfile = ({ userData, onUserUpdate, fetchFollowList }) => {
         dispatch(showToast({ message: `Now following ${userData?.username}`, type: 'success' }));
         const updatedLoggedInUser = await getUser(user?.username);
         dispatch(setUser(updatedLoggedInUser));
-        setFollowsBack(updatedProfileUser.following?.some(f => f?.username === user?.username) || false);
-        if (updatedProfileUser.following?.some(f => f?.username === user?.username)) {
+        setFollowsBack(updatedProfileUser.follows_you || false);
+        if (updatedProfileUser.follows_you) {
           const newMutual = {
             username: user?.username,
             profile_picture: updatedLoggedInUser.profile_picture
@@ -294,7 +308,7 @@ const OtherUserProfile = ({ userData, onUserUpdate, fetchFollowList }) => {
         const updatedProfileUser = await getUser(userData?.username);
         onUserUpdate(updatedProfileUser);
         setFollowerCount(updatedProfileUser.follower_count);
-        setFollowsBack(updatedProfileUser.following?.some(f => f?.username === user?.username) || false);
+        setFollowsBack(updatedProfileUser.follows_you || false);
       } else {
         const response = await blockUser(userData?.username);
         setIsBlocked(true);
@@ -491,7 +505,7 @@ const OtherUserProfile = ({ userData, onUserUpdate, fetchFollowList }) => {
       <ProfileStatsCards
         posts={userData?.posts?.length}
         followers={followerCount}
-        following={userData?.following_count || userData?.following?.length}
+        following={userData?.following_count || 0}
         fetchFollowList={fetchFollowList}
       />
       <ProfileContentTabs
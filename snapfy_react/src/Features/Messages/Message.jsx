@@ -6,7 +6,7 @@ import { format } from 'date-fns';
 import Loader from '../../utils/Loader/Loader';
 import { IoCall, IoVideocam, IoInformationCircle, IoImage, IoSend, IoSearch, IoTrash, IoMic, IoMicOff, IoPersonAdd, IoPersonRemove, IoExitOutline } from 'react-icons/io5';
 import { BsEmojiSmile } from 'react-icons/bs';
-import { getMessages } from '../../API/chatAPI';
+import { getMessageHistory } from '../../API/chatAPI';
 import { CLOUDINARY_ENDPOINT } from '../../APIEndPoints';
 import axiosInstance from '../../axiosInstance';
 import groupIcon from '../../assets/group-icon.png';
@@ -70,6 +70,8 @@ function Message() {
   const [showManageGroupModal, setShowManageGroupModal] = useState(false);
   const [selectedPost, setSelectedPost] = useState(null);
   const [roomCache, setRoomCache] = useState({});
+  const [historyCursor, setHistoryCursor] = useState(null);
+  const [isLoadingOlder, setIsLoadingOlder] = useState(false);
   const [pendingSignals, setPendingSignals] = useState([]);
   const [recipientUser, setRecipientUser] = useState(null);
   const callTimerRef = useRef(null);
@@ -77,6 +79,15 @@ function Message() {
   const remoteVideoRef = useRef(null);
   const processedStreamIds = useRef(new Set());
   const isPlayingRemote = useRef(false);
+  const activeRoomRef = useRef(conversationId);
+  activeRoomRef.current = conversationId;
+
+  const toMessageItem = (msg) => ({
+    ...msg,
+    sender: { ...msg.sender, profile_picture: msg.sender.profile_picture || null },
+    key: `${msg.id}-${msg.sent_at}-${Math.random().toString(36).substr(2, 5)}`,
+    file_url: msg.file_url || null,
+  });
 
   useEffect(() => {
     if (conversationId && !selectedRoom && chatRooms) {
@@ -184,11 +195,13 @@ function Message() {
     setSelectedRoom(null);
     setRecipientUser(null);
     setInitialLoad(true);
+    setHistoryCursor(null);
 
     const fetchRoomAndMessages = async () => {
       if (roomCache[conversationId] && roomCache[conversationId].room.id === conversationId) {
         setSelectedRoom(roomCache[conversationId].room);
         setMessages(roomCache[conversationId].messages);
+        setHistoryCursor(roomCache[conversationId].historyCursor || null);
         setIsLoading(false);
         const markAsReadSignal = JSON.stringify({ type: 'mark_as_read', room_id: conversationId });
         if (socketRef.current?.readyState === WebSocket.OPEN) {
@@ -203,23 +216,19 @@ function Message() {
 
       setIsLoading(true);
       try {
-        const [roomResponse, messagesResponse, callHistoryResponse] = await Promise.all([
+        const [roomResponse, history, callHistoryResponse] = await Promise.all([
           axiosInstance.get(`/chatrooms/${conversationId}/`),
-          axiosInstance.get(`/chatrooms/${conversationId}/messages/`),
+          getMessageHistory(conversationId),
           axiosInstance.get(`/chatrooms/${conversationId}/call-history/`),
         ]);
 
         const roomData = roomResponse.data;
         setSelectedRoom(roomData);
 
-        const messageItems = (messagesResponse.data || []).map((msg) => ({
-          ...msg,
-          sender: { ...msg.sender, profile_picture: msg.sender.profile_picture || null },
-          key: `${msg.id}-${msg.sent_at}-${Math.random().toString(36).substr(2, 5)}`,
-          file_url: msg.file_url || null,
-        }));
+        const messageItems = (history.results || []).map(toMessageItem);
+        setHistoryCursor(history.next_cursor);
 
-        const callItems = (callHistoryResponse.data || []).map((call) => ({
+        const callItems = (callHistoryResponse.data?.results || []).map((call) => ({
           id: `call-${call.id}`,
           key: `call-${call.id}-${call.call_start_time}-${Math.random().toString(36).substr(2, 5)}`,
           sender: call.caller.id === user.id ? user : call.caller,
@@ -234,7 +243,7 @@ function Message() {
         setMessages(combinedMessages);
         setRoomCache((prev) => ({
           ...prev,
-          [conversationId]: { room: roomData, messages: combinedMessages },
+          [conversationId]: { room: roomData, messages: combinedMessages, historyCursor: history.next_cursor },
         }));
 
         const markAsReadSignal = JSON.stringify({ type: 'mark_as_read', room_id: conversationId });
@@ -256,6 +265,48 @@ function Message() {
     fetchRoomAndMessages();
   }, [conversationId, dispatch, user, navigate]);
 
+  const loadOlderMessages = async () => {
+    if (!historyCursor || isLoadingOlder) return;
+    const roomIdAtRequest = conversationId;
+    const chatContainer = messagesContainerRef.current;
+    const previousHeight = chatContainer?.scrollHeight || 0;
+    setIsLoadingOlder(true);
+    try {
+      const history = await getMessageHistory(roomIdAtRequest, historyCursor);
+      const olderItems = (history.results || []).map(toMessageItem);
+      const merge = (prev) => {
+        const seen = new Set(prev.map((msg) => msg.id));
+        return [...olderItems.filter((msg) => !seen.has(msg.id)), ...prev];
+      };
+      if (activeRoomRef.current === roomIdAtRequest) {
+        setMessages(merge);
+        setHistoryCursor(history.next_cursor);
+      }
+      setRoomCache((prev) => ({
+        ...prev,
+        [roomIdAtRequest]: {
+          ...prev[roomIdAtRequest],
+          messages: merge(prev[roomIdAtRequest]?.messages || []),
+          historyCursor: history.next_cursor,
+        },
+      }));
+      // Keep the message the user was looking at in place once the older page is above it
+      requestAnimationFrame(() => {
+        if (chatContainer && activeRoomRef.current === roomIdAtRequest) {
+          chatContainer.scrollTop += chatContainer.scrollHeight - previousHeight;
+        }
+      });
+    } catch (error) {
+      dispatch(showToast({ message: 'Failed to load older messages', type: 'error' }));
+    } finally {
+      setIsLoadingOlder(false);
+    }
+  };
+
+  const handleMessagesScroll = (e) => {
+    if (e.currentTarget.scrollTop < 50) loadOlderMessages();
+  };
+
   useEffect(() => {
     if (conversationId && socketRef.current?.readyState === WebSocket.OPEN) {
       const markAsReadSignal = JSON.stringify({ type: 'mark_as_read', room_id: conversationId });
@@ -297,9 +348,9 @@ function Message() {
 
       let wsUrl;
       if (process.env.NODE_ENV === 'development') {
-        wsUrl = `ws://localhost:8000/ws/user/chat/?token=${encodeURIComponent(accessToken)}`;
+        wsUrl = `ws://localhost:8000/ws/user/chat/?token=${encodeURIComponent(accessToken)}&ice_batch=1`;
       } else {
-        wsUrl = `wss://snapfy-backend-682457091521.us-central1.run.app/ws/user/chat/?token=${encodeURIComponent(accessToken)}`;
+        wsUrl = `wss://snapfy-backend-682457091521.us-central1.run.app/ws/user/chat/?token=${encodeURIComponent(accessToken)}&ice_batch=1`;
       }
 
       socketRef.current = new WebSocket(wsUrl);
@@ -460,22 +511,34 @@ function Message() {
             break;
           }
 
-          case 'mark_as_read':
-            console.log('Received mark_as_read for room:', data.room_id, 'Updated IDs:', data.updated_ids);
+          case 'mark_as_read': {
+            // A watermark: everything from others up to (last_read_sent_at, last_read_message_id) is read
+            console.log('Received mark_as_read for room:', data.room_id, 'up to message:', data.last_read_message_id);
+            const readUpTo = new Date(data.last_read_sent_at).getTime();
+            const isCovered = (msg) => {
+              const sentAt = new Date(msg.sent_at).getTime();
+              return sentAt < readUpTo || (sentAt === readUpTo && Number(msg.id) <= Number(data.last_read_message_id));
+            };
             if (String(data.room_id) === String(conversationId)) {
               setMessages((prev) =>
                 prev.map((msg) =>
-                  data.updated_ids.includes(String(msg.id)) ? { ...msg, is_read: true, read_at: data.read_at } : msg
+                  !msg.is_read && String(msg.sender?.id) !== String(data.user_id) && isCovered(msg)
+                    ? { ...msg, is_read: true, read_at: data.read_at }
+                    : msg
                 )
               );
             }
-            setChatRooms((prev) =>
-              prev.map((room) => String(room.id) === String(data.room_id) ? { ...room, unread_count: 0 } : room)
-            );
-            setSelectedRoom((prev) =>
-              prev && String(prev.id) === String(data.room_id) ? { ...prev, unread_count: 0 } : prev
-            );
+            // Watermarks are per member, only our own clears our badge
+            if (String(data.user_id) === String(user?.id)) {
+              setChatRooms((prev) =>
+                prev.map((room) => String(room.id) === String(data.room_id) ? { ...room, unread_count: 0 } : room)
+              );
+              setSelectedRoom((prev) =>
+                prev && String(prev.id) === String(data.room_id) ? { ...prev, unread_count: 0 } : prev
+              );
+            }
             break;
+          }
 
           case 'user_status':
             console.log(`User status update: ${data.user_id} is_online=${data.is_online}`);
@@ -581,6 +644,19 @@ function Message() {
             }
             break;
 
+          case 'ice_candidates':
+            if (String(data.target_user_id) === String(user.id) && peerConnectionRef.current) {
+              for (const candidate of data.candidates) {
+                try {
+                  await peerConnectionRef.current.addIceCandidate(new RTCIceCandidate(candidate));
+                } catch (error) {
+                  console.error('Error adding ICE candidate:', error);
+                }
+              }
+              console.log(`Applied ${data.candidates.length} ICE candidates`);
+            }
+            break;
+
           case 'call_ended': {
             const callKey = `${data.call_id}-${data.type}`;
             if (processedCallIds.has(callKey)) break;
@@ -1896,9 +1972,11 @@ function Message() {
                       </div>
                       <div
                         ref={messagesContainerRef}
+                        onScroll={handleMessagesScroll}
                         className="flex-1 overflow-y-auto p-4 bg-gradient-to-b from-orange-50 to-white"
                         style={{ maxHeight: 'calc(85vh - 137px)' }}
                       >
+                        {isLoadingOlder && <Loader />}
                         {isLoading ? (
                           <Loader />
                         ) : selectedRoom && messages.length ? (
@@ -7,6 +7,7 @@ import { showToast } from '../../redux/slices/toastSlice';
 import { CLOUDINARY_ENDPOINT } from '../../APIEndPoints';
 import PostPopup from '../../Components/Post/PostPopUp';
 import { useNotifications } from '../../Features/Notification/NotificationContext';
+import { notificationData } from './notificationData';
 
 const NotificationType = {
   FOLLOW: 'follow',
@@ -34,8 +35,9 @@ const NotificationItem = ({ notification, onMarkAsRead, onDelete, onOpenPost })
     return Math.floor(seconds) + "s ago";
   };
 
-  const data = JSON.parse(notification.message);
-  const { type, from_user, content, post_id, call_status, room_id, live_id } = data;
+  const data = notificationData(notification);
+  const { type, from_user, content, post_id, call_status, room_id, live_id, actor_count } = data;
+  const others = actor_count > 1 ? actor_count - 1 : 0; // Aggregated likes carry the number of distinct likers
 
   const getIcon = () => {
     switch (type) {
@@ -110,7 +112,8 @@ const NotificationItem = ({ notification, onMarkAsRead, onDelete, onOpenPost })
       case NotificationType.LIKE:
         return (
           <>
-            <span className="font-semibold text-gray-900">{from_user.username}</span> liked your post
+            <span className="font-semibold text-gray-900">{from_user.username}</span>
+            {others > 0 && ` and ${others} ${others === 1 ? 'other' : 'others'}`} liked your post
           </>
         );
       case NotificationType.COMMENT:
@@ -251,6 +254,8 @@ const NotificationItem = ({ notification, onMarkAsRead, onDelete, onOpenPost })
 const Notifications = () => {
   const [notifications, setNotifications] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [activeTab, setActiveTab] = useState('all');
   const [isPostPopupOpen, setIsPostPopupOpen] = useState(false);
   const [selectedPostId, setSelectedPostId] = useState(null);
@@ -259,12 +264,17 @@ const Notifications = () => {
   const dispatch = useDispatch();
   const navigate = useNavigate();
 
+  // Type tabs are filtered by the server so their pages fill up; 'all' and 'unread' page through everything
+  const typeParams = () => (Object.values(NotificationType).includes(activeTab) ? { type: activeTab } : {});
+
   const fetchNotifications = async () => {
     try {
       setLoading(true);
-      const response = await axiosInstance.get('notifications/');
-      setNotifications(response.data);
-      setUnreadCount(response.data.filter((n) => !n.is_read).length);
+      const response = await axiosInstance.get('notifications/', { params: typeParams() });
+      setNotifications(response.data.results);
+      setNextCursor(response.data.next_cursor);
+      const unread = await axiosInstance.get('/notifications/unread-count/');
+      setUnreadCount(unread.data.unread_count);
     } catch (error) {
       console.error('Error fetching notifications:', error);
       dispatch(showToast({ message: 'Failed to load notifications', type: 'error' }));
@@ -273,6 +283,21 @@ const Notifications = () => {
     }
   };
 
+  const loadMore = async () => {
+    if (!nextCursor) return;
+    try {
+      setLoadingMore(true);
+      const response = await axiosInstance.get('notifications/', { params: { ...typeParams(), cursor: nextCursor } });
+      setNotifications((prev) => [...prev, ...response.data.results]);
+      setNextCursor(response.data.next_cursor);
+    } catch (error) {
+      console.error('Error loading more notifications:', error);
+      dispatch(showToast({ message: 'Failed to load notifications', type: 'error' }));
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const markAsRead = async (notificationId) => {
     try {
       await axiosInstance.patch(`/notifications/${notificationId}/read/`);
@@ -345,13 +370,13 @@ const Notifications = () => {
   useEffect(() => {
     if (!user) return;
     fetchNotifications();
-  }, [user]);
+  }, [user, activeTab]);
 
   const filteredNotifications = notifications.filter((notification) => {
     if (activeTab === 'all') return true;
     if (activeTab === 'unread') return !notification.is_read;
     try {
-      const data = JSON.parse(notification.message);
+      const data = notificationData(notification);
       return data.type === activeTab;
     } catch (e) {
       return false;
@@ -489,6 +514,15 @@ const Notifications = () => {
                 onOpenPost={openPostPopup}
               />
             ))}
+            {nextCursor && (
+              <button
+                onClick={loadMore}
+                disabled={loadingMore}
+                className="w-full py-2 text-sm font-medium text-[#198754] hover:bg-gray-100 rounded-lg transition-colors disabled:opacity-50"
+              >
+                {loadingMore ? 'Loading...' : 'Load more'}
+              </button>
+            )}
           </div>
         ) : (
           <div className="flex flex-col items-center justify-center py-16">
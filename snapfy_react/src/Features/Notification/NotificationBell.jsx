@@ -6,6 +6,7 @@ import { useNotifications } from '../../Features/Notification/NotificationContex
 import { CLOUDINARY_ENDPOINT } from '../../APIEndPoints';
 import { showToast } from '../../redux/slices/toastSlice';
 import { useDispatch } from 'react-redux';
+import { notificationData } from './notificationData';
 
 const NotificationBell = () => {
   const [dropdownOpen, setDropdownOpen] = useState(false);
@@ -42,7 +43,7 @@ const NotificationBell = () => {
   }, [dropdownOpen, syncUnreadCount]);
 
   const getNotificationMessage = (notification) => {
-    const data = JSON.parse(notification.message);
+    const data = notificationData(notification);
     switch (data.type) {
       case 'follow':
         return `${data.from_user.username} started following you`;
@@ -64,7 +65,7 @@ const NotificationBell = () => {
   };
 
   const getNotificationLink = (notification) => {
-    const data = JSON.parse(notification.message);
+    const data = notificationData(notification);
     switch (data.type) {
       case 'follow':
         return `/user/${data.from_user.username}`;
@@ -83,11 +84,11 @@ const NotificationBell = () => {
   const handleNotificationClick = (notification, e) => {
     e.preventDefault();
     e.stopPropagation();
-    const data = JSON.parse(notification.message);
+    const data = notificationData(notification);
     if (data.type === 'call') {
       axiosInstance.get(`/chatrooms/${data.room_id}/call-history/`)
         .then(response => {
-          const call = response.data.find(c => String(c.id) === String(data.call_id));
+          const call = response.data.results.find(c => String(c.id) === String(data.call_id));
           if (call && call.call_status === 'ongoing' && !call.call_end_time) {
             navigate(`/messages/${data.room_id}`);
           } else {
@@ -124,7 +125,7 @@ const NotificationBell = () => {
           <div className="max-h-96 overflow-y-auto">
             {recentNotifications.length > 0 ? (
               recentNotifications.map((notification) => {
-                const data = JSON.parse(notification.message);
+                const data = notificationData(notification);
                 return (
                   <div
                     key={notification.id}
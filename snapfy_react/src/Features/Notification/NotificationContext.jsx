@@ -4,6 +4,7 @@ import { useSelector, useDispatch } from 'react-redux';
 import { useNavigate } from 'react-router-dom';
 import axiosInstance from '../../axiosInstance';
 import { showToast } from '../../redux/slices/toastSlice';
+import { notificationData } from './notificationData';
 
 const NotificationContext = createContext();
 
@@ -16,15 +17,18 @@ export const NotificationProvider = ({ children }) => {
   const navigate = useNavigate();
   const reconnectAttempts = useRef(0);
   const maxReconnectAttempts = 5;
-  const processedNotificationIds = useRef(new Set()); // Track processed notifications
+  const processedNotificationIds = useRef(new Map()); // Track processed notifications, id -> created_at
+  const lastSeq = useRef(null); // Sequence number of the newest push received, replayed from on reconnect
 
   const fetchNotifications = async () => {
     if (!user) return;
     try {
-      const response = await axiosInstance.get('/notifications/?limit=5');
-      const allNotifications = response.data;
-      setUnreadCount(allNotifications.filter(n => !n.is_read).length);
-      setRecentNotifications(allNotifications.slice(0, 5));
+      const [response, unread] = await Promise.all([
+        axiosInstance.get('/notifications/?limit=5'),
+        axiosInstance.get('/notifications/unread-count/'),
+      ]);
+      setUnreadCount(unread.data.unread_count);
+      setRecentNotifications(response.data.results);
     } catch (error) {
       console.error('Error fetching notifications:', error);
     }
@@ -32,9 +36,8 @@ export const NotificationProvider = ({ children }) => {
 
   const syncUnreadCount = async () => {
     try {
-      const response = await axiosInstance.get('/notifications/?limit=5');
-      const allNotifications = response.data;
-      setUnreadCount(allNotifications.filter(n => !n.is_read).length);
+      const response = await axiosInstance.get('/notifications/unread-count/');
+      setUnreadCount(response.data.unread_count);
     } catch (error) {
       console.error('Error syncing unread count:', error);
     }
@@ -63,12 +66,13 @@ export const NotificationProvider = ({ children }) => {
       return;
     }
 
-    // Set WebSocket URL based on environment
+    // Set WebSocket URL based on environment; `since` asks for whatever was pushed while disconnected
+    const since = lastSeq.current !== null ? `&since=${lastSeq.current}` : '';
     let wsUrl;
     if (process.env.NODE_ENV === 'development') {
-      wsUrl = `ws://localhost:8000/ws/notifications/${user.username}/?token=${encodeURIComponent(accessToken)}`;
+      wsUrl = `ws://localhost:8000/ws/notifications/${user.username}/?token=${encodeURIComponent(accessToken)}${since}`;
     } else {
-      wsUrl = `wss://snapfy-backend-682457091521.us-central1.run.app/ws/notifications/${user.username}/?token=${encodeURIComponent(accessToken)}`;
+      wsUrl = `wss://snapfy-backend-682457091521.us-central1.run.app/ws/notifications/${user.username}/?token=${encodeURIComponent(accessToken)}${since}`;
     }
 
     socketRef.current = new WebSocket(wsUrl);
@@ -76,37 +80,50 @@ export const NotificationProvider = ({ children }) => {
     socketRef.current.onopen = () => {
       console.log('WebSocket connection established (context)');
       reconnectAttempts.current = 0;
-      fetchNotifications(); // Sync on connect
+      if (!since) fetchNotifications(); // Nothing to replay from, sync the list instead
     };
 
     socketRef.current.onmessage = (e) => {
       try {
         const data = JSON.parse(e.data);
-        if (data.type === 'notification') {
+        if (data.type === 'sequence') {
+          lastSeq.current = data.seq; // Fresh connection: later pushes are numbered after this
+        } else if (data.type === 'replay_done') {
+          // Missed notifications were replayed before this; if they could not all be, refetch
+          lastSeq.current = data.seq;
+          if (data.complete) {
+            if (data.replayed) syncUnreadCount();
+          } else {
+            fetchNotifications();
+          }
+        } else if (data.type === 'notification') {
           const notification = data.notification;
-          if (processedNotificationIds.current.has(notification.id)) return; // Skip duplicates
-          processedNotificationIds.current.add(notification.id);
+          // Aggregated rows are pushed again under the same id, so replay goes by push, not by id
+          if (data.seq != null) lastSeq.current = Math.max(lastSeq.current ?? 0, data.seq);
+          // Aggregated notifications come back with the same id and a newer created_at; anything else is a duplicate
+          const seenAt = processedNotificationIds.current.get(notification.id);
+          if (seenAt === notification.created_at) return; // Skip duplicates
+          processedNotificationIds.current.set(notification.id, notification.created_at);
 
           setRecentNotifications(prev => {
-            // Avoid duplicates in recentNotifications
-            if (prev.some(n => n.id === notification.id)) return prev;
-            const updated = [notification, ...prev].slice(0, 5);
+            const updated = [notification, ...prev.filter(n => n.id !== notification.id)].slice(0, 5);
             return updated;
           });
 
-          // Only increment if not read
-          if (!notification.is_read) {
+          if (seenAt !== undefined) {
+            syncUnreadCount(); // An updated group may or may not have been read already
+          } else if (!notification.is_read) {
             setUnreadCount(prev => prev + 1);
           }
 
           // Handle call notifications
-          const notificationData = JSON.parse(notification.message);
-          if (notificationData.type === 'call') {
+          const callData = notificationData(notification);
+          if (callData.type === 'call') {
             handleCallNotification({
               type: 'call_offer',
-              caller: notificationData.from_user,
-              room_id: notificationData.room_id,
-              call_id: notificationData.call_id
+              caller: callData.from_user,
+              room_id: callData.room_id,
+              call_id: callData.call_id
             });
           }
         }
@@ -0,0 +1,19 @@
+// Notifications come with typed fields (type, from_user, target_type, target_id, extras).
+// The components render them flattened: { type, from_user, post_id | call_id | room_id | live_id, ...extras }
+const TARGET_KEYS = {
+  post: 'post_id',
+  call: 'call_id',
+  chat: 'room_id',
+  live: 'live_id',
+};
+
+export const notificationData = (notification) => {
+  const data = {
+    ...notification.extras,
+    type: notification.type,
+    from_user: notification.from_user || { username: '', profile_picture: null },
+  };
+  const targetKey = TARGET_KEYS[notification.target_type];
+  if (targetKey) data[targetKey] = notification.target_id;
+  return data;
+};
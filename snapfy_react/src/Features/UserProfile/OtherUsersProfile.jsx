@@ -79,6 +79,10 @@ const OtherUsersProfile = () => {
     last_name: userData.last_name || '',
     bio: userData.bio || '',
     posts: userData.posts || [],
+    is_following: userData.is_following,
+    follows_you: userData.follows_you,
+    mutual_count: userData.mutual_count || 0,
+    // Only the first few of each: they seed the follow list modal, which pages in the rest
     followers: userData.followers || [],
     following: userData.following || [],
     blocked_users: userData.blocked_users || [],
@@ -73,14 +73,15 @@ const UserProfile = () => {
     username: userData.username || '',
     profileImage: previewImage || '/default-profile.png',
     postCount: userData.posts?.length || 0,
-    followerCount: userData.followers?.length || 0,
-    followingCount: userData.following?.length || 0,
+    followerCount: userData.follower_count || 0,
+    followingCount: userData.following_count || 0,
     first_name: userData.first_name || '',
     last_name: userData.last_name || '',
     bio: userData.bio || '',
     posts: userData.posts || [],
     saved_posts: userData.saved_posts || [],
     archived_posts: userData.archived_posts || [],
+    // Only the first few of each: they seed the follow list modal, which pages in the rest
     followers: userData.followers || [],
     following: userData.following || [],
     blocked_users: userData.blocked_users || [],